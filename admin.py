@@ -1,5 +1,7 @@
 from django.contrib import admin
-from geosafe.models import Metadata, Analysis
+from geosafe.models import (
+    Metadata, Analysis, HarvestedCatalogue, HarvestedRecord, ImportJob,
+    ImpactFunction, ImpactFunctionCompatibility)
 
 
 # Register your models here.
@@ -18,8 +20,61 @@ class AnalysisAdmin(admin.ModelAdmin):
         'aggregation_layer',
         'extent_option',
         'impact_function_id',
+        'created',
+    )
+
+
+class HarvestedCatalogueAdmin(admin.ModelAdmin):
+    list_display = (
+        'csw_url',
+        'last_modified',
+        'last_harvested',
+    )
+
+
+class HarvestedRecordAdmin(admin.ModelAdmin):
+    list_display = (
+        'identifier',
+        'title',
+        'catalogue',
+        'modified',
+        'inasafe_layer',
+    )
+
+
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'service_type',
+        'service_id',
+        'host',
+        'state',
+        'bytes_transferred',
+        'created',
+        'finished',
+    )
+
+
+class ImpactFunctionAdmin(admin.ModelAdmin):
+    list_display = (
+        'function_id',
+        'name',
+        'last_synced',
+    )
+
+
+class ImpactFunctionCompatibilityAdmin(admin.ModelAdmin):
+    list_display = (
+        'hazard_category',
+        'exposure_category',
+        'impact_function',
     )
 
 
 admin.site.register(Metadata, MetadataAdmin)
 admin.site.register(Analysis, AnalysisAdmin)
+admin.site.register(HarvestedCatalogue, HarvestedCatalogueAdmin)
+admin.site.register(HarvestedRecord, HarvestedRecordAdmin)
+admin.site.register(ImportJob, ImportJobAdmin)
+admin.site.register(ImpactFunction, ImpactFunctionAdmin)
+admin.site.register(
+    ImpactFunctionCompatibility, ImpactFunctionCompatibilityAdmin)
@@ -5,15 +5,44 @@ from geosafe.tasks.headless.analysis import filter_impact_function
 __author__ = 'ismailsunni'
 
 import logging
+from datetime import timedelta
 
+from celery import states
 from django.forms import models
 from django import forms
+from django.utils.encoding import force_text
 from geonode.layers.models import Layer
 from geosafe.models import Analysis
 
 LOG = logging.getLogger(__name__)
 
 
+class LayerSelect(forms.Select):
+    """Select of layers rendering only the selected layer.
+
+    The page finds other layers with the layer search API, so the form
+    doesn't list every layer. Submitted values are still checked against
+    the field queryset, one layer at a time.
+    """
+
+    def render_options(self, choices, selected_choices):
+        selected_choices = set(
+            force_text(v) for v in selected_choices if v)
+        field = self.choices.field
+        output = []
+        if field.empty_label is not None:
+            output.append(self.render_option(
+                selected_choices, '', field.empty_label))
+        if selected_choices:
+            for layer in self.choices.queryset.filter(
+                    pk__in=selected_choices):
+                output.append(self.render_option(
+                    selected_choices,
+                    layer.pk,
+                    field.label_from_instance(layer)))
+        return '\n'.join(output)
+
+
 class AnalysisCreationForm(models.ModelForm):
     """A form for creating an event."""
 
@@ -40,24 +69,24 @@ class AnalysisCreationForm(models.ModelForm):
         label='Exposure Layer',
         required=True,
         queryset=Layer.objects.filter(metadata__layer_purpose='exposure'),
-        widget=forms.Select(
-            attrs={'class': 'form-control'})
+        widget=LayerSelect(
+            attrs={'class': 'form-control', 'data-purpose': 'exposure'})
     )
 
     hazard_layer = forms.ModelChoiceField(
         label='Hazard Layer',
         required=True,
         queryset=Layer.objects.filter(metadata__layer_purpose='hazard'),
-        widget=forms.Select(
-            attrs={'class': 'form-control'})
+        widget=LayerSelect(
+            attrs={'class': 'form-control', 'data-purpose': 'hazard'})
     )
 
     aggregation_layer = forms.ModelChoiceField(
         label='Aggregation Layer',
         required=False,
         queryset=Layer.objects.filter(metadata__layer_purpose='aggregation'),
-        widget=forms.Select(
-            attrs={'class': 'form-control'})
+        widget=LayerSelect(
+            attrs={'class': 'form-control', 'data-purpose': 'aggregation'})
     )
 
     impact_function_id = forms.ChoiceField(
@@ -100,6 +129,7 @@ class MetaSearchForm(forms.Form):
     class Meta:
         fields = (
             'csw_url',
+            'federated',
             'keywords',
             'user',
             'password',
@@ -108,7 +138,11 @@ class MetaSearchForm(forms.Form):
     csw_url = forms.CharField(
         label='CSW URL',
         help_text='URL to CSW endpoint',
-        required=True)
+        required=False)
+    federated = forms.BooleanField(
+        label='Search all catalogues',
+        help_text='Search every configured catalogue instead of CSW URL',
+        required=False)
     keywords = forms.CharField(
         help_text='Keywords to include in the search',
         required=False)
@@ -119,3 +153,112 @@ class MetaSearchForm(forms.Form):
         help_text='Password to connect to CSW Endpoint',
         required=False,
         widget=forms.PasswordInput(render_value=True))
+
+    def clean(self):
+        cleaned_data = super(MetaSearchForm, self).clean()
+        if not (cleaned_data.get('csw_url') or cleaned_data.get('federated')):
+            self.add_error('csw_url', 'CSW URL is required.')
+        return cleaned_data
+
+
+class AnalysisExportForm(forms.Form):
+    """Filter of analyses exported in bulk."""
+
+    user = forms.ModelChoiceField(
+        label='Author',
+        required=False,
+        queryset=Profile.objects.all(),
+        to_field_name='username')
+    date_from = forms.DateField(
+        label='From',
+        help_text='Earliest impact layer date',
+        required=False)
+    date_to = forms.DateField(
+        label='To',
+        help_text='Latest impact layer date',
+        required=False)
+    hazard_layer = forms.ModelChoiceField(
+        label='Hazard Layer',
+        required=False,
+        queryset=Layer.objects.filter(metadata__layer_purpose='hazard'))
+    keep = forms.BooleanField(
+        label='Saved analyses only',
+        required=False)
+
+    def filter(self, queryset):
+        """Filter analyses with the cleaned data.
+
+        :param queryset: analyses to filter
+        :type queryset: QuerySet
+
+        :rtype: QuerySet
+        """
+        data = self.cleaned_data
+        if data.get('user'):
+            queryset = queryset.filter(user=data['user'])
+        if data.get('date_from'):
+            queryset = queryset.filter(
+                impact_layer__date__gte=data['date_from'])
+        if data.get('date_to'):
+            # include the whole last day
+            queryset = queryset.filter(
+                impact_layer__date__lt=data['date_to'] + timedelta(days=1))
+        if data.get('hazard_layer'):
+            queryset = queryset.filter(hazard_layer=data['hazard_layer'])
+        if data.get('keep'):
+            queryset = queryset.filter(keep=True)
+        return queryset
+
+
+class AnalysisHistoryForm(forms.Form):
+    """Filter and page of the analysis history."""
+
+    user = forms.ModelChoiceField(
+        label='Author',
+        required=False,
+        queryset=Profile.objects.all(),
+        to_field_name='username')
+    state = forms.ChoiceField(
+        label='Task State',
+        required=False,
+        choices=[('', '')] + [(s, s) for s in sorted(states.ALL_STATES)])
+    hazard_layer = forms.ModelChoiceField(
+        label='Hazard Layer',
+        required=False,
+        queryset=Layer.objects.filter(metadata__layer_purpose='hazard'))
+    exposure_layer = forms.ModelChoiceField(
+        label='Exposure Layer',
+        required=False,
+        queryset=Layer.objects.filter(metadata__layer_purpose='exposure'))
+    keep = forms.NullBooleanField(
+        label='Saved analyses',
+        required=False)
+    after = forms.CharField(
+        help_text='Cursor returned with the previous page',
+        required=False)
+    limit = forms.IntegerField(
+        label='Page size',
+        required=False,
+        min_value=1)
+
+    def filter(self, queryset):
+        """Filter analyses with the cleaned data.
+
+        :param queryset: analyses to filter
+        :type queryset: QuerySet
+
+        :rtype: QuerySet
+        """
+        data = self.cleaned_data
+        if data.get('user'):
+            queryset = queryset.filter(user=data['user'])
+        if data.get('state'):
+            queryset = queryset.filter(task_state=data['state'])
+        if data.get('hazard_layer'):
+            queryset = queryset.filter(hazard_layer=data['hazard_layer'])
+        if data.get('exposure_layer'):
+            queryset = queryset.filter(
+                exposure_layer=data['exposure_layer'])
+        if data.get('keep') is not None:
+            queryset = queryset.filter(keep=data['keep'])
+        return queryset
@@ -0,0 +1,164 @@
+# coding=utf-8
+"""Bulk export of analyses as one zip archive.
+
+Every analysis gets a directory with its reports and output layer files,
+and index.csv lists the analyses with their summary statistics, taken from
+the impact data stored with each analysis. Members are read one at a time
+while the archive is streamed, and the index is built last, so memory use
+doesn't depend on the size of the files.
+"""
+import csv
+import io
+import json
+import logging
+import os
+from functools import partial
+
+from django.conf import settings
+from django.utils.text import slugify
+
+from geosafe.helpers.impact_summary.summary_base import ImpactSummary
+from geosafe.helpers.zip_stream import ZipStreamEntry, field_file_entry
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+LOGGER = logging.getLogger(__name__)
+
+INDEX_COLUMNS = [
+    'analysis_id',
+    'title',
+    'author',
+    'date',
+    'hazard_layer',
+    'exposure_layer',
+    'impact_function_id',
+    'kept',
+    'directory',
+]
+
+
+def _encode(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+class AnalysisExport(object):
+    """Zip archive of the reports and layers of several analyses."""
+
+    def __init__(self, analyses):
+        """
+        :param analyses: analyses to export, with impact layer
+        :type analyses: QuerySet
+        """
+        self.analyses = analyses
+        self.max_analyses = getattr(
+            settings, 'GEOSAFE_EXPORT_MAX_ANALYSES', 500)
+
+    def directory(self, analysis):
+        return '%d_%s' % (
+            analysis.id, slugify(analysis.impact_layer.title) or 'impact')
+
+    def analysis_entries(self, analysis):
+        """Members of the archive for one analysis.
+
+        :rtype: list(ZipStreamEntry)
+        """
+        directory = self.directory(analysis)
+        entries = []
+        if analysis.report_map:
+            entries.append(field_file_entry(
+                '%s/map.pdf' % directory, analysis.report_map))
+        if analysis.report_table:
+            entries.append(field_file_entry(
+                '%s/table.pdf' % directory, analysis.report_table))
+
+        layers = [analysis.impact_layer] + analysis.extra_output_layers()
+        for layer in layers:
+            if not layer.upload_session:
+                continue
+            for layer_file in layer.upload_session.layerfile_set.all():
+                entries.append(field_file_entry(
+                    '%s/%s' % (
+                        directory, os.path.basename(layer_file.file.name)),
+                    layer_file.file))
+        return entries
+
+    def summary(self, analysis):
+        """Summary statistics of the impact layer.
+
+        Layers are not read here, analyses without stored impact data have
+        no statistics in the index.
+
+        :return: dictionary of category and value
+        :rtype: OrderedDict
+        """
+        if not analysis.impact_data:
+            return {}
+        try:
+            impact_data = json.loads(analysis.impact_data)
+            return ImpactSummary(
+                analysis.impact_layer,
+                impact_data=impact_data).summary_dict()
+        except Exception as e:
+            LOGGER.exception(e)
+            return {}
+
+    def index(self, analyses):
+        """CSV listing the analyses and their summary statistics.
+
+        Summary categories differ between exposures, so every category
+        found becomes a column.
+
+        :return: file object of the CSV content
+        :rtype: io.BytesIO
+        """
+        rows = []
+        categories = []
+        for analysis in analyses:
+            summary = self.summary(analysis)
+            for category in summary:
+                if category not in categories:
+                    categories.append(category)
+            rows.append((analysis, summary))
+
+        output = io.BytesIO()
+        writer = csv.writer(output)
+        writer.writerow(INDEX_COLUMNS + [_encode(c) for c in categories])
+        for analysis, summary in rows:
+            writer.writerow([_encode(v) for v in [
+                analysis.id,
+                analysis.impact_layer.title,
+                analysis.user.username if analysis.user else None,
+                analysis.impact_layer.date,
+                analysis.hazard_layer.name,
+                analysis.exposure_layer.name,
+                analysis.impact_function_id,
+                analysis.keep,
+                self.directory(analysis),
+            ]] + [_encode(summary.get(c)) for c in categories])
+        output.seek(0)
+        return output
+
+    def entries(self):
+        """Members of the archive, with the index last.
+
+        :rtype: list(ZipStreamEntry)
+        """
+        analyses = list(
+            self.analyses
+            .filter(impact_layer__isnull=False)
+            .select_related(
+                'impact_layer', 'hazard_layer', 'exposure_layer', 'user')
+            .order_by('id')[:self.max_analyses])
+
+        entries = []
+        for analysis in analyses:
+            entries += self.analysis_entries(analysis)
+        entries.append(ZipStreamEntry(
+            'index.csv', partial(self.index, analyses)))
+        return entries
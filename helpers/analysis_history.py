@@ -0,0 +1,182 @@
+# coding=utf-8
+"""Browsing the history of analyses one page at a time.
+
+Analyses are listed newest first by creation time, with the id breaking
+ties. Pages use keyset pagination on the (created, id) index: the cursor
+holds the creation time and id of the last analysis returned, so a page
+costs the same wherever it is in the history, and analyses created while
+browsing don't shift the following pages.
+"""
+import base64
+import json
+import logging
+
+from django.conf import settings
+from django.db.models.query_utils import Q
+from django.utils.dateparse import parse_datetime
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+LOGGER = logging.getLogger(__name__)
+
+# columns read for each analysis of the history API
+HISTORY_COLUMNS = [
+    'id',
+    'created',
+    'user_title',
+    'user__username',
+    'task_state',
+    'keep',
+    'impact_function_id',
+    'hazard_layer_id',
+    'hazard_layer__title',
+    'exposure_layer_id',
+    'exposure_layer__title',
+    'impact_layer_id',
+    'impact_layer__title',
+]
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(created, analysis_id):
+    return base64.urlsafe_b64encode(
+        json.dumps([created.isoformat(), analysis_id]))
+
+
+def decode_cursor(cursor):
+    try:
+        created, analysis_id = json.loads(
+            base64.urlsafe_b64decode(str(cursor)))
+        created = parse_datetime(created)
+        analysis_id = int(analysis_id)
+    except (TypeError, ValueError):
+        raise InvalidCursor('Invalid cursor')
+    if not created:
+        raise InvalidCursor('Invalid cursor')
+    return created, analysis_id
+
+
+class AnalysisHistory(object):
+    """One page of analyses, newest first.
+
+    Usage::
+
+        history = AnalysisHistory(Analysis.objects.filter(keep=True))
+        page = history.page()
+        next_page = AnalysisHistory(
+            Analysis.objects.filter(keep=True), after=page['next']).page()
+    """
+
+    def __init__(self, analyses, after=None, limit=None):
+        """
+        :param analyses: filtered analyses
+        :type analyses: QuerySet
+
+        :param after: cursor returned with the previous page
+        :type after: str
+
+        :param limit: number of analyses in a page, default
+            GEOSAFE_ANALYSIS_HISTORY_PAGE_SIZE
+        :type limit: int
+
+        :raises: InvalidCursor for invalid cursor
+        """
+        max_limit = getattr(
+            settings, 'GEOSAFE_ANALYSIS_HISTORY_MAX_PAGE_SIZE', 200)
+        limit = limit or getattr(
+            settings, 'GEOSAFE_ANALYSIS_HISTORY_PAGE_SIZE', 50)
+        self.analyses = analyses
+        self.limit = max(1, min(limit, max_limit))
+        self.after = decode_cursor(after) if after else None
+
+    def queryset(self):
+        """Analyses of the page, and the first one of the next page.
+
+        :rtype: QuerySet
+        """
+        analyses = self.analyses
+        if self.after:
+            created, analysis_id = self.after
+            analyses = analyses.filter(
+                Q(created__lt=created) |
+                Q(created=created, id__lt=analysis_id))
+        # one more row tells whether there is a next page
+        return analyses.order_by('-created', '-id')[:self.limit + 1]
+
+    def split(self, rows, created, analysis_id):
+        """Rows of the page and cursor of the next page.
+
+        :param rows: rows returned by queryset
+        :type rows: list
+
+        :param created: function reading the creation time of a row
+        :type created: callable
+
+        :param analysis_id: function reading the id of a row
+        :type analysis_id: callable
+
+        :rtype: (list, str)
+        """
+        rows = list(rows)
+        if len(rows) <= self.limit:
+            return rows, None
+        rows = rows[:self.limit]
+        last = rows[-1]
+        return rows, encode_cursor(created(last), analysis_id(last))
+
+    def objects(self):
+        """Analysis objects of the page, for templates.
+
+        :return: analyses and cursor of the next page, None on the last
+            page
+        :rtype: (list(Analysis), str)
+        """
+        return self.split(
+            self.queryset().select_related(
+                'user', 'impact_layer', 'hazard_layer', 'exposure_layer'),
+            lambda a: a.created,
+            lambda a: a.id)
+
+    def page(self):
+        """Page of the history API.
+
+        :return: dict with results, list of dict of analysis columns,
+            and next, cursor of the next page or None on the last page
+        :rtype: dict
+        """
+        rows, next_cursor = self.split(
+            self.queryset().values(*HISTORY_COLUMNS),
+            lambda r: r['created'],
+            lambda r: r['id'])
+        results = []
+        for row in rows:
+            results.append({
+                'id': row['id'],
+                'created': row['created'].isoformat(),
+                'title': row['user_title'] or row['impact_layer__title'],
+                'user': row['user__username'],
+                'state': row['task_state'],
+                'keep': row['keep'],
+                'impact_function_id': row['impact_function_id'],
+                'hazard_layer': {
+                    'id': row['hazard_layer_id'],
+                    'title': row['hazard_layer__title'],
+                },
+                'exposure_layer': {
+                    'id': row['exposure_layer_id'],
+                    'title': row['exposure_layer__title'],
+                },
+                'impact_layer': {
+                    'id': row['impact_layer_id'],
+                    'title': row['impact_layer__title'],
+                } if row['impact_layer_id'] else None,
+            })
+        return {
+            'results': results,
+            'next': next_cursor
+        }
@@ -0,0 +1,22 @@
+# coding=utf-8
+"""Helpers shared by GeoSAFE caches."""
+import hashlib
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+def cache_key(prefix, *args):
+    """Build a cache key from arbitrary arguments.
+
+    Arguments are hashed so credentials never appear in the cache backend.
+
+    :param prefix: key prefix
+    :type prefix: str
+
+    :return: cache key
+    :rtype: str
+    """
+    digest = hashlib.md5(
+        '|'.join([u'%s' % a for a in args]).encode('utf-8')).hexdigest()
+    return '%s.%s' % (prefix, digest)
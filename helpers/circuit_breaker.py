@@ -0,0 +1,112 @@
+# coding=utf-8
+"""Circuit breaker shared by all processes through the Django cache.
+
+After GEOSAFE_HEADLESS_BREAKER_THRESHOLD consecutive failures the circuit
+opens, and calls are refused for GEOSAFE_HEADLESS_BREAKER_COOLDOWN seconds
+instead of waiting on a service that is down. After the cooldown, one call
+is let through to probe the service: success closes the circuit, failure
+opens it again.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker(object):
+    """Track failures of a service and refuse calls while it is down.
+
+    Usage::
+
+        breaker = CircuitBreaker('headless')
+        breaker.before_call()
+        try:
+            result = call()
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+    """
+
+    def __init__(self, name, threshold=None, cooldown=None):
+        """
+        :param name: name of the service
+        :type name: str
+
+        :param threshold: consecutive failures opening the circuit
+        :type threshold: int
+
+        :param cooldown: seconds to refuse calls once open
+        :type cooldown: int
+        """
+        self.name = name
+        if threshold is None:
+            threshold = getattr(
+                settings, 'GEOSAFE_HEADLESS_BREAKER_THRESHOLD', 3)
+        if cooldown is None:
+            cooldown = getattr(
+                settings, 'GEOSAFE_HEADLESS_BREAKER_COOLDOWN', 60)
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+    def _key(self, suffix):
+        return 'geosafe.circuit.%s.%s' % (self.name, suffix)
+
+    def is_open(self):
+        """Whether calls are currently refused.
+
+        :rtype: bool
+        """
+        return cache.get(self._key('open')) is not None
+
+    def before_call(self):
+        """Check a call may go through.
+
+        :raises: CircuitOpen when the circuit is open, or when another
+            caller is already probing the service
+        """
+        if self.is_open():
+            raise CircuitOpen('%s circuit is open' % self.name)
+        if cache.get(self._key('tripped')) is None:
+            return
+        # half open: only one caller probes the service
+        if not cache.add(self._key('probe'), 1, self.cooldown):
+            raise CircuitOpen('%s circuit is half open' % self.name)
+
+    def record_success(self):
+        if cache.get(self._key('tripped')) is not None:
+            LOGGER.info('%s circuit closed' % self.name)
+        cache.delete_many([
+            self._key('failures'), self._key('tripped'), self._key('probe')])
+
+    def record_failure(self):
+        key = self._key('failures')
+        if cache.add(key, 1, None):
+            failures = 1
+        else:
+            try:
+                failures = cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, None)
+                failures = 1
+        tripped = cache.get(self._key('tripped')) is not None
+        if tripped or failures >= self.threshold:
+            self.trip()
+
+    def trip(self):
+        """Open the circuit for the cooldown period."""
+        LOGGER.warning('%s circuit open for %d seconds' % (
+            self.name, self.cooldown))
+        cache.set(self._key('open'), 1, self.cooldown)
+        cache.set(self._key('tripped'), 1, None)
+        cache.delete(self._key('probe'))
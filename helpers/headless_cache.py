@@ -0,0 +1,309 @@
+# coding=utf-8
+"""Shared cache of InaSAFE Headless proxy task results.
+
+Results are keyed by task name and normalised arguments. Arguments
+referring to layers are versioned: saving a layer bumps its version, so
+results computed from the previous layer content are not used anymore.
+All results of a task can be dropped at once by bumping the task
+generation.
+
+Calls are bounded by a time budget and guarded by a circuit breaker. When
+headless doesn't answer in time, or the circuit is open, the last known
+result for the same arguments is used if there is one.
+
+Views that must not hold a web worker on headless latency submit the task
+with submit_task, and collect the result with collect_task_result on a
+later request.
+"""
+import json
+import logging
+import time
+
+from celery.result import AsyncResult
+from django.conf import settings
+from django.core.cache import cache
+
+from geosafe.helpers.cache import cache_key
+from geosafe.helpers.circuit_breaker import CircuitBreaker, CircuitOpen
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+LOGGER = logging.getLogger(__name__)
+
+HEADLESS_CACHE_PREFIX = 'geosafe.headless'
+
+
+class HeadlessUnavailable(Exception):
+    """InaSAFE Headless didn't answer and no previous result is known."""
+    pass
+
+
+breaker = CircuitBreaker('headless')
+
+
+def _counter_key(kind, name):
+    return '%s.%s.%s' % (HEADLESS_CACHE_PREFIX, kind, name)
+
+
+def _counter(kind, name):
+    return cache.get(_counter_key(kind, name)) or 0
+
+
+def _bump(kind, name):
+    key = _counter_key(kind, name)
+    # counters never expire, otherwise stale results would match again
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def layer_version(layer_id):
+    """Current cache version of a layer.
+
+    :rtype: int
+    """
+    return _counter('layer_version', layer_id)
+
+
+def invalidate_layer(layer_id):
+    """Drop cached results computed from a layer."""
+    _bump('layer_version', layer_id)
+
+
+def invalidate_task(task_name):
+    """Drop every cached result of a task."""
+    _bump('task_generation', task_name)
+
+
+def task_result_key(task_name, args, layer_ids=()):
+    """Cache key of a task result.
+
+    :param task_name: celery task name
+    :type task_name: str
+
+    :param args: task arguments
+    :type args: tuple
+
+    :param layer_ids: ids of the layers the arguments refer to
+    :type layer_ids: list(int)
+
+    :rtype: str
+    """
+    # tuples and lists serialise the same
+    normalised_args = json.dumps(list(args), sort_keys=True)
+    versions = ['%s:%s' % (layer_id, layer_version(layer_id))
+                for layer_id in sorted(layer_ids)]
+    return cache_key(
+        HEADLESS_CACHE_PREFIX,
+        task_name,
+        _counter('task_generation', task_name),
+        normalised_args,
+        ','.join(versions))
+
+
+def last_known_key(task_name, args):
+    """Cache key of the last known result of a task, for any version.
+
+    :rtype: str
+    """
+    return cache_key(
+        HEADLESS_CACHE_PREFIX,
+        'last_known',
+        task_name,
+        json.dumps(list(args), sort_keys=True))
+
+
+def task_timeout(task_name):
+    """Seconds to wait for the result of a task.
+
+    Budgets are set per task name in GEOSAFE_HEADLESS_TIMEOUTS, otherwise
+    GEOSAFE_HEADLESS_TIMEOUT applies.
+
+    :rtype: int
+    """
+    timeouts = getattr(settings, 'GEOSAFE_HEADLESS_TIMEOUTS', {})
+    return timeouts.get(
+        task_name, getattr(settings, 'GEOSAFE_HEADLESS_TIMEOUT', 30))
+
+
+def cached_result(task_name, args, layer_ids=()):
+    """Cached result of a task, None if not cached.
+
+    :param task_name: celery task name
+    :type task_name: str
+    """
+    return cache.get(task_result_key(task_name, args, layer_ids=layer_ids))
+
+
+def store_task_result(task_name, args, result, layer_ids=(), ttl=None):
+    """Cache a task result, and keep it as the last known result.
+
+    :param ttl: seconds to keep the result, default
+        GEOSAFE_HEADLESS_CACHE_TTL
+    :type ttl: int
+    """
+    if result is None:
+        return
+    if ttl is None:
+        ttl = getattr(settings, 'GEOSAFE_HEADLESS_CACHE_TTL', 3600)
+    cache.set(task_result_key(task_name, args, layer_ids=layer_ids),
+              result, ttl)
+    cache.set(
+        last_known_key(task_name, args),
+        result,
+        getattr(settings, 'GEOSAFE_HEADLESS_LAST_KNOWN_TTL', 7 * 86400))
+
+
+def last_known_result(task_name, args, reason):
+    """Last known result of a task, used when headless doesn't answer.
+
+    :param reason: error preventing a fresh result
+    :type reason: Exception
+
+    :raises: HeadlessUnavailable when there is no last known result
+    """
+    result = cache.get(last_known_key(task_name, args))
+    if result is None:
+        raise HeadlessUnavailable(
+            'No result of %s: %s' % (task_name, reason))
+    LOGGER.warning('Using last known result of %s: %s' % (
+        task_name, reason))
+    return result
+
+
+def cached_task_result(task, args=(), layer_ids=(), ttl=None, timeout=None):
+    """Run a headless proxy task and wait for its result, using the cache.
+
+    :param task: celery task
+    :type task: celery.Task
+
+    :param args: task arguments
+    :type args: tuple
+
+    :param layer_ids: ids of the layers the arguments refer to
+    :type layer_ids: list(int)
+
+    :param ttl: seconds to keep the result, default
+        GEOSAFE_HEADLESS_CACHE_TTL
+    :type ttl: int
+
+    :param timeout: seconds to wait for the task result, default from
+        task_timeout
+    :type timeout: int
+
+    :return: task result
+
+    :raises: HeadlessUnavailable when headless doesn't answer and there is
+        no last known result
+    """
+    result = cached_result(task.name, args, layer_ids=layer_ids)
+    if result is not None:
+        return result
+
+    if timeout is None:
+        timeout = task_timeout(task.name)
+    async_result = None
+    try:
+        breaker.before_call()
+        async_result = task.delay(*args)
+        result = async_result.get(timeout=timeout)
+    except Exception as e:
+        if async_result is not None and async_result.failed():
+            # headless answered, the task itself failed
+            breaker.record_success()
+            raise
+        if not isinstance(e, CircuitOpen):
+            breaker.record_failure()
+        return last_known_result(task.name, args, e)
+    breaker.record_success()
+
+    store_task_result(task.name, args, result, layer_ids=layer_ids, ttl=ttl)
+    return result
+
+
+def _pending_key(token):
+    return '%s.pending.%s' % (HEADLESS_CACHE_PREFIX, token)
+
+
+def submit_task(task, args=(), layer_ids=()):
+    """Start a headless proxy task without waiting for its result.
+
+    Requests for the same arguments share one pending task.
+
+    :param task: celery task
+    :type task: celery.Task
+
+    :param args: task arguments
+    :type args: tuple
+
+    :param layer_ids: ids of the layers the arguments refer to
+    :type layer_ids: list(int)
+
+    :return: token to collect the result with
+    :rtype: str
+
+    :raises: CircuitOpen when headless calls are refused
+    """
+    key = task_result_key(task.name, args, layer_ids=layer_ids)
+    token = cache.get(key + '.token')
+    if token and cache.get(_pending_key(token)):
+        return token
+
+    breaker.before_call()
+    try:
+        async_result = task.delay(*args)
+    except Exception:
+        breaker.record_failure()
+        raise
+    token = async_result.id
+    timeout = task_timeout(task.name)
+    # pending entries outlive the budget, so late polls can still fall back
+    cache.set(_pending_key(token), {
+        'task': task.name,
+        'args': list(args),
+        'layer_ids': list(layer_ids),
+        'submitted': time.time()
+    }, timeout * 10)
+    cache.set(key + '.token', token, timeout)
+    return token
+
+
+def collect_task_result(token):
+    """Collect the result of a task started with submit_task.
+
+    :param token: token returned by submit_task
+    :type token: str
+
+    :return: whether the result is ready, and the result
+    :rtype: (bool, object)
+
+    :raises: KeyError for unknown tokens, HeadlessUnavailable when the time
+        budget is exceeded and there is no last known result
+    """
+    pending = cache.get(_pending_key(token))
+    if not pending:
+        raise KeyError(token)
+
+    task_name = pending['task']
+    args = pending['args']
+    async_result = AsyncResult(token)
+    if async_result.ready():
+        # headless answered, even if the task itself failed
+        breaker.record_success()
+        result = async_result.get(propagate=True)
+        store_task_result(
+            task_name, args, result, layer_ids=pending['layer_ids'])
+        return True, result
+
+    elapsed = time.time() - pending['submitted']
+    if elapsed <= task_timeout(task_name):
+        return False, None
+
+    cache.delete(_pending_key(token))
+    reason = 'no answer after %d seconds' % elapsed
+    breaker.record_failure()
+    return True, last_known_result(task_name, args, reason)
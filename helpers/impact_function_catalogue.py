@@ -0,0 +1,186 @@
+# coding=utf-8
+"""Local catalogue of InaSAFE Headless impact functions.
+
+The list of impact functions and the functions usable with each
+(hazard category, exposure category) pair are synced periodically from
+InaSAFE Headless into the database. Requests then resolve functions
+without waiting on the broker, and the catalogue survives restarts.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from geosafe.helpers.headless_cache import (
+    HeadlessUnavailable, cached_task_result)
+from geosafe.models import (
+    Analysis,
+    ImpactFunction,
+    ImpactFunctionCompatibility,
+    Metadata)
+from geosafe.tasks.headless.analysis import filter_impact_function
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+LOGGER = logging.getLogger(__name__)
+
+NAMES_CACHE_KEY = 'geosafe.impact_function_catalogue.names'
+
+
+def sync_impact_functions():
+    """Sync the list of impact functions from InaSAFE Headless.
+
+    :return: number of impact functions
+    :rtype: int
+    """
+    functions = filter_impact_function.delay().get()
+    with transaction.atomic():
+        seen = []
+        for function in functions:
+            ImpactFunction.objects.update_or_create(
+                function_id=function['id'],
+                defaults={'name': function.get('name') or ''})
+            seen.append(function['id'])
+        ImpactFunction.objects.exclude(function_id__in=seen).delete()
+    cache.delete(NAMES_CACHE_KEY)
+    return len(seen)
+
+
+def category_pairs():
+    """Hazard and exposure category pairs of the available layers.
+
+    Each pair comes with one layer of each category, used to ask InaSAFE
+    Headless which functions apply.
+
+    :return: dict of (hazard category, exposure category) to
+        (hazard layer, exposure layer)
+    :rtype: dict
+    """
+    representatives = {}
+    metadata = Metadata.objects.filter(
+        layer_purpose__in=['hazard', 'exposure']).exclude(
+        category__isnull=True).exclude(category='').select_related(
+        'layer').order_by('layer_id')
+    for m in metadata:
+        representatives.setdefault((m.layer_purpose, m.category), m.layer)
+
+    pairs = {}
+    for (purpose, hazard_category), hazard_layer in \
+            representatives.items():
+        if purpose != 'hazard':
+            continue
+        for (other, exposure_category), exposure_layer in \
+                representatives.items():
+            if other != 'exposure':
+                continue
+            pairs[(hazard_category, exposure_category)] = (
+                hazard_layer, exposure_layer)
+    return pairs
+
+
+def sync_compatibility_matrix():
+    """Sync impact functions usable with each category pair.
+
+    :return: number of category pairs synced
+    :rtype: int
+    """
+    functions = dict(
+        ImpactFunction.objects.values_list('function_id', 'id'))
+    synced = 0
+    for (hazard_category, exposure_category), (hazard, exposure) in \
+            category_pairs().items():
+        try:
+            compatible = cached_task_result(
+                filter_impact_function,
+                (Analysis.get_layer_url(hazard),
+                 Analysis.get_layer_url(exposure)),
+                layer_ids=[hazard.id, exposure.id])
+        except Exception as e:
+            LOGGER.exception(e)
+            continue
+
+        with transaction.atomic():
+            ImpactFunctionCompatibility.objects.filter(
+                hazard_category=hazard_category,
+                exposure_category=exposure_category).delete()
+            ImpactFunctionCompatibility.objects.bulk_create([
+                ImpactFunctionCompatibility(
+                    hazard_category=hazard_category,
+                    exposure_category=exposure_category,
+                    impact_function_id=functions[f['id']])
+                for f in compatible or [] if f['id'] in functions])
+        synced += 1
+    return synced
+
+
+def impact_function_list():
+    """Impact functions in the format returned by InaSAFE Headless.
+
+    :return: list of dict of id and name
+    :rtype: list(dict)
+    """
+    functions = [
+        {'id': function_id, 'name': name}
+        for function_id, name in ImpactFunction.objects.order_by(
+            'name').values_list('function_id', 'name')]
+    if not functions:
+        # catalogue not synced yet
+        try:
+            functions = cached_task_result(filter_impact_function) or []
+        except HeadlessUnavailable as e:
+            # degraded: pages still render, without impact functions
+            LOGGER.warning(e)
+    return functions
+
+
+def impact_function_names():
+    """Index of impact function name by id.
+
+    :rtype: dict
+    """
+    names = cache.get(NAMES_CACHE_KEY)
+    if not names:
+        names = dict(
+            (f['id'], f['name']) for f in impact_function_list())
+        cache.set(
+            NAMES_CACHE_KEY,
+            names,
+            getattr(settings, 'GEOSAFE_HEADLESS_CACHE_TTL', 3600))
+    return names
+
+
+def layer_category(layer):
+    """InaSAFE category of a layer, None without metadata.
+
+    :type layer: Layer
+    :rtype: str
+    """
+    try:
+        return layer.metadata.category
+    except Metadata.DoesNotExist:
+        return None
+
+
+def compatible_impact_functions(hazard_category, exposure_category):
+    """Impact functions usable with a hazard and exposure category.
+
+    :return: list of dict of id and name, None if the pair is not synced
+    :rtype: list(dict)
+    """
+    if not (hazard_category and exposure_category):
+        return None
+    entries = ImpactFunctionCompatibility.objects.filter(
+        hazard_category=hazard_category,
+        exposure_category=exposure_category).select_related(
+        'impact_function').order_by('impact_function__name')
+    functions = [
+        {
+            'id': e.impact_function.function_id,
+            'name': e.impact_function.name
+        } for e in entries]
+    if not functions:
+        return None
+    return functions
@@ -1,19 +1,64 @@
 # coding=utf-8
 
 import json
+import logging
 from collections import OrderedDict
 
 from geonode.layers.models import Layer, LayerFile
+from geosafe.helpers.impact_summary.summary_engine import \
+    ImpactSummaryEngine
+from geosafe.models import Analysis
 
 __author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
 __date__ = '5/17/16'
 
 
+LOGGER = logging.getLogger(__name__)
+
+
+def load_impact_data(impact_layer):
+    """Impact data of an impact layer, stored with its analysis.
+
+    Impact data is read from impact_data.json, or computed from the layer,
+    only when the analysis doesn't hold it yet. It is then stored so the
+    layer isn't read again.
+
+    :param impact_layer: impact layer
+    :type impact_layer: Layer
+
+    :return: dictionary of impact data
+    :rtype: dict
+    """
+    analyses = Analysis.objects.filter(impact_layer=impact_layer)
+    stored = analyses.exclude(impact_data__isnull=True).values_list(
+        'impact_data', flat=True)[:1]
+    if stored:
+        try:
+            return json.loads(stored[0])
+        except ValueError:
+            pass
+    impact_data = ImpactSummary(impact_layer, impact_data={}) \
+        .read_impact_data_json()
+    if impact_data:
+        analyses.update(impact_data=json.dumps(impact_data))
+    return impact_data
+
+
 class ImpactSummary(object):
 
-    def __init__(self, impact_layer):
+    def __init__(self, impact_layer, impact_data=None):
+        """
+        :param impact_layer: impact layer
+        :type impact_layer: Layer
+
+        :param impact_data: impact data if already loaded, otherwise it is
+            loaded with load_impact_data
+        :type impact_data: dict
+        """
         self._impact_layer = impact_layer
-        self._impact_data = self.read_impact_data_json()
+        if impact_data is None:
+            impact_data = load_impact_data(impact_layer)
+        self._impact_data = impact_data
 
     @property
     def impact_layer(self):
@@ -44,6 +89,9 @@ class ImpactSummary(object):
     def read_impact_data_json(self):
         """Read impact_data.json file from a given impact layer
 
+        If the file doesn't exist or can't be used, the impact data is
+        computed from the impact layer itself.
+
         :return: dictionary of impact data
         :rtype: dict
         """
@@ -51,8 +99,24 @@ class ImpactSummary(object):
             json_file = self.impact_layer.upload_session.layerfile_set.get(
                 file__endswith=".json")
             impact_data = json.loads(json_file.file.read())
-            return impact_data
-        except LayerFile.DoesNotExist:
+            if isinstance(impact_data, dict) and impact_data.get(
+                    'impact summary'):
+                return impact_data
+        except (LayerFile.DoesNotExist, LayerFile.MultipleObjectsReturned,
+                ValueError):
+            pass
+        return self.compute_impact_data()
+
+    def compute_impact_data(self):
+        """Compute impact data from the impact layer using summary engine.
+
+        :return: dictionary of impact data
+        :rtype: dict
+        """
+        try:
+            return ImpactSummaryEngine(self.impact_layer).impact_data()
+        except Exception as e:
+            LOGGER.exception(e)
             return {}
 
     def is_summary_exists(self):
@@ -0,0 +1,351 @@
+# coding=utf-8
+"""Local summary engine for impact layers.
+
+Compute impact summary statistics directly from the impact layer files when
+InaSAFE Headless does not provide a usable impact_data.json. The result is
+returned in the same structure as impact_data.json so it can be consumed by
+ImpactSummary and its subclasses.
+"""
+import logging
+import os
+from collections import OrderedDict
+from xml.etree import ElementTree
+
+from geosafe.models import ISO_METADATA_KEYWORD_TAG
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+LOGGER = logging.getLogger(__name__)
+
+# number of raster rows reduced in one chunk
+RASTER_CHUNK_ROWS = 512
+
+# number of vector features aggregated in one batch
+VECTOR_BATCH_SIZE = 10000
+
+# candidate attribute names holding hazard class of an impact feature
+HAZARD_CLASS_FIELDS = [
+    'affected',
+    'AFFECTED',
+    'INUNDATED',
+    'inundated',
+    'state',
+    'STATE',
+    'hazard',
+    'HAZARD',
+]
+
+# candidate attribute names holding population count of an impact feature
+POPULATION_FIELDS = [
+    'population',
+    'POPULATION',
+    'pop',
+    'POP',
+]
+
+# exposure keyword mapped to the exposure name headless writes in
+# impact_data.json, together with the summary keys used by the summary
+# classes for total and affected values.
+EXPOSURE_SUMMARY_KEYS = {
+    'population': ('population', 'Total population',
+                   'Total affected population'),
+    'structure': ('building', 'Total', 'Affected buildings'),
+    'road': ('road', 'Total', 'Affected roads'),
+    'land_cover': ('landcover', 'Total', 'Affected landcover'),
+}
+
+# hazard class values or labels considered as not affected
+NOT_AFFECTED_CLASSES = ['0', 'not affected', 'dry', 'false', 'no']
+
+
+def _as_float(value):
+    """Convert a summary value to float, treating None as zero."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def is_affected_class(hazard_class):
+    """Check if a given hazard class represents an affected area.
+
+    :param hazard_class: hazard class value or label
+    :type hazard_class: str, int
+
+    :return: True if the class is considered affected
+    :rtype: bool
+    """
+    label = ('%s' % hazard_class).strip().lower()
+    return label not in NOT_AFFECTED_CLASSES
+
+
+class ImpactSummaryEngine(object):
+    """Derive impact statistics from impact layer files."""
+
+    def __init__(self, impact_layer, chunk_rows=RASTER_CHUNK_ROWS,
+                 batch_size=VECTOR_BATCH_SIZE):
+        self._impact_layer = impact_layer
+        self.chunk_rows = chunk_rows
+        self.batch_size = batch_size
+        self._keywords = None
+
+    @property
+    def impact_layer(self):
+        """
+
+        :return: Impact Layer
+        :rtype: Layer
+        """
+        return self._impact_layer
+
+    def layer_file_path(self, extensions):
+        """Find the local path of a layer file with given extensions.
+
+        :param extensions: list of file extensions, including the dot
+        :type extensions: list(str)
+
+        :return: path of the file, None if not found
+        :rtype: str
+        """
+        upload_session = self.impact_layer.upload_session
+        for layer_file in upload_session.layerfile_set.all():
+            _, ext = os.path.splitext(layer_file.file.name)
+            if ext.lower() in extensions:
+                try:
+                    return layer_file.file.path
+                except NotImplementedError:
+                    # storage backend without local filesystem
+                    return None
+        return None
+
+    def keywords(self):
+        """Read InaSAFE keywords stored in the impact layer xml metadata.
+
+        :return: dictionary of keywords
+        :rtype: dict
+        """
+        if self._keywords is not None:
+            return self._keywords
+
+        self._keywords = {}
+        xml_path = self.layer_file_path(['.xml'])
+        if not xml_path or not os.path.exists(xml_path):
+            return self._keywords
+
+        try:
+            tree = ElementTree.parse(xml_path)
+            keywords_tag = tree.getroot().find(ISO_METADATA_KEYWORD_TAG)
+            if keywords_tag is not None:
+                for child in keywords_tag:
+                    self._keywords[child.tag] = (child.text or '').strip()
+        except ElementTree.ParseError as e:
+            LOGGER.exception(e)
+        return self._keywords
+
+    def exposure_keys(self):
+        """Get exposure name and summary keys of this impact layer.
+
+        :return: tuple of exposure name, total key and affected key
+        :rtype: (str, str, str)
+        """
+        exposure = self.keywords().get('exposure', '')
+        return EXPOSURE_SUMMARY_KEYS.get(
+            exposure, (exposure, 'Total', 'Total affected'))
+
+    def impact_data(self):
+        """Compute impact data of the impact layer.
+
+        :return: dictionary in the format of impact_data.json, or empty
+            dict if the layer can't be summarized
+        :rtype: dict
+        """
+        raster_path = self.layer_file_path(['.tif', '.tiff', '.asc'])
+        vector_path = self.layer_file_path(['.shp'])
+        if raster_path:
+            class_totals = self.raster_class_totals(raster_path)
+        elif vector_path:
+            class_totals = self.vector_class_totals(vector_path)
+        else:
+            return {}
+
+        if class_totals is None:
+            return {}
+
+        exposure, total_key, affected_key = self.exposure_keys()
+        fields = [
+            [('%s' % hazard_class), value]
+            for hazard_class, value in class_totals.items()]
+        total = sum(class_totals.values())
+        affected = sum(
+            value for hazard_class, value in class_totals.items()
+            if is_affected_class(hazard_class))
+        fields.append([affected_key, affected])
+        fields.append([total_key, total])
+
+        return {
+            'exposure': exposure,
+            'impact summary': {
+                'attributes': ['category', 'value'],
+                'fields': fields
+            }
+        }
+
+    def raster_class_totals(self, raster_path):
+        """Reduce a raster impact layer to per-class totals.
+
+        Integer rasters are treated as classified, so the result is the
+        number of cells for each class value. Floating point rasters hold
+        counts (for example population), so the result is their sum.
+        The raster is consumed in chunks of rows from a memory mapped view
+        when available, so it may be larger than the available memory.
+
+        :param raster_path: path to the raster file
+        :type raster_path: str
+
+        :return: ordered dictionary of class value and total
+        :rtype: OrderedDict
+        """
+        try:
+            import numpy
+            from osgeo import gdal
+        except ImportError:
+            LOGGER.info('NumPy and GDAL are required to summarize rasters')
+            return None
+
+        dataset = gdal.Open(raster_path)
+        if not dataset:
+            return None
+        band = dataset.GetRasterBand(1)
+        nodata = band.GetNoDataValue()
+
+        try:
+            array = band.GetVirtualMemAutoArray()
+        except (AttributeError, RuntimeError):
+            # GDAL without virtual memory support, read windows instead
+            array = None
+
+        totals = {}
+        classified = None
+        rows = band.YSize
+        for offset in range(0, rows, self.chunk_rows):
+            count = min(self.chunk_rows, rows - offset)
+            if array is not None:
+                chunk = array[offset:offset + count]
+            else:
+                chunk = band.ReadAsArray(0, offset, band.XSize, count)
+
+            if classified is None:
+                classified = numpy.issubdtype(chunk.dtype, numpy.integer)
+
+            mask = numpy.ones(chunk.shape, dtype=bool)
+            if nodata is not None:
+                mask &= chunk != nodata
+            if not classified:
+                mask &= numpy.isfinite(chunk)
+            values = chunk[mask]
+
+            if classified:
+                classes, counts = numpy.unique(values, return_counts=True)
+                for hazard_class, class_count in zip(
+                        classes.tolist(), counts.tolist()):
+                    totals[hazard_class] = (
+                        totals.get(hazard_class, 0) + class_count)
+            else:
+                totals['Affected'] = (
+                    totals.get('Affected', 0.0) +
+                    float(values.sum(dtype=numpy.float64)))
+
+        dataset = None
+        ret_val = OrderedDict()
+        for hazard_class in sorted(totals.keys()):
+            ret_val[hazard_class] = totals[hazard_class]
+        return ret_val
+
+    def vector_class_totals(self, vector_path):
+        """Aggregate a vector impact layer to per-class totals.
+
+        Features are grouped by their hazard class attribute. If the layer
+        has a population attribute, its values are summed for each class,
+        otherwise features are counted.
+
+        :param vector_path: path to the vector file
+        :type vector_path: str
+
+        :return: ordered dictionary of class value and total
+        :rtype: OrderedDict
+        """
+        try:
+            import numpy
+            from osgeo import ogr
+        except ImportError:
+            LOGGER.info('NumPy and OGR are required to summarize vectors')
+            return None
+
+        datasource = ogr.Open(vector_path)
+        if not datasource:
+            return None
+        layer = datasource.GetLayer(0)
+        definition = layer.GetLayerDefn()
+        field_names = [
+            definition.GetFieldDefn(i).GetName()
+            for i in range(definition.GetFieldCount())]
+
+        keywords = self.keywords()
+        class_field = keywords.get('target_field')
+        if class_field not in field_names:
+            class_field = None
+            for name in HAZARD_CLASS_FIELDS:
+                if name in field_names:
+                    class_field = name
+                    break
+        if not class_field:
+            LOGGER.info('No hazard class attribute in %s' % vector_path)
+            return None
+
+        weight_field = None
+        for name in POPULATION_FIELDS:
+            if name in field_names:
+                weight_field = name
+                break
+
+        totals = {}
+
+        def reduce_batch(classes, weights):
+            classes = numpy.array(classes)
+            unique_classes, inverse = numpy.unique(
+                classes, return_inverse=True)
+            sums = numpy.bincount(
+                inverse,
+                weights=numpy.array(weights, dtype=numpy.float64))
+            for hazard_class, value in zip(
+                    unique_classes.tolist(), sums.tolist()):
+                totals[hazard_class] = totals.get(hazard_class, 0) + value
+
+        classes = []
+        weights = []
+        layer.ResetReading()
+        feature = layer.GetNextFeature()
+        while feature is not None:
+            classes.append('%s' % feature.GetField(class_field))
+            if weight_field:
+                weights.append(_as_float(feature.GetField(weight_field)))
+            else:
+                weights.append(1.0)
+            if len(classes) >= self.batch_size:
+                reduce_batch(classes, weights)
+                classes = []
+                weights = []
+            feature = layer.GetNextFeature()
+        if classes:
+            reduce_batch(classes, weights)
+
+        datasource = None
+        ret_val = OrderedDict()
+        for hazard_class in sorted(totals.keys()):
+            value = totals[hazard_class]
+            if not weight_field:
+                value = int(value)
+            ret_val[hazard_class] = value
+        return ret_val
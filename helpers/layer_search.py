@@ -0,0 +1,262 @@
+# coding=utf-8
+"""Search of InaSAFE layers for typeahead inputs.
+
+Layers are matched on name and title, filtered by purpose, category and
+bbox, and returned one page at a time in name order. Pages use keyset
+pagination: the cursor holds the name and id of the last layer returned,
+so fetching a page costs the same wherever it is in the list. Only the
+requested fields are read from the database.
+"""
+import base64
+import json
+import logging
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.expressions import F
+from django.db.models.query_utils import Q
+
+from geonode.layers.models import Layer
+from geosafe.models import Metadata
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+LOGGER = logging.getLogger(__name__)
+
+# field name in results, and the columns it is read from
+LAYER_FIELDS = OrderedDict([
+    ('id', ['layer_id']),
+    ('name', ['layer__name']),
+    ('title', ['layer__title']),
+    ('typename', ['layer__typename']),
+    ('purpose', ['layer_purpose']),
+    ('category', ['category']),
+    ('bbox', [
+        'layer__bbox_x0',
+        'layer__bbox_y0',
+        'layer__bbox_x1',
+        'layer__bbox_y1']),
+])
+
+DEFAULT_FIELDS = ['id', 'name']
+
+MATCH_PREFIX = 'prefix'
+MATCH_FULL = 'full'
+
+
+class InvalidSearch(Exception):
+    pass
+
+
+def normalize_bbox(bbox):
+    """Order bbox corners as (min x, min y, max x, max y).
+
+    :param bbox: bbox as list, or its JSON string
+    :type bbox: list, str
+
+    :rtype: list(float)
+    """
+    if isinstance(bbox, basestring):
+        bbox = json.loads(bbox)
+    bbox = [float(c) for c in bbox]
+    if len(bbox) != 4:
+        raise ValueError('bbox needs 4 coordinates')
+    if bbox[2] < bbox[0]:
+        bbox[0], bbox[2] = bbox[2], bbox[0]
+    if bbox[3] < bbox[1]:
+        bbox[1], bbox[3] = bbox[3], bbox[1]
+    return bbox
+
+
+def bbox_intersects(bbox):
+    """Filter of Metadata whose layer intersects a bbox.
+
+    :param bbox: normalized bbox
+    :type bbox: list(float)
+
+    :rtype: Q
+    """
+    return (
+        Q(layer__bbox_x0__lte=bbox[2]) &
+        Q(layer__bbox_x1__gte=bbox[0]) &
+        Q(layer__bbox_y0__lte=bbox[3]) &
+        Q(layer__bbox_y1__gte=bbox[1]) &
+        Q(layer__bbox_x0__lte=F('layer__bbox_x1')) &
+        Q(layer__bbox_y0__lte=F('layer__bbox_y1'))
+    ) | (
+        # in case of swapped value
+        Q(layer__bbox_x0__lte=bbox[2]) &
+        Q(layer__bbox_x1__gte=bbox[0]) &
+        Q(layer__bbox_y0__gte=bbox[1]) &
+        Q(layer__bbox_y1__lte=bbox[3]) &
+        Q(layer__bbox_x0__lte=F('layer__bbox_x1')) &
+        Q(layer__bbox_y1__lte=F('layer__bbox_y0'))
+    )
+
+
+def encode_cursor(name, layer_id):
+    return base64.urlsafe_b64encode(json.dumps([name, layer_id]))
+
+
+def decode_cursor(cursor):
+    try:
+        name, layer_id = json.loads(base64.urlsafe_b64decode(str(cursor)))
+        return name, int(layer_id)
+    except (TypeError, ValueError):
+        raise InvalidSearch('Invalid cursor')
+
+
+class LayerSearch(object):
+    """One page of layers matching a search.
+
+    Usage::
+
+        search = LayerSearch(query='jak', purpose='hazard', limit=10)
+        page = search.page()
+        next_page = LayerSearch(
+            query='jak', purpose='hazard', limit=10,
+            after=page['next']).page()
+    """
+
+    def __init__(self, query=None, match=MATCH_PREFIX, purpose=None,
+                 category=None, bbox=None, fields=None, after=None,
+                 limit=None):
+        """
+        :param query: text to match with layer name or title
+        :type query: str
+
+        :param match: 'prefix' to match the start of name or title, 'full'
+            to match every word anywhere in name or title
+        :type match: str
+
+        :param purpose: InaSAFE layer purpose
+        :type purpose: str
+
+        :param category: InaSAFE layer category
+        :type category: str
+
+        :param bbox: bbox the layers must intersect
+        :type bbox: list, str
+
+        :param fields: fields of each result, from LAYER_FIELDS
+        :type fields: list(str)
+
+        :param after: cursor returned with the previous page
+        :type after: str
+
+        :param limit: number of layers in a page, default
+            GEOSAFE_LAYER_SEARCH_PAGE_SIZE
+        :type limit: int
+
+        :raises: InvalidSearch for invalid parameters
+        """
+        if match not in (MATCH_PREFIX, MATCH_FULL):
+            raise InvalidSearch('Unknown match %s' % match)
+        fields = fields or DEFAULT_FIELDS
+        unknown = [f for f in fields if f not in LAYER_FIELDS]
+        if unknown:
+            raise InvalidSearch('Unknown fields %s' % ', '.join(unknown))
+        try:
+            self.bbox = normalize_bbox(bbox) if bbox else None
+        except (TypeError, ValueError):
+            raise InvalidSearch('Invalid bbox')
+        max_limit = getattr(
+            settings, 'GEOSAFE_LAYER_SEARCH_MAX_PAGE_SIZE', 100)
+        try:
+            limit = int(limit or getattr(
+                settings, 'GEOSAFE_LAYER_SEARCH_PAGE_SIZE', 20))
+        except ValueError:
+            raise InvalidSearch('Invalid limit')
+        self.limit = max(1, min(limit, max_limit))
+        self.query = (query or '').strip()
+        self.match = match
+        self.purpose = purpose
+        self.category = category
+        self.fields = fields
+        self.after = decode_cursor(after) if after else None
+
+    def text_filter(self):
+        """Filter on layer name and title.
+
+        :rtype: Q
+        """
+        if self.match == MATCH_PREFIX:
+            return (
+                Q(layer__name__istartswith=self.query) |
+                Q(layer__title__istartswith=self.query))
+        if connection.vendor == 'postgresql':
+            # uses the full text indexes of the layer_search_indexes command
+            layers = Layer.objects.extra(
+                where=["to_tsvector('simple', layers_layer.name) @@ "
+                       "plainto_tsquery('simple', %s) OR "
+                       "to_tsvector('simple', base_resourcebase.title) @@ "
+                       "plainto_tsquery('simple', %s)"],
+                params=[self.query, self.query])
+            return Q(layer__in=layers.values('id'))
+        condition = Q()
+        for term in self.query.split():
+            condition &= (
+                Q(layer__name__icontains=term) |
+                Q(layer__title__icontains=term))
+        return condition
+
+    def queryset(self):
+        """Matching Metadata in page order, without keyset condition.
+
+        :rtype: QuerySet
+        """
+        metadata = Metadata.objects.all()
+        if self.purpose:
+            metadata = metadata.filter(layer_purpose=self.purpose)
+        if self.category:
+            metadata = metadata.filter(category=self.category)
+        if self.bbox:
+            metadata = metadata.filter(bbox_intersects(self.bbox))
+        if self.query:
+            metadata = metadata.filter(self.text_filter())
+        return metadata.order_by('layer__name', 'layer_id')
+
+    def page(self):
+        """Layers of the page and cursor of the next page.
+
+        :return: dict with results, list of dict of the requested fields,
+            and next, cursor of the next page or None on the last page
+        :rtype: dict
+        """
+        metadata = self.queryset()
+        if self.after:
+            name, layer_id = self.after
+            metadata = metadata.filter(
+                Q(layer__name__gt=name) |
+                Q(layer__name=name, layer_id__gt=layer_id))
+
+        columns = ['layer_id', 'layer__name']
+        for field in self.fields:
+            columns += [c for c in LAYER_FIELDS[field] if c not in columns]
+        # one more row tells whether there is a next page
+        rows = list(metadata.values(*columns)[:self.limit + 1])
+
+        next_cursor = None
+        if len(rows) > self.limit:
+            rows = rows[:self.limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(last['layer__name'], last['layer_id'])
+
+        results = []
+        for row in rows:
+            result = OrderedDict()
+            for field in self.fields:
+                values = [row[c] for c in LAYER_FIELDS[field]]
+                if field == 'bbox':
+                    result[field] = [
+                        float(v) if v is not None else None for v in values]
+                else:
+                    result[field] = values[0]
+            results.append(result)
+        return {
+            'results': results,
+            'next': next_cursor
+        }
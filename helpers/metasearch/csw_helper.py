@@ -1,28 +1,239 @@
 # coding=utf-8
+import copy
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
 from owslib.csw import CatalogueServiceWeb
+from owslib.iso import MD_Metadata
 from owslib import fes
 
+from geosafe.helpers.cache import cache_key
+from geosafe.helpers.metasearch.record_cache import record_cache
+
 __author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
 __date__ = '10/14/16'
 
 
+LOGGER = logging.getLogger(__name__)
+
+
+class CSWClientPool(object):
+    """Provide CSW clients with cached capabilities.
+
+    Constructing CatalogueServiceWeb performs a GetCapabilities request.
+    The pool keeps one client per (url, credentials) with its parsed
+    capabilities for a TTL, and hands out shallow copies of it, so each
+    caller has its own records and results while skipping the
+    GetCapabilities round trip.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl or getattr(
+            settings, 'GEOSAFE_CSW_CAPABILITIES_TTL', 3600)
+        self._lock = threading.Lock()
+        self._templates = {}
+
+    def _template(self, csw_url, username, password):
+        key = (csw_url, username, password)
+        with self._lock:
+            template, expiry = self._templates.get(key, (None, 0))
+        if template and expiry > time.time():
+            return template
+
+        template = CatalogueServiceWeb(
+            csw_url,
+            username=username,
+            password=password)
+        with self._lock:
+            self._templates[key] = (template, time.time() + self.ttl)
+        return template
+
+    def get(self, csw_url, username=None, password=None):
+        """Get a CSW client for a given endpoint.
+
+        :param csw_url: CSW endpoint url
+        :type csw_url: str
+
+        :return: CSW client with capabilities loaded
+        :rtype: CatalogueServiceWeb
+        """
+        return copy.copy(self._template(csw_url, username, password))
+
+    def invalidate(self, csw_url, username=None, password=None):
+        """Drop cached capabilities of a given endpoint."""
+        with self._lock:
+            self._templates.pop((csw_url, username, password), None)
+
+    @contextmanager
+    def client(self, csw_url, username=None, password=None):
+        """Context manager of a CSW client.
+
+        Capabilities are invalidated if the client fails, so the next
+        request reloads them.
+        """
+        try:
+            yield self.get(csw_url, username=username, password=password)
+        except Exception:
+            self.invalidate(csw_url, username=username, password=password)
+            raise
+
+
+csw_pool = CSWClientPool()
+
+
 def csw_query_metadata_by_id(csw_url, identifier, username=None, password=None):
-    csw = CatalogueServiceWeb(
-        csw_url,
-        username=username,
-        password=password)
-    result = csw.identification.type
-    record = None
-    if result == 'CSW':
-        constraints = [
-            fes.PropertyIsEqualTo(
-                'dc:identifier', identifier)
-        ]
-        csw.getrecords2(
-            typenames='gmd:MD_Metadata',
-            esn='full',
-            outputschema='http://www.isotc211.org/2005/gmd',
-            constraints=constraints)
-        for key in csw.records:
-            record = csw.records[key]
-    return record
\ No newline at end of file
+    record = record_cache.get(
+        csw_url, identifier, username=username, password=password)
+    if record is not None:
+        return record
+
+    with csw_pool.client(
+            csw_url, username=username, password=password) as csw:
+        result = csw.identification.type
+        record = None
+        if result == 'CSW':
+            constraints = [
+                fes.PropertyIsEqualTo(
+                    'dc:identifier', identifier)
+            ]
+            csw.getrecords2(
+                typenames='gmd:MD_Metadata',
+                esn='full',
+                outputschema='http://www.isotc211.org/2005/gmd',
+                constraints=constraints)
+            for key in csw.records:
+                record = csw.records[key]
+    if isinstance(record, MD_Metadata):
+        record_cache.put(
+            csw_url, record, username=username, password=password)
+    return record
+
+
+def record_summary(rec):
+    """Convert an ISO record to the dictionary used by metasearch results.
+
+    :param rec: ISO metadata record
+    :type rec: MD_Metadata
+
+    :return: dictionary of id, title and InaSAFE keywords information
+    :rtype: dict
+    """
+    res = {}
+    res['id'] = rec.identifier
+    res['title'] = rec.identification.title
+    res['inasafe_keywords'] = rec.identification.supplementalinformation
+    if res['inasafe_keywords']:
+        res['inasafe_layer'] = (
+            '<inasafe_keywords/>' in res['inasafe_keywords'])
+    return res
+
+
+def _fetch_records_page(csw_url, keywords, offset, per_page,
+                        username=None, password=None):
+    keywords_query = [fes.PropertyIsLike(
+        'csw:AnyText', '%%%s%%' % keywords)]
+    with csw_pool.client(
+            csw_url, username=username, password=password) as csw:
+        records = []
+        matches = 0
+        if csw.identification.type == 'CSW':
+            csw.getrecords2(
+                typenames='gmd:MD_Metadata',
+                esn='full',
+                outputschema='http://www.isotc211.org/2005/gmd',
+                constraints=keywords_query,
+                startposition=offset,
+                maxrecords=per_page)
+            for key in csw.records:
+                rec = csw.records[key]
+                if isinstance(rec, MD_Metadata):
+                    record_cache.put(
+                        csw_url, rec, username=username, password=password)
+                    records.append(record_summary(rec))
+            matches = csw.results['matches']
+    return {
+        'records': records,
+        'matches': matches,
+    }
+
+
+_prefetching = set()
+_prefetching_lock = threading.Lock()
+
+
+def _prefetch_records_page(key, *args, **kwargs):
+    try:
+        page = _fetch_records_page(*args, **kwargs)
+        cache.set(key, page, getattr(
+            settings, 'GEOSAFE_CSW_PAGE_CACHE_TTL', 300))
+    except Exception as e:
+        LOGGER.exception(e)
+    finally:
+        with _prefetching_lock:
+            _prefetching.discard(key)
+
+
+def prefetch_records_page(csw_url, keywords, offset, per_page,
+                          username=None, password=None):
+    """Fetch a result page in a background thread and cache it.
+
+    Does nothing if the page is already cached or being fetched.
+    """
+    key = cache_key(
+        'geosafe.csw.page',
+        csw_url, username, password, keywords, offset, per_page)
+    with _prefetching_lock:
+        if key in _prefetching or cache.get(key) is not None:
+            return
+        _prefetching.add(key)
+    thread = threading.Thread(
+        target=_prefetch_records_page,
+        args=(key, csw_url, keywords, offset, per_page),
+        kwargs={'username': username, 'password': password})
+    thread.daemon = True
+    thread.start()
+
+
+def csw_search_records(csw_url, keywords, offset, per_page,
+                       username=None, password=None, prefetch=True):
+    """Search ISO records of a CSW endpoint, one page at a time.
+
+    Pages are cached for a short TTL and the next page is prefetched in the
+    background, so paging through results costs one request per page.
+
+    :param csw_url: CSW endpoint url
+    :type csw_url: str
+
+    :param keywords: keywords matched against any text of the records
+    :type keywords: str
+
+    :param offset: start position of the page
+    :type offset: int
+
+    :param per_page: maximum number of records in a page
+    :type per_page: int
+
+    :return: dictionary of records and number of matches
+    :rtype: dict
+    """
+    key = cache_key(
+        'geosafe.csw.page',
+        csw_url, username, password, keywords, offset, per_page)
+    page = cache.get(key)
+    if page is None:
+        page = _fetch_records_page(
+            csw_url, keywords, offset, per_page,
+            username=username, password=password)
+        cache.set(key, page, getattr(
+            settings, 'GEOSAFE_CSW_PAGE_CACHE_TTL', 300))
+
+    next_offset = offset + per_page
+    if prefetch and next_offset <= page['matches']:
+        prefetch_records_page(
+            csw_url, keywords, next_offset, per_page,
+            username=username, password=password)
+    return page
@@ -0,0 +1,155 @@
+# coding=utf-8
+"""Search several CSW catalogues concurrently."""
+import logging
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import connection
+
+from geosafe.helpers.metasearch.csw_helper import csw_search_records
+from geosafe.helpers.metasearch.harvest import (
+    configured_catalogues,
+    search_harvested_records)
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+LOGGER = logging.getLogger(__name__)
+
+# seconds between checks of pending catalogue searches
+POLL_INTERVAL = 0.05
+
+
+def catalogue_credentials(csw_url, session=None):
+    """Find credentials to connect to a catalogue.
+
+    Credentials in the session are used for the catalogue in the session,
+    otherwise they are taken from configured catalogues.
+
+    :param csw_url: CSW endpoint url
+    :type csw_url: str
+
+    :param session: request session
+    :type session: dict
+
+    :return: tuple of user and password
+    :rtype: (str, str)
+    """
+    if session and session.get('csw_url') == csw_url:
+        return session.get('user'), session.get('password')
+    for catalogue in configured_catalogues():
+        if catalogue['url'] == csw_url:
+            return catalogue.get('user'), catalogue.get('password')
+    return None, None
+
+
+def _search_catalogue(catalogue, keywords, offset, per_page):
+    try:
+        page = search_harvested_records(
+            catalogue['url'], keywords, offset, per_page,
+            username=catalogue.get('user'))
+        if page is None:
+            page = csw_search_records(
+                catalogue['url'],
+                keywords,
+                offset,
+                per_page,
+                username=catalogue.get('user'),
+                password=catalogue.get('password'),
+                prefetch=False)
+        return page
+    finally:
+        connection.close()
+
+
+def federated_search(keywords, offset, per_page, catalogues=None,
+                     timeout=None, workers=None):
+    """Search catalogues concurrently, yielding results as they arrive.
+
+    Records are de-duplicated by identifier across catalogues, and tagged
+    with the url of the catalogue they were found in. Catalogues not
+    answering within the timeout are reported as failed, without blocking
+    the others.
+
+    :param keywords: keywords matched against any text of the records
+    :type keywords: str
+
+    :param offset: start position of the page in each catalogue
+    :type offset: int
+
+    :param per_page: maximum number of records from each catalogue
+    :type per_page: int
+
+    :param catalogues: list of dict with url, user and password, defaults
+        to configured catalogues
+    :type catalogues: list(dict)
+
+    :param timeout: seconds to wait for each catalogue
+    :type timeout: float
+
+    :return: generator of dict with catalogue, records, matches and error
+    """
+    if catalogues is None:
+        catalogues = configured_catalogues()
+    if not catalogues:
+        return
+    timeout = timeout or getattr(
+        settings, 'GEOSAFE_METASEARCH_FEDERATED_TIMEOUT', 15)
+    workers = workers or getattr(
+        settings, 'GEOSAFE_METASEARCH_FEDERATED_WORKERS', 8)
+
+    pool = ThreadPool(min(workers, len(catalogues)))
+    try:
+        pending = []
+        for catalogue in catalogues:
+            pending.append((catalogue['url'], pool.apply_async(
+                _search_catalogue,
+                (catalogue, keywords, offset, per_page))))
+
+        seen = set()
+        deadline = time.time() + timeout
+        while pending:
+            still_pending = []
+            for csw_url, async_result in pending:
+                if not async_result.ready():
+                    still_pending.append((csw_url, async_result))
+                    continue
+
+                result = {
+                    'catalogue': csw_url,
+                    'records': [],
+                    'matches': 0,
+                    'error': None,
+                }
+                try:
+                    page = async_result.get()
+                    for record in page['records']:
+                        if record['id'] in seen:
+                            continue
+                        seen.add(record['id'])
+                        record['csw_url'] = csw_url
+                        result['records'].append(record)
+                    result['matches'] = page['matches']
+                except Exception as e:
+                    LOGGER.exception(e)
+                    result['error'] = 'failed'
+                yield result
+            pending = still_pending
+
+            if pending and time.time() > deadline:
+                for csw_url, _ in pending:
+                    LOGGER.info('Catalogue %s timed out' % csw_url)
+                    yield {
+                        'catalogue': csw_url,
+                        'records': [],
+                        'matches': 0,
+                        'error': 'timeout',
+                    }
+                break
+            if pending:
+                time.sleep(POLL_INTERVAL)
+    finally:
+        # don't wait for catalogues that timed out
+        pool.terminate()
@@ -0,0 +1,342 @@
+# coding=utf-8
+"""Harvest remote CSW catalogues into a local searchable index.
+
+The index is shared by every user, so only catalogues configured without
+credentials are harvested, and it only answers anonymous searches.
+"""
+import json
+import logging
+from datetime import timedelta
+
+from dateutil import parser as date_parser
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.query_utils import Q
+from django.utils import timezone
+from owslib import fes
+from owslib.iso import MD_Metadata
+
+from geosafe.helpers.metasearch.csw_helper import csw_pool
+from geosafe.models import HarvestedCatalogue, HarvestedRecord
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def configured_catalogues():
+    """Catalogues configured for metasearch.
+
+    Taken from GEOSAFE_METASEARCH_CATALOGUES setting, a list of dict with
+    url, and optionally user and password keys.
+
+    :rtype: list(dict)
+    """
+    return getattr(settings, 'GEOSAFE_METASEARCH_CATALOGUES', [])
+
+
+def public_catalogues():
+    """Configured catalogues accessed without credentials.
+
+    :rtype: list(dict)
+    """
+    return [c for c in configured_catalogues() if not c.get('user')]
+
+
+def parse_datestamp(datestamp):
+    """Parse record datestamp to a datetime suitable for the database.
+
+    :return: datetime, None if it can't be parsed
+    :rtype: datetime.datetime
+    """
+    if not datestamp:
+        return None
+    try:
+        value = date_parser.parse(datestamp)
+    except (ValueError, OverflowError):
+        return None
+    if settings.USE_TZ and timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.utc)
+    elif not settings.USE_TZ and timezone.is_aware(value):
+        value = timezone.make_naive(value, timezone.utc)
+    return value
+
+
+def record_references(rec):
+    """Service references of an ISO record.
+
+    :param rec: ISO metadata record
+    :type rec: MD_Metadata
+
+    :return: list of dict with scheme and url
+    :rtype: list(dict)
+    """
+    references = []
+    if rec.distribution:
+        for online in rec.distribution.online:
+            if online.url:
+                references.append({
+                    'scheme': online.protocol or '',
+                    'url': online.url
+                })
+    return references
+
+
+def record_keywords(identification):
+    """Descriptive keywords of an ISO record identification.
+
+    Reads keywords2 of recent OWSLib, and keywords of older versions.
+
+    :param identification: identification of the record
+    :type identification: MD_DataIdentification
+
+    :rtype: list(str)
+    """
+    keywords = []
+    for group in getattr(identification, 'keywords2', None) or []:
+        for keyword in getattr(group, 'keywords', None) or []:
+            # recent OWSLib wraps each keyword in MD_Keyword
+            keyword = getattr(keyword, 'name', keyword)
+            if keyword:
+                keywords.append(keyword)
+    if not keywords:
+        for group in getattr(identification, 'keywords', None) or []:
+            if isinstance(group, dict):
+                keywords += [k for k in group.get('keywords') or [] if k]
+    return keywords
+
+
+class CatalogueHarvester(object):
+    """Incrementally harvest public ISO records of a CSW catalogue."""
+
+    def __init__(self, csw_url, page_size=None):
+        self.csw_url = csw_url
+        self.page_size = page_size or getattr(
+            settings, 'GEOSAFE_METASEARCH_HARVEST_PAGE_SIZE', 100)
+
+    def store_record(self, catalogue, rec):
+        """Insert or update a harvested record.
+
+        :return: modification date of the record
+        :rtype: datetime.datetime
+        """
+        identification = rec.identification
+        title = identification.title if identification else None
+        abstract = identification.abstract if identification else None
+        keywords = (
+            identification.supplementalinformation
+            if identification else None)
+        bbox = identification.bbox if identification else None
+        modified = parse_datestamp(rec.datestamp)
+
+        values = {
+            'title': title,
+            'abstract': abstract,
+            'search_text': ' '.join([
+                t for t in [rec.identifier, title, abstract] + (
+                    record_keywords(identification)
+                    if identification else []) if t]),
+            'modified': modified,
+            'inasafe_keywords': keywords,
+            'inasafe_layer': bool(
+                keywords and '<inasafe_keywords/>' in keywords),
+            'references': json.dumps(record_references(rec)),
+            'xml': rec.xml,
+            'bbox_x0': None,
+            'bbox_x1': None,
+            'bbox_y0': None,
+            'bbox_y1': None,
+        }
+        if bbox:
+            try:
+                values.update({
+                    'bbox_x0': float(bbox.minx),
+                    'bbox_x1': float(bbox.maxx),
+                    'bbox_y0': float(bbox.miny),
+                    'bbox_y1': float(bbox.maxy),
+                })
+            except (TypeError, ValueError):
+                pass
+
+        HarvestedRecord.objects.update_or_create(
+            catalogue=catalogue,
+            identifier=rec.identifier,
+            defaults=values)
+        return modified
+
+    def harvest(self):
+        """Harvest records modified since the last harvest.
+
+        :return: number of records harvested
+        :rtype: int
+        """
+        catalogue, _ = HarvestedCatalogue.objects.get_or_create(
+            csw_url=self.csw_url)
+        constraints = []
+        if catalogue.last_modified:
+            constraints.append(fes.PropertyIsGreaterThanOrEqualTo(
+                'apiso:Modified', catalogue.last_modified.isoformat()))
+
+        harvest_time = timezone.now()
+        last_modified = catalogue.last_modified
+        count = 0
+        position = 1
+        with csw_pool.client(self.csw_url) as csw:
+            while True:
+                csw.getrecords2(
+                    typenames='gmd:MD_Metadata',
+                    esn='full',
+                    outputschema='http://www.isotc211.org/2005/gmd',
+                    constraints=constraints,
+                    startposition=position,
+                    maxrecords=self.page_size)
+                with transaction.atomic():
+                    for key in csw.records:
+                        rec = csw.records[key]
+                        if not isinstance(rec, MD_Metadata):
+                            continue
+                        modified = self.store_record(catalogue, rec)
+                        if modified and (
+                                not last_modified or
+                                modified > last_modified):
+                            last_modified = modified
+                        count += 1
+
+                returned = csw.results.get('returned', 0)
+                next_record = csw.results.get('nextrecord', 0)
+                if not returned or not next_record or (
+                        next_record > csw.results.get('matches', 0)):
+                    break
+                position = next_record
+
+        catalogue.last_modified = last_modified
+        catalogue.last_harvested = harvest_time
+        sweep_interval = getattr(
+            settings, 'GEOSAFE_METASEARCH_HARVEST_SWEEP_INTERVAL', 24 * 3600)
+        if not catalogue.last_swept or (
+                catalogue.last_swept <
+                harvest_time - timedelta(seconds=sweep_interval)):
+            self.sweep(catalogue)
+            catalogue.last_swept = harvest_time
+        catalogue.save()
+        LOGGER.info('Harvested %d records from %s' % (count, self.csw_url))
+        return count
+
+    def sweep(self, catalogue):
+        """Delete records the catalogue no longer lists.
+
+        Incremental harvests only see added and modified records, so every
+        identifier is listed with brief records to find the removed ones.
+
+        :return: number of records deleted
+        :rtype: int
+        """
+        identifiers = set()
+        position = 1
+        with csw_pool.client(self.csw_url) as csw:
+            while True:
+                csw.getrecords2(
+                    typenames='gmd:MD_Metadata',
+                    esn='brief',
+                    outputschema='http://www.isotc211.org/2005/gmd',
+                    startposition=position,
+                    maxrecords=self.page_size)
+                identifiers.update(csw.records.keys())
+
+                returned = csw.results.get('returned', 0)
+                next_record = csw.results.get('nextrecord', 0)
+                if not returned or not next_record or (
+                        next_record > csw.results.get('matches', 0)):
+                    break
+                position = next_record
+
+        removed = [
+            identifier for identifier in
+            catalogue.records.values_list('identifier', flat=True)
+            if identifier not in identifiers]
+        # delete in batches to keep the IN clause small
+        for start in range(0, len(removed), 500):
+            catalogue.records.filter(
+                identifier__in=removed[start:start + 500]).delete()
+        LOGGER.info('Deleted %d records removed from %s' % (
+            len(removed), self.csw_url))
+        return len(removed)
+
+
+def search_harvested_records(csw_url, keywords, offset, per_page,
+                             bbox=None, inasafe_only=False, username=None):
+    """Search the local index of a harvested catalogue.
+
+    :param csw_url: CSW endpoint url
+    :type csw_url: str
+
+    :param keywords: keywords to search in identifier, title, abstract
+        and keywords
+    :type keywords: str
+
+    :param offset: offset of the first record of the page
+    :type offset: int
+
+    :param per_page: maximum number of records in a page
+    :type per_page: int
+
+    :param bbox: bounding box filter (x0, y0, x1, y1)
+    :type bbox: (float, float, float, float)
+
+    :param inasafe_only: only return records with InaSAFE keywords
+    :type inasafe_only: bool
+
+    :param username: user name of the search, the index only holds
+        records visible without credentials
+    :type username: str
+
+    :return: dictionary of records and number of matches in the same format
+        as csw_search_records, None if the catalogue is not harvested or
+        the search uses credentials
+    :rtype: dict
+    """
+    if username:
+        return None
+    try:
+        catalogue = HarvestedCatalogue.objects.get(
+            csw_url=csw_url, last_harvested__isnull=False)
+    except HarvestedCatalogue.DoesNotExist:
+        return None
+
+    records = catalogue.records.all()
+    if keywords:
+        if connection.vendor == 'postgresql':
+            records = records.extra(
+                where=["to_tsvector('simple', search_text) @@ "
+                       "plainto_tsquery('simple', %s)"],
+                params=[keywords])
+        else:
+            records = records.filter(search_text__icontains=keywords)
+    if bbox:
+        records = records.filter(
+            Q(bbox_x0__lte=bbox[2]) &
+            Q(bbox_x1__gte=bbox[0]) &
+            Q(bbox_y0__lte=bbox[3]) &
+            Q(bbox_y1__gte=bbox[1]))
+    if inasafe_only:
+        records = records.filter(inasafe_layer=True)
+
+    page = records.order_by('-modified', 'id').values(
+        'identifier', 'title', 'inasafe_keywords', 'inasafe_layer')[
+        offset:offset + per_page]
+    result = []
+    for rec in page:
+        res = {
+            'id': rec['identifier'],
+            'title': rec['title'],
+            'inasafe_keywords': rec['inasafe_keywords'],
+        }
+        if rec['inasafe_keywords']:
+            res['inasafe_layer'] = rec['inasafe_layer']
+        result.append(res)
+    return {
+        'records': result,
+        'matches': records.count(),
+    }
@@ -0,0 +1,318 @@
+# coding=utf-8
+"""Tracking and scheduling of metasearch import jobs.
+
+Identical imports that are not finished yet are merged into one job, the
+unique active key of the job makes concurrent requests agree on it. Jobs
+are dispatched to celery only while the remote host has free download
+slots, the rest wait as pending until a running job of the same host
+finishes. Jobs left queued or running by a dead worker fail after
+GEOSAFE_IMPORT_JOB_TIMEOUT seconds, freeing their slot.
+"""
+import hashlib
+import logging
+import threading
+import time
+import urlparse
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from geosafe.helpers.metasearch.federated import catalogue_credentials
+from geosafe.models import ImportJob
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def import_request_key(service_type, endpoint, service_id, service_version,
+                       bbox):
+    """Hash identifying identical import requests.
+
+    :rtype: str
+    """
+    bbox = ','.join(['%s' % c for c in bbox]) if bbox else ''
+    value = u'|'.join([
+        u'%s' % v for v in [
+            service_type, endpoint, service_id, service_version, bbox]])
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def source_fingerprint(job, remote_modified=None):
+    """Fingerprint of the source of an import job.
+
+    Two imports with the same fingerprint would fetch the same data.
+
+    :param remote_modified: modification date of the catalogue record
+    :type remote_modified: datetime.datetime
+
+    :rtype: str
+    """
+    value = '%s|%s' % (
+        job.request_key,
+        remote_modified.isoformat() if remote_modified else '')
+    return hashlib.sha1(value).hexdigest()
+
+
+def find_imported_layer(job):
+    """Find a layer already imported from the same source as a job.
+
+    Imports of the same feature type or coverage may write into the same
+    layer, so the layer is only reused if no import of another source
+    wrote into it since. Sources without modification date can't tell
+    whether they changed, their layer is reused only for
+    GEOSAFE_IMPORT_REUSE_TTL seconds.
+
+    :return: the imported layer, None if the source was never imported or
+        has changed since
+    :rtype: Layer
+    """
+    if not job.fingerprint:
+        return None
+    previous = ImportJob.objects.filter(
+        fingerprint=job.fingerprint,
+        state=ImportJob.STATE_SUCCESS,
+        layer__isnull=False).exclude(id=job.id).select_related(
+        'layer').order_by('-finished').first()
+    if not previous:
+        return None
+
+    overwritten = ImportJob.objects.filter(
+        layer=previous.layer_id,
+        state=ImportJob.STATE_SUCCESS,
+        finished__gt=previous.finished).exclude(
+        fingerprint=job.fingerprint).exists()
+    if overwritten:
+        return None
+
+    if not job.remote_modified:
+        ttl = getattr(settings, 'GEOSAFE_IMPORT_REUSE_TTL', 24 * 3600)
+        if previous.finished < timezone.now() - timedelta(seconds=ttl):
+            return None
+    return previous.layer
+
+
+def create_import_job(service_type, endpoint, service_id, service_version,
+                      bbox=None, csw_url=None, identifier=None, title=None,
+                      user=None):
+    """Create an import job, or find an identical unfinished one.
+
+    :return: tuple of the job and whether it was created
+    :rtype: (ImportJob, bool)
+    """
+    request_key = import_request_key(
+        service_type, endpoint, service_id, service_version, bbox)
+    existing = ImportJob.objects.filter(active_key=request_key).first()
+    if existing:
+        return existing, False
+
+    try:
+        with transaction.atomic():
+            job = ImportJob.objects.create(
+                request_key=request_key,
+                active_key=request_key,
+                service_type=service_type,
+                endpoint=endpoint,
+                host=urlparse.urlparse(endpoint).netloc,
+                service_id=service_id,
+                service_version=service_version,
+                bbox=','.join(['%s' % c for c in bbox]) if bbox else None,
+                csw_url=csw_url,
+                identifier=identifier,
+                title=title,
+                user=user if user and user.is_authenticated() else None)
+    except IntegrityError:
+        # an identical request created the job first
+        existing = ImportJob.objects.filter(active_key=request_key).first()
+        if not existing:
+            raise
+        return existing, False
+    return job, True
+
+
+def _credentials_key(job):
+    return 'geosafe.import_job.credentials.%s' % job.id
+
+
+def store_job_credentials(job, user, password):
+    """Keep credentials of an import job until it runs.
+
+    Credentials are kept in the cache rather than in the database.
+    """
+    if not user:
+        return
+    cache.set(
+        _credentials_key(job),
+        (user, password),
+        getattr(settings, 'GEOSAFE_IMPORT_CREDENTIALS_TTL', 24 * 3600))
+
+
+def job_credentials(job):
+    """Credentials to connect to the services of an import job.
+
+    :return: tuple of user and password
+    :rtype: (str, str)
+    """
+    credentials = cache.get(_credentials_key(job))
+    if credentials:
+        return credentials
+    return catalogue_credentials(job.csw_url)
+
+
+def schedule_import_jobs(dispatch, host=None):
+    """Dispatch pending jobs of hosts with free download slots.
+
+    :param dispatch: function receiving a job to send to celery, returning
+        the task id
+    :type dispatch: callable
+
+    :param host: only schedule jobs of this host
+    :type host: str
+
+    :return: number of dispatched jobs
+    :rtype: int
+    """
+    expire_import_jobs(host=host)
+    max_per_host = getattr(settings, 'GEOSAFE_IMPORT_MAX_PER_HOST', 2)
+    pending = ImportJob.objects.filter(state=ImportJob.STATE_PENDING)
+    if host:
+        pending = pending.filter(host=host)
+    hosts = pending.values_list('host', flat=True).distinct()
+
+    dispatched = 0
+    for job_host in list(hosts):
+        with transaction.atomic():
+            # lock jobs of this host, so concurrent schedulers don't
+            # exceed the limit
+            jobs = list(ImportJob.objects.select_for_update().filter(
+                host=job_host,
+                state__in=ImportJob.ACTIVE_STATES).order_by('created'))
+            active = len([
+                j for j in jobs if j.state != ImportJob.STATE_PENDING])
+            slots = max(max_per_host - active, 0)
+            to_dispatch = [
+                j for j in jobs if j.state == ImportJob.STATE_PENDING][:slots]
+            for job in to_dispatch:
+                job.state = ImportJob.STATE_QUEUED
+                job.queued = timezone.now()
+                job.save(update_fields=['state', 'queued'])
+
+        for job in to_dispatch:
+            try:
+                job.task_id = dispatch(job)
+                job.save(update_fields=['task_id'])
+                dispatched += 1
+            except Exception as e:
+                LOGGER.exception(e)
+                finish_import_job(job, error=e)
+    return dispatched
+
+
+def expire_import_jobs(host=None):
+    """Fail jobs left queued or running for longer than the timeout.
+
+    A worker dying while a job is queued or running would otherwise keep
+    its download slot, and identical requests merged into it, forever.
+
+    :param host: only expire jobs of this host
+    :type host: str
+
+    :return: number of expired jobs
+    :rtype: int
+    """
+    timeout = getattr(settings, 'GEOSAFE_IMPORT_JOB_TIMEOUT', 6 * 3600)
+    limit = timezone.now() - timedelta(seconds=timeout)
+    stale = ImportJob.objects.filter(
+        state=ImportJob.STATE_QUEUED, queued__lt=limit) | \
+        ImportJob.objects.filter(
+            state=ImportJob.STATE_RUNNING, started__lt=limit)
+    if host:
+        stale = stale.filter(host=host)
+    expired = 0
+    for job in stale:
+        LOGGER.info('Import job %s timed out in state %s' % (
+            job.id, job.state))
+        finish_import_job(
+            job, error='Timed out after %d seconds' % timeout)
+        expired += 1
+    return expired
+
+
+def start_import_job(job):
+    """Mark an import job as running.
+
+    :return: False if the job is no longer queued, e.g. it timed out
+        while waiting for a worker
+    :rtype: bool
+    """
+    started = timezone.now()
+    updated = ImportJob.objects.filter(
+        id=job.id, state=ImportJob.STATE_QUEUED).update(
+        state=ImportJob.STATE_RUNNING,
+        started=started,
+        bytes_transferred=0)
+    if not updated:
+        return False
+    job.state = ImportJob.STATE_RUNNING
+    job.started = started
+    job.bytes_transferred = 0
+    return True
+
+
+def finish_import_job(job, layer=None, error=None):
+    """Mark an import job as finished.
+
+    :param layer: the imported layer
+    :type layer: Layer
+
+    :param error: the error if the import failed
+    :type error: Exception
+    """
+    job.finished = timezone.now()
+    job.layer = layer
+    # identical requests create a new job from now on
+    job.active_key = None
+    if error:
+        job.state = ImportJob.STATE_FAILURE
+        job.error = '%s' % error
+    else:
+        job.state = ImportJob.STATE_SUCCESS
+    job.save(update_fields=[
+        'finished', 'layer', 'active_key', 'state', 'error'])
+    cache.delete(_credentials_key(job))
+
+
+class TransferProgress(object):
+    """Count bytes transferred by an import job.
+
+    Called from several download threads with the size of each received
+    chunk. The count is written to the job at most every interval seconds.
+    """
+
+    def __init__(self, job_id, interval=2.0):
+        self.job_id = job_id
+        self.interval = interval
+        self.total = 0
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+
+    def __call__(self, size):
+        with self._lock:
+            self.total += size
+            if time.time() - self._last_flush < self.interval:
+                return
+            self._last_flush = time.time()
+            total = self.total
+        ImportJob.objects.filter(id=self.job_id).update(
+            bytes_transferred=total)
+
+    def flush(self):
+        with self._lock:
+            total = self.total
+        ImportJob.objects.filter(id=self.job_id).update(
+            bytes_transferred=total)
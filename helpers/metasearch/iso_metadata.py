@@ -0,0 +1,92 @@
+# coding=utf-8
+"""Normalise ISO metadata fetched from remote catalogues.
+
+Catalogues return InaSAFE keywords as escaped text of the
+supplementalInformation node. GeoNode and InaSAFE expect them as XML
+elements, so the escaped text is unwrapped from its CharacterString and
+unescaped. The document is scanned once from start to end, touching only
+the supplementalInformation nodes.
+"""
+from xml.sax.saxutils import unescape
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+SUPPLEMENTAL_INFORMATION_OPEN = '<gmd:supplementalInformation>'
+SUPPLEMENTAL_INFORMATION_CLOSE = '</gmd:supplementalInformation>'
+CHARACTER_STRING_OPEN = '<gco:CharacterString>'
+CHARACTER_STRING_CLOSE = '</gco:CharacterString>'
+
+# entities other than &amp;, &lt; and &gt; handled by unescape
+EXTRA_ENTITIES = {
+    '&quot;': '"',
+    '&apos;': "'",
+}
+
+
+def unwrap_supplemental_information(content):
+    """Unwrap escaped XML of a supplementalInformation node content.
+
+    :param content: text between supplementalInformation tags
+    :type content: unicode
+
+    :return: unescaped XML, or None if the content is not escaped XML
+    :rtype: unicode
+    """
+    stripped = content.strip()
+    if not (stripped.startswith(CHARACTER_STRING_OPEN) and
+            stripped.endswith(CHARACTER_STRING_CLOSE)):
+        return None
+    text = stripped[
+        len(CHARACTER_STRING_OPEN):-len(CHARACTER_STRING_CLOSE)].strip()
+    # plain text supplemental information is left as is
+    if not text.startswith('&lt;'):
+        return None
+    return unescape(text, EXTRA_ENTITIES)
+
+
+def iter_normalised_metadata(metadata_string):
+    """Generate chunks of normalised metadata.
+
+    :param metadata_string: ISO metadata XML
+    :type metadata_string: unicode
+
+    :return: generator of unicode chunks
+    """
+    position = 0
+    length = len(metadata_string)
+    while position < length:
+        start = metadata_string.find(
+            SUPPLEMENTAL_INFORMATION_OPEN, position)
+        if start < 0:
+            break
+        content_start = start + len(SUPPLEMENTAL_INFORMATION_OPEN)
+        end = metadata_string.find(
+            SUPPLEMENTAL_INFORMATION_CLOSE, content_start)
+        if end < 0:
+            break
+
+        keywords = unwrap_supplemental_information(
+            metadata_string[content_start:end])
+        if keywords is None:
+            yield metadata_string[position:end]
+        else:
+            yield metadata_string[position:content_start]
+            yield keywords
+        position = end
+    yield metadata_string[position:]
+
+
+def normalise_iso_metadata(metadata_string):
+    """Unescape InaSAFE keywords in every supplementalInformation node.
+
+    Documents without such node are returned unchanged.
+
+    :param metadata_string: ISO metadata XML
+    :type metadata_string: unicode
+
+    :return: normalised ISO metadata XML
+    :rtype: unicode
+    """
+    return u''.join(iter_normalised_metadata(metadata_string))
@@ -0,0 +1,154 @@
+# coding=utf-8
+"""Bounded cache of CSW records.
+
+Records are keyed by (csw_url, credentials, identifier), so a record fetched
+with one user's credentials is never served to another user. Parsed records
+are kept in a process local LRU, and their raw XML is also stored in the
+Django cache so other processes can rebuild the parsed record without a
+remote fetch.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from owslib.etree import etree
+from owslib.iso import MD_Metadata
+
+from geosafe.helpers.cache import cache_key
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+class ServiceRecord(object):
+    """Record attributes used by the add layer dialog.
+
+    Mirrors the attributes of a Dublin Core CswRecord, built from an ISO
+    record.
+    """
+
+    def __init__(self, iso_record):
+        """
+
+        :param iso_record: ISO metadata record
+        :type iso_record: MD_Metadata
+        """
+        identification = iso_record.identification
+        self.identifier = iso_record.identifier
+        self.title = identification.title if identification else None
+        self.abstract = identification.abstract if identification else None
+        self.bbox = identification.bbox if identification else None
+        self.xml = iso_record.xml
+        self.references = []
+        if iso_record.distribution:
+            for online in iso_record.distribution.online:
+                if online.url:
+                    self.references.append({
+                        'scheme': online.protocol or '',
+                        'url': online.url
+                    })
+
+
+def credential_scope(username=None, password=None):
+    """Part of the record keys identifying the credentials.
+
+    :return: hash of the credentials, empty for anonymous access
+    :rtype: str
+    """
+    if not username:
+        return ''
+    return cache_key('geosafe.csw.credentials', username, password)
+
+
+class CSWRecordCache(object):
+    """LRU cache of CSW records keyed by catalogue, credentials and
+    identifier."""
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size or getattr(
+            settings, 'GEOSAFE_CSW_RECORD_CACHE_SIZE', 256)
+        self.ttl = ttl or getattr(
+            settings, 'GEOSAFE_CSW_RECORD_CACHE_TTL', 3600)
+        self._lock = threading.Lock()
+        self._records = OrderedDict()
+
+    @classmethod
+    def cache_key(cls, csw_url, scope, identifier):
+        return cache_key('geosafe.csw.record', csw_url, scope, identifier)
+
+    def put(self, csw_url, record, username=None, password=None):
+        """Store a parsed ISO record.
+
+        :param csw_url: CSW endpoint url
+        :type csw_url: str
+
+        :param record: ISO metadata record
+        :type record: MD_Metadata
+
+        :param username: user name the record was fetched with
+        :type username: str
+
+        :param password: password the record was fetched with
+        :type password: str
+        """
+        if not record or not record.identifier:
+            return
+        scope = credential_scope(username, password)
+        key = (csw_url, scope, record.identifier)
+        with self._lock:
+            self._records.pop(key, None)
+            self._records[key] = record
+            while len(self._records) > self.max_size:
+                self._records.popitem(last=False)
+        if record.xml:
+            cache.set(
+                self.cache_key(csw_url, scope, record.identifier),
+                record.xml,
+                self.ttl)
+
+    def get(self, csw_url, identifier, username=None, password=None):
+        """Get a parsed ISO record fetched with the same credentials.
+
+        :return: ISO metadata record, None if not cached
+        :rtype: MD_Metadata
+        """
+        scope = credential_scope(username, password)
+        key = (csw_url, scope, identifier)
+        with self._lock:
+            record = self._records.pop(key, None)
+            if record is not None:
+                self._records[key] = record
+                return record
+
+        xml = cache.get(self.cache_key(csw_url, scope, identifier))
+        if not xml:
+            return None
+        record = MD_Metadata(etree.fromstring(xml))
+        with self._lock:
+            self._records[key] = record
+            while len(self._records) > self.max_size:
+                self._records.popitem(last=False)
+        return record
+
+    def get_service_record(self, csw_url, identifier, username=None,
+                           password=None):
+        """Get a cached record in the form used by the add layer dialog.
+
+        :rtype: ServiceRecord
+        """
+        record = self.get(
+            csw_url, identifier, username=username, password=password)
+        if record is None:
+            return None
+        return ServiceRecord(record)
+
+    def invalidate(self, csw_url, identifier, username=None,
+                   password=None):
+        scope = credential_scope(username, password)
+        with self._lock:
+            self._records.pop((csw_url, scope, identifier), None)
+        cache.delete(self.cache_key(csw_url, scope, identifier))
+
+
+record_cache = CSWRecordCache()
@@ -0,0 +1,240 @@
+# coding=utf-8
+"""Tiled download of WCS coverages.
+
+The requested bbox is split into tiles which are fetched concurrently with
+a bounded number of connections and retried independently. The tiles are
+then mosaicked locally into one GeoTIFF.
+"""
+import logging
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import urllib
+import urlparse
+from multiprocessing.pool import ThreadPool
+
+import requests
+from django.conf import settings
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+LOGGER = logging.getLogger(__name__)
+
+# emulate browser, like download_file
+USER_AGENT = ('Mozilla/5.0 (X11; U; Linux i686) '
+              'Gecko/20071127 Firefox/2.0.0.11')
+
+
+class TileDownloadError(Exception):
+    pass
+
+
+def split_bbox(bbox, tile_size):
+    """Split a bbox into tiles of at most tile_size degrees.
+
+    :param bbox: bbox (minx, miny, maxx, maxy)
+    :type bbox: list(float)
+
+    :param tile_size: maximum width and height of a tile
+    :type tile_size: float
+
+    :return: list of tile bbox, in row major order
+    :rtype: list(tuple)
+    """
+    minx, miny, maxx, maxy = [float(c) for c in bbox]
+    columns = max(int(math.ceil((maxx - minx) / tile_size)), 1)
+    rows = max(int(math.ceil((maxy - miny) / tile_size)), 1)
+    width = (maxx - minx) / columns
+    height = (maxy - miny) / rows
+    tiles = []
+    for row in range(rows):
+        for column in range(columns):
+            tiles.append((
+                minx + column * width,
+                miny + row * height,
+                minx + (column + 1) * width if column < columns - 1 else maxx,
+                miny + (row + 1) * height if row < rows - 1 else maxy,
+            ))
+    return tiles
+
+
+def coverage_url(endpoint, version, coverage_id, bbox=None):
+    """Build GetCoverage url of a coverage.
+
+    :return: url
+    :rtype: str
+    """
+    endpoint_parsed = urlparse.urlparse(endpoint)
+    q_dict = {
+        'version': version,
+        'coverageid': coverage_id,
+        'format': 'image/tiff',
+        'request': 'GetCoverage',
+        'service': 'WCS',
+        'crs': 'EPSG:4326',
+    }
+    if bbox:
+        q_dict['bbox'] = ','.join(['%s' % c for c in bbox])
+    parsed_url = urlparse.ParseResult(
+        scheme=endpoint_parsed.scheme,
+        netloc=endpoint_parsed.netloc,
+        path=endpoint_parsed.path,
+        params=None,
+        query=urllib.urlencode(q_dict),
+        fragment=None
+    )
+    return parsed_url.geturl()
+
+
+def fetch_tile(url, destination, user=None, password=None, retries=3,
+               timeout=None, progress_callback=None):
+    """Fetch one tile with retries.
+
+    :param url: GetCoverage url of the tile
+    :type url: str
+
+    :param destination: path to write the tile
+    :type destination: str
+
+    :param progress_callback: called with the size of each received chunk
+    :type progress_callback: callable
+
+    :return: destination path
+    :rtype: str
+    """
+    timeout = timeout or getattr(settings, 'GEOSAFE_WCS_TILE_TIMEOUT', 120)
+    auth = (user, password) if user else None
+    last_error = None
+    for attempt in range(retries):
+        try:
+            r = requests.get(
+                url,
+                headers={'User-Agent': USER_AGENT},
+                stream=True,
+                auth=auth,
+                timeout=timeout)
+            r.raise_for_status()
+            content_type = r.headers.get('content-type', '')
+            if 'xml' in content_type:
+                # service exception report instead of coverage
+                raise TileDownloadError(r.text[:1000])
+            with open(destination, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=64 * 1024):
+                    if chunk:
+                        f.write(chunk)
+                        if progress_callback:
+                            progress_callback(len(chunk))
+            return destination
+        except (requests.RequestException, TileDownloadError) as e:
+            last_error = e
+            LOGGER.info('Tile %s failed, attempt %d: %s' % (
+                url, attempt + 1, e))
+            if attempt + 1 < retries:
+                time.sleep(2 ** attempt)
+    raise TileDownloadError('Failed to fetch %s: %s' % (url, last_error))
+
+
+def mosaic(tile_paths, destination):
+    """Mosaic tiles into one GeoTIFF.
+
+    :param tile_paths: list of tile GeoTIFF paths
+    :type tile_paths: list(str)
+
+    :param destination: output GeoTIFF path
+    :type destination: str
+
+    :return: destination path
+    :rtype: str
+    """
+    if len(tile_paths) == 1:
+        shutil.move(tile_paths[0], destination)
+        return destination
+
+    vrt_path = '%s.vrt' % destination
+    try:
+        from osgeo import gdal
+        has_utilities = hasattr(gdal, 'BuildVRT')
+    except ImportError:
+        has_utilities = False
+
+    try:
+        if has_utilities:
+            # the returned dataset isn't kept, so the VRT is flushed to
+            # disk before it is translated
+            gdal.BuildVRT(vrt_path, tile_paths)
+            gdal.Translate(
+                destination, vrt_path,
+                format='GTiff',
+                creationOptions=['COMPRESS=DEFLATE', 'TILED=YES',
+                                 'BIGTIFF=IF_SAFER'])
+        else:
+            subprocess.check_call(['gdalbuildvrt', vrt_path] + tile_paths)
+            subprocess.check_call([
+                'gdal_translate', '-of', 'GTiff',
+                '-co', 'COMPRESS=DEFLATE', '-co', 'TILED=YES',
+                '-co', 'BIGTIFF=IF_SAFER',
+                vrt_path, destination])
+    finally:
+        if os.path.exists(vrt_path):
+            os.remove(vrt_path)
+    return destination
+
+
+def download_coverage(endpoint, version, coverage_id, destination,
+                      bbox=None, user=None, password=None,
+                      progress_callback=None):
+    """Download a coverage as GeoTIFF, tiling large bbox.
+
+    :param endpoint: WCS endpoint url
+    :type endpoint: str
+
+    :param version: WCS version
+    :type version: str
+
+    :param coverage_id: coverage identifier
+    :type coverage_id: str
+
+    :param destination: path of the output GeoTIFF
+    :type destination: str
+
+    :param bbox: bbox (minx, miny, maxx, maxy), None for whole coverage
+    :type bbox: list
+
+    :param progress_callback: called with the size of each received chunk
+    :type progress_callback: callable
+
+    :return: destination path
+    :rtype: str
+    """
+    tile_size = getattr(settings, 'GEOSAFE_WCS_TILE_SIZE', 1.0)
+    workers = getattr(settings, 'GEOSAFE_WCS_DOWNLOAD_WORKERS', 4)
+    retries = getattr(settings, 'GEOSAFE_WCS_TILE_RETRIES', 3)
+
+    tiles = split_bbox(bbox, tile_size) if bbox else [None]
+    # tiles go next to the destination, in the scratch space of the task
+    tile_dir = tempfile.mkdtemp(
+        prefix='wcs-tiles-', dir=os.path.dirname(destination))
+    pool = ThreadPool(min(workers, len(tiles)))
+    try:
+        def fetch(args):
+            index, tile_bbox = args
+            return fetch_tile(
+                coverage_url(endpoint, version, coverage_id, tile_bbox),
+                os.path.join(tile_dir, 'tile_%d.tif' % index),
+                user=user,
+                password=password,
+                retries=retries,
+                progress_callback=progress_callback)
+
+        tile_paths = pool.map(fetch, list(enumerate(tiles)))
+        LOGGER.info('Fetched %d tiles of %s' % (len(tile_paths), coverage_id))
+        return mosaic(tile_paths, destination)
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(tile_dir, ignore_errors=True)
@@ -0,0 +1,403 @@
+# coding=utf-8
+"""Paged download of WFS features.
+
+Features are requested in pages using startIndex with count (WFS 2.0) or
+maxFeatures (WFS 1.1), sorted on a property so pages don't overlap. If the
+service version has no paging, or the server can't report the number of
+features, the bbox is split into tiles instead. Pages are fetched concurrently in bounded batches and appended to
+the output shapefile one page at a time, so memory use doesn't depend on the
+number of features.
+"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+import urllib
+import urlparse
+from multiprocessing.pool import ThreadPool
+from xml.etree import ElementTree
+
+import requests
+from django.conf import settings
+
+from geosafe.helpers.metasearch.wcs_download import (
+    USER_AGENT,
+    TileDownloadError,
+    split_bbox)
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+DEFAULT_VERSION = '1.1.0'
+
+
+def paging_version(version):
+    """WFS version used for the requests.
+
+    :param version: version advertised by the service, None if unknown
+    :type version: str
+
+    :return: '2.0.0' or '1.1.0' when the version supports paging, else
+        '1.0.0'
+    :rtype: str
+    """
+    version = (version or DEFAULT_VERSION).strip()
+    if version.startswith('2.'):
+        return '2.0.0'
+    if version.startswith('1.0'):
+        return '1.0.0'
+    return DEFAULT_VERSION
+
+
+def feature_url(endpoint, typename, version=DEFAULT_VERSION, bbox=None,
+                start_index=None, count=None, sort_by=None,
+                result_type=None):
+    """Build WFS GetFeature url returning GeoJSON.
+
+    :param version: WFS version, from paging_version
+    :type version: str
+
+    :param sort_by: property name to sort the features with
+    :type sort_by: str
+
+    :return: url
+    :rtype: str
+    """
+    endpoint_parsed = urlparse.urlparse(endpoint)
+    wfs_2 = version.startswith('2.')
+    q_dict = {
+        'version': version,
+        'outputFormat': 'json',
+        'request': 'GetFeature',
+        'service': 'WFS',
+        'srsName': 'EPSG:4326',
+    }
+    q_dict['typeNames' if wfs_2 else 'typeName'] = typename
+    if bbox:
+        bbox = ['%s' % c for c in bbox]
+        if wfs_2:
+            # explicit crs keeps x/y axis order in WFS 2.0
+            bbox.append('EPSG:4326')
+        q_dict['bbox'] = ','.join(bbox)
+    if start_index is not None:
+        q_dict['startIndex'] = start_index
+        q_dict['count' if wfs_2 else 'maxFeatures'] = count
+    if sort_by:
+        q_dict['sortBy'] = '%s %s' % (sort_by, 'ASC' if wfs_2 else 'A')
+    if result_type:
+        q_dict['resultType'] = result_type
+        q_dict.pop('outputFormat')
+    parsed_url = urlparse.ParseResult(
+        scheme=endpoint_parsed.scheme,
+        netloc=endpoint_parsed.netloc,
+        path=endpoint_parsed.path,
+        params=None,
+        query=urllib.urlencode(q_dict),
+        fragment=None
+    )
+    return parsed_url.geturl()
+
+
+def count_features(endpoint, typename, version=DEFAULT_VERSION, bbox=None,
+                   user=None, password=None):
+    """Ask the number of features matching a request.
+
+    :return: number of features, None if the server doesn't tell
+    :rtype: int
+    """
+    auth = (user, password) if user else None
+    try:
+        r = requests.get(
+            feature_url(
+                endpoint, typename, version=version, bbox=bbox,
+                result_type='hits'),
+            headers={'User-Agent': USER_AGENT},
+            auth=auth,
+            timeout=getattr(settings, 'GEOSAFE_WFS_PAGE_TIMEOUT', 120))
+        r.raise_for_status()
+        root = ElementTree.fromstring(r.content)
+    except (requests.RequestException, ElementTree.ParseError) as e:
+        LOGGER.info('Feature count request failed: %s' % e)
+        return None
+
+    for attribute in ['numberMatched', 'numberOfFeatures']:
+        value = root.get(attribute)
+        if value and value.isdigit():
+            return int(value)
+    return None
+
+
+def sort_property(endpoint, typename, version=DEFAULT_VERSION, user=None,
+                  password=None):
+    """First non geometry property of a feature type, to sort pages.
+
+    :return: property name, None if the feature type can't be described
+    :rtype: str
+    """
+    endpoint_parsed = urlparse.urlparse(endpoint)
+    q_dict = {
+        'version': version,
+        'request': 'DescribeFeatureType',
+        'service': 'WFS',
+    }
+    q_dict['typeNames' if version.startswith('2.') else 'typeName'] = \
+        typename
+    url = urlparse.ParseResult(
+        scheme=endpoint_parsed.scheme,
+        netloc=endpoint_parsed.netloc,
+        path=endpoint_parsed.path,
+        params=None,
+        query=urllib.urlencode(q_dict),
+        fragment=None
+    ).geturl()
+    auth = (user, password) if user else None
+    try:
+        r = requests.get(
+            url,
+            headers={'User-Agent': USER_AGENT},
+            auth=auth,
+            timeout=getattr(settings, 'GEOSAFE_WFS_PAGE_TIMEOUT', 120))
+        r.raise_for_status()
+        root = ElementTree.fromstring(r.content)
+    except (requests.RequestException, ElementTree.ParseError) as e:
+        LOGGER.info('DescribeFeatureType request failed: %s' % e)
+        return None
+
+    xsd = '{http://www.w3.org/2001/XMLSchema}'
+    for sequence in root.iter('%ssequence' % xsd):
+        for element in sequence.findall('%selement' % xsd):
+            name = element.get('name')
+            if name and not element.get('type', '').startswith('gml:'):
+                return name
+    return None
+
+
+def fetch_page(url, destination, user=None, password=None, retries=3,
+               progress_callback=None):
+    """Stream one page of features to a file.
+
+    :param progress_callback: called with the size of each received chunk
+    :type progress_callback: callable
+
+    :return: destination path
+    :rtype: str
+    """
+    timeout = getattr(settings, 'GEOSAFE_WFS_PAGE_TIMEOUT', 120)
+    auth = (user, password) if user else None
+    last_error = None
+    for attempt in range(retries):
+        try:
+            r = requests.get(
+                url,
+                headers={'User-Agent': USER_AGENT},
+                stream=True,
+                auth=auth,
+                timeout=timeout)
+            r.raise_for_status()
+            if 'xml' in r.headers.get('content-type', ''):
+                # service exception report instead of features
+                raise TileDownloadError(r.text[:1000])
+            with open(destination, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=64 * 1024):
+                    if chunk:
+                        f.write(chunk)
+                        if progress_callback:
+                            progress_callback(len(chunk))
+            return destination
+        except (requests.RequestException, TileDownloadError) as e:
+            last_error = e
+            LOGGER.info('Page %s failed, attempt %d: %s' % (
+                url, attempt + 1, e))
+    raise TileDownloadError('Failed to fetch %s: %s' % (url, last_error))
+
+
+class FeatureWriter(object):
+    """Append GeoJSON pages to a shapefile."""
+
+    def __init__(self, path):
+        self.path = path
+        self.datasource = None
+        self.layer = None
+        self.fields = []
+        self.count = 0
+
+    def write(self, geojson_path):
+        """Append features of a GeoJSON file.
+
+        :param geojson_path: path to GeoJSON page
+        :type geojson_path: str
+        """
+        from osgeo import ogr
+        source = ogr.Open(geojson_path)
+        if not source:
+            return
+        source_layer = source.GetLayer(0)
+        if not source_layer.GetFeatureCount():
+            return
+
+        source_definition = source_layer.GetLayerDefn()
+        source_fields = [
+            source_definition.GetFieldDefn(i).GetName()
+            for i in range(source_definition.GetFieldCount())]
+        if self.layer is None:
+            driver = ogr.GetDriverByName('ESRI Shapefile')
+            self.datasource = driver.CreateDataSource(self.path)
+            layer_name = os.path.splitext(os.path.basename(self.path))[0]
+            self.layer = self.datasource.CopyLayer(source_layer, layer_name)
+            # the schema is set by the first page, fields are mapped by
+            # their source name since shapefile truncates the names
+            self.fields = source_fields
+            self.count += self.layer.GetFeatureCount()
+        else:
+            field_map = [
+                self.fields.index(name) if name in self.fields else -1
+                for name in source_fields]
+            dropped = [
+                name for name in source_fields if name not in self.fields]
+            if dropped:
+                LOGGER.warning(
+                    'Fields %s of %s are not in the first page, their '
+                    'values are dropped' % (
+                        ', '.join(dropped), self.path))
+            definition = self.layer.GetLayerDefn()
+            source_layer.ResetReading()
+            for feature in source_layer:
+                out_feature = ogr.Feature(definition)
+                out_feature.SetFromWithMap(feature, 1, field_map)
+                self.layer.CreateFeature(out_feature)
+                self.count += 1
+        source = None
+
+    def close(self):
+        if self.datasource:
+            self.datasource.SyncToDisk()
+        self.layer = None
+        self.datasource = None
+
+
+def remove_duplicates(geojson_path, seen):
+    """Drop features already written by another tile.
+
+    :param geojson_path: path to GeoJSON page, rewritten in place
+    :type geojson_path: str
+
+    :param seen: identifiers of features already written, updated
+    :type seen: set
+    """
+    with open(geojson_path) as f:
+        page = json.load(f)
+    features = []
+    for feature in page.get('features', []):
+        feature_id = feature.get('id')
+        if feature_id is not None:
+            if feature_id in seen:
+                continue
+            seen.add(feature_id)
+        features.append(feature)
+    page['features'] = features
+    with open(geojson_path, 'w') as f:
+        json.dump(page, f)
+
+
+def download_features(endpoint, typename, destination, version=None,
+                      bbox=None, user=None, password=None,
+                      progress_callback=None):
+    """Download features of a feature type into a shapefile.
+
+    :param endpoint: WFS endpoint url
+    :type endpoint: str
+
+    :param typename: feature type name
+    :type typename: str
+
+    :param destination: path of the output shapefile
+    :type destination: str
+
+    :param version: WFS version advertised by the service
+    :type version: str
+
+    :param bbox: bbox (minx, miny, maxx, maxy), None for all features
+    :type bbox: list
+
+    :param progress_callback: called with the size of each received chunk
+    :type progress_callback: callable
+
+    :return: destination path, None if no features were found
+    :rtype: str
+    """
+    page_size = getattr(settings, 'GEOSAFE_WFS_PAGE_SIZE', 5000)
+    workers = getattr(settings, 'GEOSAFE_WFS_DOWNLOAD_WORKERS', 4)
+    retries = getattr(settings, 'GEOSAFE_WFS_PAGE_RETRIES', 3)
+
+    version = paging_version(version)
+    total = None
+    if version != '1.0.0':
+        total = count_features(
+            endpoint, typename, version=version, bbox=bbox, user=user,
+            password=password)
+    if total is not None:
+        sort_by = None
+        if total > page_size:
+            # without a sort order, pages may overlap or skip features
+            sort_by = sort_property(
+                endpoint, typename, version=version, user=user,
+                password=password)
+            if not sort_by:
+                LOGGER.warning(
+                    'No property to sort %s, pages may be inconsistent' %
+                    typename)
+        urls = [
+            feature_url(
+                endpoint, typename, version=version, bbox=bbox,
+                start_index=start, count=page_size, sort_by=sort_by)
+            for start in range(0, total, page_size)]
+        deduplicate = len(urls) > 1
+    else:
+        # no paging support, split the request spatially instead
+        tile_size = getattr(settings, 'GEOSAFE_WFS_TILE_SIZE', 0.5)
+        tiles = split_bbox(bbox, tile_size) if bbox else [None]
+        urls = [
+            feature_url(endpoint, typename, version=version, bbox=tile)
+            for tile in tiles]
+        deduplicate = len(urls) > 1
+
+    # pages go next to the destination, in the scratch space of the task
+    page_dir = tempfile.mkdtemp(
+        prefix='wfs-pages-', dir=os.path.dirname(destination))
+    writer = FeatureWriter(destination)
+    seen = set()
+    pool = ThreadPool(workers)
+    try:
+        def fetch(args):
+            index, url = args
+            return fetch_page(
+                url,
+                os.path.join(page_dir, 'page_%d.json' % index),
+                user=user,
+                password=password,
+                retries=retries,
+                progress_callback=progress_callback)
+
+        pages = list(enumerate(urls))
+        # fetch in batches so only a few pages are on disk at once
+        for start in range(0, len(pages), workers):
+            for page_path in pool.map(fetch, pages[start:start + workers]):
+                if deduplicate:
+                    remove_duplicates(page_path, seen)
+                writer.write(page_path)
+                os.remove(page_path)
+    finally:
+        writer.close()
+        pool.close()
+        pool.join()
+        shutil.rmtree(page_dir, ignore_errors=True)
+
+    LOGGER.info('Fetched %d features of %s' % (writer.count, typename))
+    if not writer.count:
+        return None
+    return destination
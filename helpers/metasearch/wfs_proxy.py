@@ -0,0 +1,274 @@
+# coding=utf-8
+"""Streaming proxy of WFS GeoJSON used by the metasearch map preview.
+
+Upstream responses are streamed to the client gzip compressed, without
+buffering the whole body. Requests can be limited to a bbox, which is
+snapped to a tile grid depending on the zoom level so responses can be
+cached per (endpoint, typename, bbox tile). When a zoom level is given,
+geometries are simplified to the resolution of that zoom.
+"""
+import json
+import logging
+import math
+import urllib
+import urlparse
+import zlib
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from geosafe.helpers.cache import cache_key
+from geosafe.helpers.metasearch.wcs_download import USER_AGENT
+from geosafe.helpers.scratch import ScratchSpace
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+LOGGER = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# maximum zoom level used to snap bbox and simplify geometries
+MAX_ZOOM = 20
+
+
+def tile_bbox(bbox, zoom):
+    """Snap a bbox outwards to the tile grid of a zoom level.
+
+    :param bbox: bbox (minx, miny, maxx, maxy)
+    :type bbox: list(float)
+
+    :param zoom: zoom level
+    :type zoom: int
+
+    :return: snapped bbox
+    :rtype: tuple
+    """
+    size = 360.0 / (2 ** zoom)
+    minx, miny, maxx, maxy = bbox
+    return (
+        max(math.floor(minx / size) * size, -180.0),
+        max(math.floor(miny / size) * size, -90.0),
+        min(math.ceil(maxx / size) * size, 180.0),
+        min(math.ceil(maxy / size) * size, 90.0),
+    )
+
+
+def simplify_tolerance(zoom):
+    """Geometry tolerance in degrees of one pixel at a zoom level.
+
+    :rtype: float
+    """
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def proxy_url(endpoint, typename, bbox=None):
+    """Build GetFeature url of the proxied request.
+
+    :return: url
+    :rtype: str
+    """
+    endpoint_parsed = urlparse.urlparse(endpoint)
+    q_dict = {
+        'version': '1.0.0',
+        'typename': typename,
+        'outputFormat': 'json',
+        'request': 'GetFeature',
+        'service': 'WFS',
+        'srsName': 'EPSG:4326',
+    }
+    if bbox:
+        q_dict['bbox'] = ','.join(['%s' % c for c in bbox])
+    parsed_url = urlparse.ParseResult(
+        scheme=endpoint_parsed.scheme,
+        netloc=endpoint_parsed.netloc,
+        path=endpoint_parsed.path,
+        params=None,
+        query=urllib.urlencode(q_dict),
+        fragment=None
+    )
+    return parsed_url.geturl()
+
+
+def gzip_stream(chunks):
+    """Gzip compress a stream of chunks.
+
+    :param chunks: iterable of byte strings
+    :return: generator of compressed byte strings
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def simplified_stream(response, tolerance):
+    """Stream GeoJSON of simplified features of an upstream response.
+
+    The upstream body is spooled to a temporary file, then features are
+    read, simplified and written one by one.
+
+    :param response: upstream streaming response
+    :type response: requests.Response
+
+    :param tolerance: simplification tolerance in degrees
+    :type tolerance: float
+
+    :return: generator of byte strings
+    """
+    from osgeo import ogr
+    scratch = ScratchSpace('wfs-proxy')
+    path = scratch.path('upstream.json')
+    try:
+        with open(path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if chunk:
+                    f.write(chunk)
+        response.close()
+
+        datasource = ogr.Open(path)
+        yield b'{"type": "FeatureCollection", "features": ['
+        if datasource:
+            layer = datasource.GetLayer(0)
+            first = True
+            for feature in layer:
+                geometry = feature.GetGeometryRef()
+                if geometry is not None:
+                    simplified = geometry.SimplifyPreserveTopology(tolerance)
+                    if simplified is not None and not simplified.IsEmpty():
+                        feature.SetGeometry(simplified)
+                data = feature.ExportToJson()
+                if not first:
+                    data = ',' + data
+                first = False
+                yield data.encode('utf-8')
+        datasource = None
+        yield b']}'
+    finally:
+        # an abandoned stream leaves the file to the scratch sweeper
+        scratch.cleanup()
+
+
+class WFSProxy(object):
+    """Fetch, simplify, compress and cache proxied WFS responses."""
+
+    def __init__(self, endpoint, typename, bbox=None, zoom=None,
+                 user=None, password=None):
+        self.endpoint = endpoint
+        self.typename = typename
+        self.zoom = None
+        if zoom is not None:
+            self.zoom = max(0, min(int(zoom), MAX_ZOOM))
+        self.bbox = None
+        if bbox:
+            bbox = [float(c) for c in bbox]
+            if self.zoom is not None:
+                bbox = tile_bbox(bbox, self.zoom)
+            self.bbox = tuple(bbox)
+        self.user = user
+        self.password = password
+
+    def cache_key(self):
+        return cache_key(
+            'geosafe.wfs_proxy',
+            self.endpoint, self.typename, self.bbox, self.zoom,
+            self.user, self.password)
+
+    def cached(self):
+        """Cached gzip compressed body, None if not cached.
+
+        :rtype: bytes
+        """
+        return cache.get(self.cache_key())
+
+    def open_upstream(self):
+        auth = (self.user, self.password) if self.user else None
+        url = proxy_url(self.endpoint, self.typename, bbox=self.bbox)
+        LOGGER.info('Proxy to url: %s' % url)
+        response = requests.get(
+            url,
+            headers={'User-Agent': USER_AGENT},
+            stream=True,
+            auth=auth,
+            timeout=getattr(settings, 'GEOSAFE_WFS_PROXY_TIMEOUT', 60))
+        response.raise_for_status()
+        return response
+
+    def stream(self):
+        """Gzip compressed body, streamed from upstream or cache.
+
+        The body is stored in the cache when complete, unless it is larger
+        than GEOSAFE_WFS_PROXY_CACHE_MAX_BYTES.
+
+        The upstream request is sent before returning, so upstream errors
+        are raised here rather than while streaming.
+
+        :return: iterator of compressed byte strings
+        """
+        body = self.cached()
+        if body is not None:
+            return iter([body])
+        return self._stream_upstream(self.open_upstream())
+
+    def _stream_upstream(self, response):
+        if self.zoom is not None:
+            chunks = simplified_stream(
+                response, simplify_tolerance(self.zoom))
+        else:
+            chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+
+        max_bytes = getattr(
+            settings, 'GEOSAFE_WFS_PROXY_CACHE_MAX_BYTES', 5 * 1024 ** 2)
+        buffered = []
+        buffered_size = 0
+        for data in gzip_stream(c for c in chunks if c):
+            if buffered is not None:
+                buffered.append(data)
+                buffered_size += len(data)
+                if buffered_size > max_bytes:
+                    buffered = None
+            yield data
+
+        if buffered is not None:
+            cache.set(
+                self.cache_key(),
+                b''.join(buffered),
+                getattr(settings, 'GEOSAFE_WFS_PROXY_CACHE_TTL', 300))
+
+
+def decompress_stream(chunks):
+    """Decompress a stream of gzip chunks, for clients without gzip.
+
+    :return: generator of byte strings
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    yield decompressor.flush()
+
+
+def parse_bbox(value):
+    """Parse bbox request parameter.
+
+    :param value: comma separated or JSON list of minx, miny, maxx, maxy
+    :type value: str
+
+    :return: list of float, None if not given
+    :rtype: list(float)
+    """
+    if not value:
+        return None
+    if value.startswith('['):
+        bbox = json.loads(value)
+    else:
+        bbox = value.split(',')
+    bbox = [float(c) for c in bbox]
+    if len(bbox) != 4:
+        raise ValueError('bbox requires 4 values')
+    return bbox
@@ -0,0 +1,5 @@
+# coding=utf-8
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+
+__date__ = '10/19/16'
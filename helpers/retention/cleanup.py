@@ -0,0 +1,232 @@
+# coding=utf-8
+"""Bulk cleanup engine for impact results.
+
+Analyses are removed in bounded chunks ordered by id. Storage side effects
+(report files and impact layers, which touch GeoServer and the catalogue)
+are run concurrently in a thread pool, while database rows are removed with
+one bulk query per chunk. The engine remembers the last processed id so an
+interrupted run can be resumed.
+"""
+import logging
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from geosafe.models import Analysis, Metadata
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+LOGGER = logging.getLogger(__name__)
+
+# cache key to store the id of the last cleaned analysis
+CLEANUP_CURSOR_KEY = 'geosafe.cleanup.cursor'
+
+
+def _delete_analysis_storage(analysis):
+    """Remove report files and output layers of an analysis.
+
+    Executed in a worker thread, so the thread database connection is
+    closed afterwards. The impact layer, whose deletion cascades to the
+    analysis, is only deleted once every other side effect succeeded.
+
+    :param analysis: the analysis to clean
+    :type analysis: Analysis
+
+    :return: True if every side effect succeeded
+    :rtype: bool
+    """
+    success = True
+    try:
+        for report in [analysis.report_map, analysis.report_table]:
+            if report:
+                try:
+                    report.delete(save=False)
+                except Exception as e:
+                    LOGGER.exception(e)
+                    success = False
+
+        for layer in analysis.extra_output_layers():
+            try:
+                layer.delete()
+            except Exception as e:
+                LOGGER.exception(e)
+                success = False
+
+        # the analysis row is kept to retry a failed side effect later
+        if success and analysis.impact_layer_id:
+            try:
+                # deleting the layer cascades to the analysis row
+                analysis.impact_layer.delete()
+            except Exception as e:
+                LOGGER.exception(e)
+                success = False
+    finally:
+        connection.close()
+    return success
+
+
+class CleanupEngine(object):
+    """Delete unkept analyses and orphaned impact metadata in bulk."""
+
+    def __init__(self, chunk_size=None, workers=None, progress_callback=None):
+        """
+
+        :param chunk_size: number of analyses deleted in one chunk
+        :type chunk_size: int
+
+        :param workers: number of threads removing storage concurrently
+        :type workers: int
+
+        :param progress_callback: called with the progress dictionary after
+            every chunk
+        :type progress_callback: callable
+        """
+        self.chunk_size = chunk_size or getattr(
+            settings, 'GEOSAFE_CLEANUP_CHUNK_SIZE', 100)
+        self.workers = workers or getattr(
+            settings, 'GEOSAFE_CLEANUP_WORKERS', 4)
+        self.progress_callback = progress_callback
+        self.progress = {
+            'deleted': 0,
+            'failed': 0,
+            'orphans': 0,
+            'last_id': 0,
+            'elapsed': 0.0,
+            'rate': 0.0,
+        }
+
+    def analysis_queryset(self):
+        """Analyses eligible for cleanup.
+
+        :rtype: QuerySet
+        """
+        return Analysis.objects.filter(keep=False)
+
+    def orphan_queryset(self):
+        """Impact metadata not referred by any analysis.
+
+        Resolved with a single outer join instead of one query per
+        metadata.
+
+        :rtype: QuerySet
+        """
+        return Metadata.objects.filter(
+            layer_purpose='impact',
+            layer__impact_layer__isnull=True,
+            layer__analysis_outputs__isnull=True)
+
+    def report(self, start_time):
+        elapsed = time.time() - start_time
+        self.progress['elapsed'] = elapsed
+        if elapsed > 0:
+            self.progress['rate'] = self.progress['deleted'] / elapsed
+        LOGGER.info(
+            'Cleanup progress: %(deleted)d deleted, %(failed)d failed, '
+            'last id %(last_id)d, %(rate).2f analyses/s' % self.progress)
+        if self.progress_callback:
+            self.progress_callback(dict(self.progress))
+
+    def delete_chunk(self, analyses, pool):
+        """Delete one chunk of analyses.
+
+        :param analyses: list of analyses in this chunk
+        :type analyses: list(Analysis)
+
+        :param pool: thread pool for storage removal
+        :type pool: ThreadPool
+
+        :return: number of analyses deleted
+        :rtype: int
+        """
+        deleted_ids, failed_ids = self.delete_chunk_ids(analyses, pool)
+        return len(deleted_ids)
+
+    def delete_chunk_ids(self, analyses, pool):
+        """Delete one chunk of analyses, telling which ones failed.
+
+        :param analyses: list of analyses in this chunk
+        :type analyses: list(Analysis)
+
+        :param pool: thread pool for storage removal
+        :type pool: ThreadPool
+
+        :return: ids of deleted analyses and ids of failed ones
+        :rtype: (list(int), list(int))
+        """
+        results = pool.map(_delete_analysis_storage, analyses)
+        failed_ids = [
+            a.id for a, success in zip(analyses, results) if not success]
+        deleted_ids = [a.id for a in analyses if a.id not in failed_ids]
+
+        # rows without impact layer are not removed by cascade
+        with transaction.atomic():
+            Analysis.objects.filter(id__in=deleted_ids).delete()
+
+        self.progress['failed'] += len(failed_ids)
+        return deleted_ids, failed_ids
+
+    def delete_analyses(self, start_after=0):
+        """Delete unkept analyses in chunks, starting after a given id.
+
+        :param start_after: id of the last analysis processed by a previous
+            run
+        :type start_after: int
+        """
+        start_time = time.time()
+        last_id = start_after
+        pool = ThreadPool(self.workers)
+        try:
+            while True:
+                analyses = list(
+                    self.analysis_queryset()
+                    .filter(id__gt=last_id)
+                    .select_related('impact_layer')
+                    .order_by('id')[:self.chunk_size])
+                if not analyses:
+                    break
+
+                self.progress['deleted'] += self.delete_chunk(
+                    analyses, pool)
+                last_id = analyses[-1].id
+                self.progress['last_id'] = last_id
+                cache.set(CLEANUP_CURSOR_KEY, last_id, None)
+                self.report(start_time)
+        finally:
+            pool.close()
+            pool.join()
+
+    def delete_orphans(self):
+        """Delete impact metadata without analysis in chunks."""
+        while True:
+            orphan_ids = list(
+                self.orphan_queryset()
+                .values_list('layer_id', flat=True)[:self.chunk_size])
+            if not orphan_ids:
+                break
+            with transaction.atomic():
+                Metadata.objects.filter(layer_id__in=orphan_ids).delete()
+            self.progress['orphans'] += len(orphan_ids)
+
+    def run(self, resume=True):
+        """Run the cleanup.
+
+        :param resume: continue after the last id processed by an
+            interrupted run
+        :type resume: bool
+
+        :return: progress dictionary
+        :rtype: dict
+        """
+        start_after = 0
+        if resume:
+            start_after = cache.get(CLEANUP_CURSOR_KEY) or 0
+        self.delete_analyses(start_after=start_after)
+        self.delete_orphans()
+        # completed, next run starts from the beginning
+        cache.delete(CLEANUP_CURSOR_KEY)
+        return dict(self.progress)
@@ -0,0 +1,159 @@
+# coding=utf-8
+"""Quota driven retention of impact results.
+
+Unkept analyses are evicted least recently used first, only when the
+configured disk or row quota is exceeded, until usage falls below the low
+watermark of the quota.
+"""
+import logging
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db.models import Sum
+
+from geosafe.helpers.retention.cleanup import CleanupEngine
+from geosafe.models import Analysis
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class RetentionManager(object):
+    """Enforce disk and row quota on unkept impact results."""
+
+    def __init__(self, max_bytes=None, max_rows=None, low_watermark=None,
+                 chunk_size=None, workers=None):
+        """
+
+        :param max_bytes: quota of storage used by impact results, None
+            for unlimited
+        :type max_bytes: int
+
+        :param max_rows: quota of number of unkept analyses, None for
+            unlimited
+        :type max_rows: int
+
+        :param low_watermark: fraction of quota to evict down to
+        :type low_watermark: float
+        """
+        self.max_bytes = max_bytes or getattr(
+            settings, 'GEOSAFE_IMPACT_QUOTA_BYTES', None)
+        self.max_rows = max_rows or getattr(
+            settings, 'GEOSAFE_IMPACT_QUOTA_ROWS', None)
+        self.low_watermark = low_watermark or getattr(
+            settings, 'GEOSAFE_IMPACT_QUOTA_LOW_WATERMARK', 0.9)
+        self.cleanup = CleanupEngine(chunk_size=chunk_size, workers=workers)
+
+    def unkept_queryset(self):
+        return Analysis.objects.filter(keep=False)
+
+    def update_storage_size(self):
+        """Calculate storage size of analyses that don't have it yet."""
+        analyses = Analysis.objects.filter(
+            storage_size__isnull=True,
+            impact_layer__isnull=False).select_related('impact_layer')
+        for analysis in analyses.iterator():
+            Analysis.objects.filter(id=analysis.id).update(
+                storage_size=analysis.calculate_storage_size())
+
+    def usage(self):
+        """Current storage and row usage of impact results.
+
+        Kept analyses count towards the disk usage, but are never evicted.
+
+        :return: dictionary of bytes and rows used
+        :rtype: dict
+        """
+        total_bytes = Analysis.objects.aggregate(
+            total=Sum('storage_size'))['total'] or 0
+        return {
+            'bytes': total_bytes,
+            'rows': self.unkept_queryset().count(),
+        }
+
+    def excess(self, usage):
+        """Amount to evict to go below the low watermark.
+
+        :return: tuple of bytes and rows to evict, zero when within quota
+        :rtype: (int, int)
+        """
+        excess_bytes = 0
+        excess_rows = 0
+        if self.max_bytes and usage['bytes'] > self.max_bytes:
+            excess_bytes = usage['bytes'] - int(
+                self.max_bytes * self.low_watermark)
+        if self.max_rows and usage['rows'] > self.max_rows:
+            excess_rows = usage['rows'] - int(
+                self.max_rows * self.low_watermark)
+        return excess_bytes, excess_rows
+
+    def eviction_candidates(self, exclude_ids=()):
+        """Unkept analyses, least recently used first.
+
+        :param exclude_ids: ids of analyses that failed to be deleted
+        :type exclude_ids: set(int)
+
+        :rtype: QuerySet
+        """
+        candidates = self.unkept_queryset()
+        if exclude_ids:
+            candidates = candidates.exclude(id__in=exclude_ids)
+        return candidates.order_by(
+            'last_accessed', 'id').select_related('impact_layer')
+
+    def evict(self):
+        """Evict least recently used analyses until within quota.
+
+        Analyses failing to be deleted are skipped afterwards, and only
+        successful deletions count towards the evicted amount.
+
+        :return: dictionary of evicted rows and bytes, and failed rows
+        :rtype: dict
+        """
+        self.update_storage_size()
+        excess_bytes, excess_rows = self.excess(self.usage())
+        evicted = {
+            'rows': 0,
+            'bytes': 0,
+            'failed': 0,
+        }
+        if not excess_bytes and not excess_rows:
+            return evicted
+
+        failed_ids = set()
+        pool = ThreadPool(self.cleanup.workers)
+        try:
+            while (evicted['bytes'] < excess_bytes or
+                    evicted['rows'] < excess_rows):
+                victims = []
+                planned_bytes = evicted['bytes']
+                planned_rows = evicted['rows']
+                for analysis in self.eviction_candidates(failed_ids)[
+                        :self.cleanup.chunk_size]:
+                    if (planned_bytes >= excess_bytes and
+                            planned_rows >= excess_rows):
+                        break
+                    victims.append(analysis)
+                    planned_bytes += analysis.storage_size or 0
+                    planned_rows += 1
+                if not victims:
+                    break
+                deleted_ids, chunk_failed_ids = \
+                    self.cleanup.delete_chunk_ids(victims, pool)
+                failed_ids.update(chunk_failed_ids)
+                for analysis in victims:
+                    if analysis.id in deleted_ids:
+                        evicted['bytes'] += analysis.storage_size or 0
+                        evicted['rows'] += 1
+        finally:
+            pool.close()
+            pool.join()
+
+        evicted['failed'] = len(failed_ids)
+        LOGGER.info(
+            'Evicted %(rows)d impact results, %(bytes)d bytes, '
+            '%(failed)d failed' % evicted)
+        return evicted
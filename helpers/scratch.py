@@ -0,0 +1,264 @@
+# coding=utf-8
+"""Scratch space for temporary files of tasks and views.
+
+Each task or request gets its own directory under GEOSAFE_SCRATCH_ROOT, so
+files of the same name extracted by concurrent tasks don't collide. The
+directory is removed when the task is done. Total size of the scratch root
+is limited by GEOSAFE_SCRATCH_QUOTA_BYTES, and directories leaked by killed
+workers are removed by a periodic sweep.
+
+The scratch root isn't walked for every directory created: its size is
+kept in the Django cache, increased by the reserve of each new directory
+and decreased by the size of each removed one. It is measured again from
+disk every GEOSAFE_SCRATCH_USAGE_TTL seconds, and after a sweep.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+LOGGER = logging.getLogger(__name__)
+
+USAGE_CACHE_KEY = 'geosafe.scratch.usage'
+
+
+class ScratchQuotaExceeded(Exception):
+    pass
+
+
+def scratch_root():
+    """Directory holding scratch directories, created if needed.
+
+    :rtype: str
+    """
+    root = getattr(
+        settings,
+        'GEOSAFE_SCRATCH_ROOT',
+        os.path.join(tempfile.gettempdir(), 'geosafe'))
+    try:
+        os.makedirs(root)
+    except OSError:
+        if not os.path.isdir(root):
+            raise
+    return root
+
+
+def path_size(path):
+    """Size of a file, or of all files in a directory.
+
+    :rtype: int
+    """
+    if not os.path.isdir(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+    size = 0
+    for dir_path, dir_names, file_names in os.walk(path):
+        for name in file_names:
+            try:
+                size += os.path.getsize(os.path.join(dir_path, name))
+            except OSError:
+                # removed meanwhile by its task
+                pass
+    return size
+
+
+def last_modified(path):
+    """Latest modification time of a file, or of a directory content.
+
+    :rtype: float
+    """
+    latest = os.path.getmtime(path)
+    if os.path.isdir(path):
+        for dir_path, dir_names, file_names in os.walk(path):
+            for name in dir_names + file_names:
+                try:
+                    latest = max(
+                        latest, os.path.getmtime(os.path.join(dir_path, name)))
+                except OSError:
+                    pass
+    return latest
+
+
+def scratch_usage(refresh=False):
+    """Bytes used in the scratch root.
+
+    :param refresh: measure the usage from disk instead of the counter
+    :type refresh: bool
+
+    :rtype: int
+    """
+    usage = None if refresh else cache.get(USAGE_CACHE_KEY)
+    if usage is None:
+        usage = path_size(scratch_root())
+        cache.set(
+            USAGE_CACHE_KEY,
+            usage,
+            getattr(settings, 'GEOSAFE_SCRATCH_USAGE_TTL', 60))
+    return usage
+
+
+def update_usage(delta):
+    """Add bytes to the usage counter, if it is in the cache.
+
+    :param delta: bytes added, negative for removed bytes
+    :type delta: int
+    """
+    if not delta:
+        return
+    try:
+        if delta > 0:
+            cache.incr(USAGE_CACHE_KEY, delta)
+        elif cache.decr(USAGE_CACHE_KEY, -delta) < 0:
+            # removed files written after the usage was measured
+            cache.delete(USAGE_CACHE_KEY)
+    except ValueError:
+        # expired, measured again on next use
+        pass
+
+
+class ScratchSpace(object):
+    """A private scratch directory, removed when leaving the context.
+
+    Usage::
+
+        with ScratchSpace('impact') as scratch:
+            path = scratch.path('impact.zip')
+    """
+
+    def __init__(self, prefix='geosafe', reserve=0):
+        """
+        :param prefix: prefix of the directory name
+        :type prefix: str
+
+        :param reserve: bytes expected to be written, checked against the
+            quota
+        :type reserve: int
+        """
+        self.prefix = prefix
+        self.reserve = reserve
+        self.directory = None
+
+    def check_quota(self):
+        quota = getattr(settings, 'GEOSAFE_SCRATCH_QUOTA_BYTES', None)
+        if not quota:
+            return
+        usage = scratch_usage()
+        if usage + self.reserve <= quota:
+            return
+        # leaked directories may be the cause
+        sweep_scratch()
+        usage = scratch_usage(refresh=True)
+        if usage + self.reserve > quota:
+            raise ScratchQuotaExceeded(
+                'Scratch space uses %d of %d bytes' % (usage, quota))
+
+    def create(self):
+        """Create the scratch directory.
+
+        :return: path of the directory
+        :rtype: str
+        """
+        self.check_quota()
+        self.directory = tempfile.mkdtemp(
+            prefix='%s-' % self.prefix, dir=scratch_root())
+        update_usage(self.reserve)
+        return self.directory
+
+    def path(self, *names):
+        """Path of a file in the scratch directory.
+
+        :rtype: str
+        """
+        if not self.directory:
+            self.create()
+        return os.path.join(self.directory, *names)
+
+    def mkstemp(self, suffix=''):
+        """Create a unique empty file in the scratch directory.
+
+        :return: path of the file
+        :rtype: str
+        """
+        if not self.directory:
+            self.create()
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self.directory)
+        os.close(fd)
+        return path
+
+    def mkdtemp(self, prefix=''):
+        """Create a unique subdirectory in the scratch directory.
+
+        :return: path of the subdirectory
+        :rtype: str
+        """
+        if not self.directory:
+            self.create()
+        return tempfile.mkdtemp(prefix=prefix, dir=self.directory)
+
+    def cleanup(self):
+        if self.directory:
+            size = path_size(self.directory)
+            shutil.rmtree(self.directory, ignore_errors=True)
+            update_usage(-size)
+            self.directory = None
+
+    def __enter__(self):
+        self.create()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup()
+
+
+def sweep_scratch(max_age=None):
+    """Remove scratch entries not modified for max_age seconds.
+
+    :param max_age: age in seconds, default GEOSAFE_SCRATCH_MAX_AGE
+    :type max_age: int
+
+    :return: number of removed entries and bytes
+    :rtype: dict
+    """
+    if max_age is None:
+        max_age = getattr(settings, 'GEOSAFE_SCRATCH_MAX_AGE', 6 * 3600)
+    root = scratch_root()
+    limit = time.time() - max_age
+    removed = 0
+    removed_bytes = 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            # a task may still be writing files deep in its directory
+            if last_modified(path) > limit:
+                continue
+        except OSError:
+            continue
+        size = path_size(path)
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError as e:
+            LOGGER.info('Failed to remove scratch %s: %s' % (path, e))
+            continue
+        removed += 1
+        removed_bytes += size
+    if removed:
+        LOGGER.info('Removed %d scratch entries, %d bytes' % (
+            removed, removed_bytes))
+        cache.delete(USAGE_CACHE_KEY)
+    return {
+        'removed': removed,
+        'bytes': removed_bytes
+    }
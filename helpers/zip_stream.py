@@ -0,0 +1,236 @@
+# coding=utf-8
+"""Zip archives generated as a stream of chunks.
+
+zipfile needs a seekable output to write the sizes of each member before
+its data. Here the sizes and CRC are written in a data descriptor after
+the data instead, so the archive can be sent to the client while it is
+built, reading one chunk of one member at a time. Members larger than
+4 GiB and archives with offsets beyond 4 GiB use ZIP64 records.
+"""
+import struct
+import time
+import zlib
+from functools import partial
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+CHUNK_SIZE = 64 * 1024
+
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP32_COUNT_LIMIT = 0xFFFF
+
+# general purpose flags: sizes in data descriptor, utf-8 names
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+
+
+def _dos_date_time(timestamp):
+    year, month, day, hour, minute, second = time.localtime(timestamp)[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    dos_date = (year - 1980) << 9 | month << 5 | day
+    dos_time = hour << 11 | minute << 5 | second // 2
+    return dos_date, dos_time
+
+
+class ZipStreamEntry(object):
+    """A member of a streamed zip archive."""
+
+    def __init__(self, arcname, open_file, size=None, timestamp=None):
+        """
+        :param arcname: name of the member in the archive
+        :type arcname: str, unicode
+
+        :param open_file: function returning a file object of the content,
+            called when the member is written
+        :type open_file: callable
+
+        :param size: content size in bytes if known, to decide whether ZIP64
+            is needed
+        :type size: int
+        """
+        if isinstance(arcname, unicode):
+            self.name = arcname.encode('utf-8')
+            self.flags = FLAG_DATA_DESCRIPTOR | FLAG_UTF8
+        else:
+            self.name = arcname
+            self.flags = FLAG_DATA_DESCRIPTOR
+        self.open_file = open_file
+        # unknown sizes are assumed large
+        self.zip64 = size is None or size >= ZIP32_LIMIT
+        self.date, self.time = _dos_date_time(timestamp or time.time())
+        self.crc = 0
+        self.compressed_size = 0
+        self.size = 0
+        self.offset = 0
+
+    @property
+    def version(self):
+        return VERSION_ZIP64 if self.zip64 else VERSION_DEFAULT
+
+    def local_header(self):
+        extra = b''
+        size = 0
+        if self.zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+            size = ZIP32_LIMIT
+        return struct.pack(
+            '<IHHHHHIIIHH',
+            0x04034b50,
+            self.version,
+            self.flags,
+            zlib.DEFLATED,
+            self.time,
+            self.date,
+            0,
+            size,
+            size,
+            len(self.name),
+            len(extra)) + self.name + extra
+
+    def data_descriptor(self):
+        if self.zip64:
+            return struct.pack(
+                '<IIQQ', 0x08074b50, self.crc,
+                self.compressed_size, self.size)
+        return struct.pack(
+            '<IIII', 0x08074b50, self.crc,
+            self.compressed_size, self.size)
+
+    def central_directory_header(self):
+        extra_values = []
+        size = self.size
+        compressed_size = self.compressed_size
+        offset = self.offset
+        if size >= ZIP32_LIMIT or compressed_size >= ZIP32_LIMIT:
+            extra_values += [size, compressed_size]
+            size = compressed_size = ZIP32_LIMIT
+        if offset >= ZIP32_LIMIT:
+            extra_values.append(offset)
+            offset = ZIP32_LIMIT
+        extra = b''
+        if extra_values:
+            extra = struct.pack(
+                '<HH' + 'Q' * len(extra_values),
+                0x0001, 8 * len(extra_values), *extra_values)
+        version = VERSION_ZIP64 if extra or self.zip64 else VERSION_DEFAULT
+        return struct.pack(
+            '<IHHHHHHIIIHHHHHII',
+            0x02014b50,
+            version,
+            version,
+            self.flags,
+            zlib.DEFLATED,
+            self.time,
+            self.date,
+            self.crc,
+            compressed_size,
+            size,
+            len(self.name),
+            len(extra),
+            0,
+            0,
+            0,
+            0o644 << 16,
+            offset) + self.name + extra
+
+    def iter_data(self):
+        """Generate compressed content, updating CRC and sizes."""
+        compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+        f = self.open_file()
+        try:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.size += len(chunk)
+                self.crc = zlib.crc32(chunk, self.crc)
+                data = compressor.compress(chunk)
+                if data:
+                    self.compressed_size += len(data)
+                    yield data
+        finally:
+            f.close()
+        data = compressor.flush()
+        self.compressed_size += len(data)
+        self.crc &= 0xFFFFFFFF
+        yield data
+
+
+class ZipStream(object):
+    """Iterate over the chunks of a zip archive of the given entries.
+
+    Usage::
+
+        entries = [ZipStreamEntry('report.pdf', lambda: open(path), size)]
+        response = StreamingHttpResponse(ZipStream(entries))
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    def __iter__(self):
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            header = entry.local_header()
+            offset += len(header)
+            yield header
+            for data in entry.iter_data():
+                offset += len(data)
+                yield data
+            descriptor = entry.data_descriptor()
+            offset += len(descriptor)
+            yield descriptor
+
+        directory_offset = offset
+        for entry in self.entries:
+            header = entry.central_directory_header()
+            offset += len(header)
+            yield header
+        directory_size = offset - directory_offset
+
+        count = len(self.entries)
+        if (count >= ZIP32_COUNT_LIMIT or
+                directory_offset >= ZIP32_LIMIT or
+                directory_size >= ZIP32_LIMIT):
+            yield struct.pack(
+                '<IQHHIIQQQQ',
+                0x06064b50, 44, VERSION_ZIP64, VERSION_ZIP64, 0, 0,
+                count, count, directory_size, directory_offset)
+            yield struct.pack('<IIQI', 0x07064b50, 0, offset, 1)
+        yield struct.pack(
+            '<IHHHHIIH',
+            0x06054b50, 0, 0,
+            min(count, ZIP32_COUNT_LIMIT),
+            min(count, ZIP32_COUNT_LIMIT),
+            min(directory_size, ZIP32_LIMIT),
+            min(directory_offset, ZIP32_LIMIT),
+            0)
+
+
+def field_file_entry(arcname, field_file):
+    """Zip stream member reading a stored file.
+
+    :param arcname: name of the member in the archive
+    :type arcname: str
+
+    :param field_file: stored file
+    :type field_file: FieldFile
+
+    :rtype: ZipStreamEntry
+    """
+    try:
+        size = field_file.size
+    except (IOError, OSError):
+        size = None
+    return ZipStreamEntry(
+        arcname,
+        partial(field_file.storage.open, field_file.name, 'rb'),
+        size=size)
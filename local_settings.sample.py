@@ -35,10 +35,31 @@ CELERY_QUEUES = [
 
 # Schedule for periodic tasks
 CELERYBEAT_SCHEDULE = {
-    # executes every night at 0:0 AM
-    'clean-impact-nightly': {
-        'task': 'geosafe.tasks.analysis.clean_impact_result',
-        'schedule': crontab(hour='0', minute='0')
+    # evict least recently used impact results exceeding quota. Removing
+    # every unkept result with clean_impact_result is left to be run by hand
+    'enforce-impact-quota-hourly': {
+        'task': 'geosafe.tasks.analysis.enforce_impact_quota',
+        'schedule': crontab(minute='30')
+    },
+    # harvest metasearch catalogues into local index
+    'harvest-catalogues-hourly': {
+        'task': 'geosafe.tasks.metasearch.harvest_catalogues',
+        'schedule': crontab(minute='15')
+    },
+    # remove scratch directories leaked by interrupted tasks
+    'sweep-scratch-space-hourly': {
+        'task': 'geosafe.tasks.analysis.sweep_scratch_space',
+        'schedule': crontab(minute='45')
+    },
+    # dispatch metasearch import jobs left waiting for a download slot
+    'schedule-import-jobs': {
+        'task': 'geosafe.tasks.metasearch.schedule_import_jobs',
+        'schedule': crontab(minute='*/5')
+    },
+    # sync local impact function catalogue from InaSAFE Headless
+    'sync-impact-function-catalogue': {
+        'task': 'geosafe.tasks.analysis.sync_impact_function_catalogue',
+        'schedule': crontab(minute='15', hour='*/6')
     }
 }
 
@@ -46,3 +67,128 @@ djcelery.setup_loader()
 
 # base url used to resolve layer files accessed by InaSAFE Headless
 GEONODE_BASE_URL = 'http://localhost:8000/'
+
+# Impact result cleanup: number of analyses deleted in one chunk and number
+# of threads removing reports and impact layers concurrently
+GEOSAFE_CLEANUP_CHUNK_SIZE = 100
+GEOSAFE_CLEANUP_WORKERS = 4
+
+# Impact result retention: quota of storage (bytes) and number of unkept
+# analyses. Least recently used unkept analyses are evicted down to the low
+# watermark fraction of the quota. None means unlimited.
+GEOSAFE_IMPACT_QUOTA_BYTES = 10 * 1024 ** 3
+GEOSAFE_IMPACT_QUOTA_ROWS = None
+GEOSAFE_IMPACT_QUOTA_LOW_WATERMARK = 0.9
+# Minimum seconds between two updates of an analysis last access time
+GEOSAFE_ACCESS_TOUCH_INTERVAL = 300
+
+# Metasearch: seconds to keep CSW capabilities and search result pages
+GEOSAFE_CSW_CAPABILITIES_TTL = 3600
+GEOSAFE_CSW_PAGE_CACHE_TTL = 300
+# Metasearch: number of CSW records kept in memory and seconds to keep them
+GEOSAFE_CSW_RECORD_CACHE_SIZE = 256
+GEOSAFE_CSW_RECORD_CACHE_TTL = 3600
+
+# Metasearch: configured catalogues. Each entry is a dict with url, and
+# optionally user and password. Only catalogues without credentials are
+# harvested into the local index, the others are searched live.
+GEOSAFE_METASEARCH_CATALOGUES = [
+    # {
+    #     'url': 'http://demo.geonode.org/catalogue/csw',
+    #     'user': None,
+    #     'password': None,
+    # },
+]
+GEOSAFE_METASEARCH_HARVEST_PAGE_SIZE = 100
+# Metasearch: seconds between full identifier listings deleting harvested
+# records removed from the catalogue
+GEOSAFE_METASEARCH_HARVEST_SWEEP_INTERVAL = 24 * 3600
+# Metasearch: seconds to wait for each catalogue, and number of catalogues
+# searched concurrently, when searching all configured catalogues
+GEOSAFE_METASEARCH_FEDERATED_TIMEOUT = 15
+GEOSAFE_METASEARCH_FEDERATED_WORKERS = 8
+
+# Metasearch WCS import: maximum tile width and height in degrees, number of
+# tiles fetched concurrently, attempts and timeout (seconds) for each tile
+GEOSAFE_WCS_TILE_SIZE = 1.0
+GEOSAFE_WCS_DOWNLOAD_WORKERS = 4
+GEOSAFE_WCS_TILE_RETRIES = 3
+GEOSAFE_WCS_TILE_TIMEOUT = 120
+
+# Metasearch WFS import: features in one page, number of pages fetched
+# concurrently, attempts and timeout (seconds) for each page, and tile size
+# in degrees used when the server doesn't support paging
+GEOSAFE_WFS_PAGE_SIZE = 5000
+GEOSAFE_WFS_DOWNLOAD_WORKERS = 4
+GEOSAFE_WFS_PAGE_RETRIES = 3
+GEOSAFE_WFS_PAGE_TIMEOUT = 120
+GEOSAFE_WFS_TILE_SIZE = 0.5
+
+# Metasearch WFS map preview proxy: upstream timeout (seconds), cache TTL
+# (seconds) and maximum compressed response size kept in cache (bytes)
+GEOSAFE_WFS_PROXY_TIMEOUT = 60
+GEOSAFE_WFS_PROXY_CACHE_TTL = 300
+GEOSAFE_WFS_PROXY_CACHE_MAX_BYTES = 5 * 1024 ** 2
+
+# Metasearch import jobs: imports running concurrently against one host,
+# seconds to keep credentials of a job waiting for a download slot, and
+# seconds after which a queued or running job is considered lost and failed,
+# and seconds a layer imported from a record without modification date is
+# reused by identical imports
+GEOSAFE_IMPORT_MAX_PER_HOST = 2
+GEOSAFE_IMPORT_CREDENTIALS_TTL = 24 * 3600
+GEOSAFE_IMPORT_JOB_TIMEOUT = 6 * 3600
+GEOSAFE_IMPORT_REUSE_TTL = 24 * 3600
+
+# Scratch space of tasks and downloads: root directory (default geosafe in
+# the system temp directory), quota of its total size in bytes (None means
+# unlimited), age in seconds after which leaked files are swept, and seconds
+# between measures of its size from disk
+# GEOSAFE_SCRATCH_ROOT = '/tmp/geosafe'
+GEOSAFE_SCRATCH_QUOTA_BYTES = 20 * 1024 ** 3
+GEOSAFE_SCRATCH_MAX_AGE = 6 * 3600
+GEOSAFE_SCRATCH_USAGE_TTL = 60
+
+# Impact result ingestion: number of output layers of an analysis uploaded
+# concurrently
+GEOSAFE_INGEST_WORKERS = 4
+
+# Analysis reports: render PDF reports with every analysis instead of when
+# first downloaded, seconds a download waits for the reports before
+# answering 202 Accepted, seconds between polls of the page shown while
+# rendering, and seconds after which a render task still pending is
+# considered lost and started again
+GEOSAFE_GENERATE_REPORT_WITH_ANALYSIS = False
+GEOSAFE_REPORT_WAIT_TIMEOUT = 5
+GEOSAFE_REPORT_POLL_INTERVAL = 5
+GEOSAFE_REPORT_TASK_TIMEOUT = 3600
+
+# Bulk export of analyses: maximum number of analyses in one archive
+GEOSAFE_EXPORT_MAX_ANALYSES = 500
+
+# Seconds to keep results of InaSAFE Headless proxy tasks such as impact
+# function filtering and keyword reading
+GEOSAFE_HEADLESS_CACHE_TTL = 3600
+
+# Seconds to wait for an InaSAFE Headless proxy task, by default and per task
+# name, and seconds to keep the last known result used when headless doesn't
+# answer in time
+GEOSAFE_HEADLESS_TIMEOUT = 30
+GEOSAFE_HEADLESS_TIMEOUTS = {
+    'headless.tasks.inasafe_wrapper.filter_impact_function': 10,
+}
+GEOSAFE_HEADLESS_LAST_KNOWN_TTL = 7 * 86400
+# Consecutive headless failures opening the circuit breaker, and seconds
+# calls are refused afterwards
+GEOSAFE_HEADLESS_BREAKER_THRESHOLD = 3
+GEOSAFE_HEADLESS_BREAKER_COOLDOWN = 60
+
+# Layer search API: default and maximum number of layers in a page
+GEOSAFE_LAYER_SEARCH_PAGE_SIZE = 20
+GEOSAFE_LAYER_SEARCH_MAX_PAGE_SIZE = 100
+# Layers listed in each analysis panel list before "More layers"
+GEOSAFE_LAYER_PANEL_SIZE = 20
+
+# Analysis history: default and maximum number of analyses in a page
+GEOSAFE_ANALYSIS_HISTORY_PAGE_SIZE = 50
+GEOSAFE_ANALYSIS_HISTORY_MAX_PAGE_SIZE = 200
@@ -0,0 +1,51 @@
+# coding=utf-8
+"""Create or drop indexes used by the layer search API.
+
+The indexes are on GeoNode tables, layers_layer and base_resourcebase, so
+they are not part of the geosafe migrations. Layer search works without
+them, with slower prefix and full text matches on large catalogues. Only
+PostgreSQL supports them.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+LAYER_SEARCH_INDEXES = [
+    ('geosafe_layer_name_prefix',
+     'layers_layer (UPPER(name) varchar_pattern_ops)'),
+    ('geosafe_resource_title_prefix',
+     'base_resourcebase (UPPER(title) varchar_pattern_ops)'),
+    ('geosafe_layer_name_fts',
+     "layers_layer USING gin(to_tsvector('simple', name))"),
+    ('geosafe_resource_title_fts',
+     "base_resourcebase USING gin(to_tsvector('simple', title))"),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Create indexes on GeoNode layer tables used by the geosafe layer '
+        'search, or drop them with --drop.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--drop',
+            action='store_true',
+            default=False,
+            help='Drop the indexes instead of creating them')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Layer search indexes require PostgreSQL')
+        with connection.cursor() as cursor:
+            for name, definition in LAYER_SEARCH_INDEXES:
+                if options['drop']:
+                    cursor.execute('DROP INDEX IF EXISTS %s' % name)
+                else:
+                    cursor.execute(
+                        'CREATE INDEX IF NOT EXISTS %s ON %s' % (
+                            name, definition))
+                self.stdout.write(name)
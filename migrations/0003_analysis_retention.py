@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geosafe', '0002_analysis_user_title'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='last_accessed',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text=b'The last time the impact result was accessed', verbose_name=b'Last Accessed', db_index=True),
+        ),
+        migrations.AddField(
+            model_name='analysis',
+            name='storage_size',
+            field=models.BigIntegerField(help_text=b'Size in bytes of the reports and impact layer files', null=True, verbose_name=b'Storage Size', blank=True),
+        ),
+    ]
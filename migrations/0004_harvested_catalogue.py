@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def create_search_index(apps, schema_editor):
+    # Full text index is only available on PostgreSQL
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE INDEX geosafe_harvestedrecord_search_text_fts "
+        "ON geosafe_harvestedrecord "
+        "USING gin(to_tsvector('simple', search_text))")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "DROP INDEX IF EXISTS geosafe_harvestedrecord_search_text_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geosafe', '0003_analysis_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HarvestedCatalogue',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('csw_url', models.CharField(help_text=b'URL to CSW endpoint', unique=True, max_length=255, verbose_name=b'CSW URL')),
+                ('last_modified', models.DateTimeField(help_text=b'Latest modification date of the harvested records', null=True, verbose_name=b'Last Modified', blank=True)),
+                ('last_harvested', models.DateTimeField(help_text=b'The last time the catalogue was harvested', null=True, verbose_name=b'Last Harvested', blank=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HarvestedRecord',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('identifier', models.CharField(help_text=b'Identifier of the record in the catalogue', max_length=255, verbose_name=b'Identifier')),
+                ('title', models.TextField(null=True, verbose_name=b'Title', blank=True)),
+                ('abstract', models.TextField(null=True, verbose_name=b'Abstract', blank=True)),
+                ('search_text', models.TextField(default=b'', help_text=b'Text indexed for full text search', verbose_name=b'Search Text', blank=True)),
+                ('bbox_x0', models.FloatField(null=True, blank=True)),
+                ('bbox_x1', models.FloatField(null=True, blank=True)),
+                ('bbox_y0', models.FloatField(null=True, blank=True)),
+                ('bbox_y1', models.FloatField(null=True, blank=True)),
+                ('modified', models.DateTimeField(help_text=b'Modification date of the record in the catalogue', null=True, verbose_name=b'Modified', db_index=True, blank=True)),
+                ('inasafe_keywords', models.TextField(help_text=b'Supplemental information of the record', null=True, verbose_name=b'InaSAFE Keywords', blank=True)),
+                ('inasafe_layer', models.BooleanField(default=False, help_text=b'True if the record contains InaSAFE keywords', db_index=True, verbose_name=b'InaSAFE Layer')),
+                ('references', models.TextField(default=b'[]', help_text=b'JSON list of service references of the record', verbose_name=b'Service References', blank=True)),
+                ('xml', models.TextField(help_text=b'ISO metadata of the record', null=True, verbose_name=b'Record XML', blank=True)),
+                ('catalogue', models.ForeignKey(related_name='records', verbose_name=b'Catalogue', to='geosafe.HarvestedCatalogue', help_text=b'The catalogue this record is harvested from')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='harvestedrecord',
+            unique_together=set([('catalogue', 'identifier')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='harvestedrecord',
+            index_together=set([('bbox_x0', 'bbox_x1', 'bbox_y0', 'bbox_y1')]),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
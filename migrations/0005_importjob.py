@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.conf import settings
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('layers', '0003_auto_20160821_1919'),
+        ('geosafe', '0004_harvested_catalogue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('request_key', models.CharField(help_text=b'Hash of the import request, used to find duplicates', max_length=40, verbose_name=b'Request Key', db_index=True)),
+                ('service_type', models.CharField(help_text=b'OGC service type, WCS or WFS', max_length=10, verbose_name=b'Service Type')),
+                ('endpoint', models.CharField(help_text=b'URL of the OGC service', max_length=255, verbose_name=b'Endpoint')),
+                ('host', models.CharField(help_text=b'Host name of the endpoint', max_length=255, verbose_name=b'Host')),
+                ('service_id', models.CharField(help_text=b'Coverage ID or feature type name', max_length=255, verbose_name=b'Service ID')),
+                ('service_version', models.CharField(max_length=10, null=True, verbose_name=b'Service Version', blank=True)),
+                ('bbox', models.CharField(help_text=b'Comma separated minx, miny, maxx, maxy', max_length=255, null=True, verbose_name=b'Bounding Box', blank=True)),
+                ('csw_url', models.CharField(help_text=b'Catalogue the layer was found in', max_length=255, null=True, verbose_name=b'CSW URL', blank=True)),
+                ('identifier', models.CharField(help_text=b'Identifier of the record in the catalogue', max_length=255, null=True, verbose_name=b'Identifier', blank=True)),
+                ('title', models.CharField(max_length=255, null=True, verbose_name=b'Title', blank=True)),
+                ('state', models.CharField(default=b'PENDING', max_length=10, verbose_name=b'State', db_index=True, choices=[(b'PENDING', b'Waiting for a download slot'), (b'QUEUED', b'Queued'), (b'RUNNING', b'Running'), (b'SUCCESS', b'Success'), (b'FAILURE', b'Failure')])),
+                ('task_id', models.CharField(max_length=40, null=True, verbose_name=b'Task UUID', blank=True)),
+                ('bytes_transferred', models.BigIntegerField(default=0, verbose_name=b'Bytes Transferred')),
+                ('error', models.TextField(null=True, verbose_name=b'Error', blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name=b'Created', db_index=True)),
+                ('started', models.DateTimeField(null=True, verbose_name=b'Started', blank=True)),
+                ('finished', models.DateTimeField(null=True, verbose_name=b'Finished', blank=True)),
+                ('layer', models.ForeignKey(related_name='import_jobs', on_delete=django.db.models.deletion.SET_NULL, verbose_name=b'Imported Layer', blank=True, to='layers.Layer', null=True)),
+                ('user', models.ForeignKey(verbose_name=b'Requested By', blank=True, to=settings.AUTH_USER_MODEL, null=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='importjob',
+            index_together=set([('host', 'state')]),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geosafe', '0005_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='fingerprint',
+            field=models.CharField(max_length=40, blank=True, help_text=b'Hash of the import request and remote modification date', null=True, verbose_name=b'Source Fingerprint', db_index=True),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='remote_modified',
+            field=models.DateTimeField(help_text=b'Modification date of the catalogue record when imported', null=True, verbose_name=b'Remote Modified', blank=True),
+        ),
+    ]
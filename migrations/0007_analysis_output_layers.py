@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('layers', '0003_auto_20160821_1919'),
+        ('geosafe', '0006_importjob_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='output_layers',
+            field=models.ManyToManyField(help_text=b'All layers produced by this analysis, including the impact layer.', related_name='analysis_outputs', verbose_name=b'Output Layers', to='layers.Layer', blank=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geosafe', '0007_analysis_output_layers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='report_task_id',
+            field=models.CharField(help_text=b'Task UUID that renders the reports on demand', max_length=40, null=True, verbose_name=b'Report Task UUID', blank=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geosafe', '0008_analysis_report_task_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImpactFunction',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('function_id', models.CharField(unique=True, max_length=100, verbose_name=b'ID of Impact Function')),
+                ('name', models.CharField(default=b'', max_length=255, verbose_name=b'Name', blank=True)),
+                ('last_synced', models.DateTimeField(help_text=b'The last time the function was seen in InaSAFE Headless', verbose_name=b'Last Synced', auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ImpactFunctionCompatibility',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('hazard_category', models.CharField(max_length=30, verbose_name=b'Hazard Category')),
+                ('exposure_category', models.CharField(max_length=30, verbose_name=b'Exposure Category')),
+                ('impact_function', models.ForeignKey(related_name='compatibilities', verbose_name=b'Impact Function', to='geosafe.ImpactFunction')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='impactfunctioncompatibility',
+            unique_together=set([('hazard_category', 'exposure_category', 'impact_function')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='impactfunctioncompatibility',
+            index_together=set([('hazard_category', 'exposure_category')]),
+        ),
+    ]
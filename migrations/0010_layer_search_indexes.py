@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geosafe', '0009_impact_function_catalogue'),
+    ]
+
+    operations = [
+        # indexes on GeoNode tables are created separately with the
+        # layer_search_indexes management command
+        migrations.AlterIndexTogether(
+            name='metadata',
+            index_together=set([('layer_purpose', 'category')]),
+        ),
+    ]
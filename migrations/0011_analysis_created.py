@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def backfill_created(apps, schema_editor):
+    # best known creation time of existing analyses is their impact date
+    Analysis = apps.get_model('geosafe', 'Analysis')
+    analyses = Analysis.objects.filter(
+        impact_layer__isnull=False).values_list(
+        'id', 'impact_layer__date').iterator()
+    for analysis_id, date in analyses:
+        if date:
+            Analysis.objects.filter(id=analysis_id).update(created=date)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geosafe', '0010_layer_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text=b'The time the analysis was requested', verbose_name=b'Created'),
+        ),
+        migrations.AlterIndexTogether(
+            name='analysis',
+            index_together=set([('created', 'id'), ('user', 'created', 'id')]),
+        ),
+        migrations.RunPython(backfill_created, migrations.RunPython.noop),
+    ]
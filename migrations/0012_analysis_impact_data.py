@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geosafe', '0011_analysis_created'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='impact_data',
+            field=models.TextField(help_text=b'Impact summary data of the impact layer, as JSON', null=True, verbose_name=b'Impact Data', blank=True),
+        ),
+    ]
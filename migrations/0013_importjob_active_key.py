@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_active_key(apps, schema_editor):
+    ImportJob = apps.get_model('geosafe', 'ImportJob')
+    seen = set()
+    active = ImportJob.objects.filter(
+        state__in=['PENDING', 'QUEUED', 'RUNNING']).order_by('created')
+    for job in active:
+        if job.request_key in seen:
+            # duplicate of an older unfinished job
+            job.state = 'FAILURE'
+            job.error = 'Duplicate of an unfinished import'
+            job.save(update_fields=['state', 'error'])
+            continue
+        seen.add(job.request_key)
+        job.active_key = job.request_key
+        job.save(update_fields=['active_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geosafe', '0012_analysis_impact_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='active_key',
+            field=models.CharField(null=True, max_length=40, blank=True, help_text=b'Request key while the job is not finished, only one unfinished job exists for a request', unique=True, verbose_name=b'Active Request Key'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='queued',
+            field=models.DateTimeField(null=True, verbose_name=b'Queued', blank=True),
+        ),
+        migrations.RunPython(set_active_key, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geosafe', '0013_importjob_active_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysis',
+            name='report_error',
+            field=models.TextField(help_text=b'Why the reports can not be rendered on demand', null=True, verbose_name=b'Report Error', blank=True),
+        ),
+    ]
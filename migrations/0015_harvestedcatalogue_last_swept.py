@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geosafe', '0014_analysis_report_error'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='harvestedcatalogue',
+            name='last_swept',
+            field=models.DateTimeField(help_text=b'The last time records removed from the catalogue were deleted from the index', null=True, verbose_name=b'Last Swept', blank=True),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 
+import datetime
 import tempfile
 import urlparse
 
@@ -7,6 +8,7 @@ from django.conf import settings
 from django.core.files.base import File
 from django.core.urlresolvers import reverse
 from django.db import models
+from django.utils import timezone
 from celery.result import AsyncResult
 
 from geonode.layers.models import Layer
@@ -34,6 +36,12 @@ class GeoSAFEException(BaseException):
 # Create your models here.
 class Metadata(models.Model):
     """Represent metadata for a layer."""
+
+    class Meta:
+        index_together = [
+            ['layer_purpose', 'category'],
+        ]
+
     layer = models.OneToOneField(Layer, primary_key=True,
                                  related_name='metadata')
     layer_purpose = models.CharField(
@@ -74,6 +82,10 @@ class Analysis(models.Model):
 
     class Meta:
         verbose_name_plural = 'Analyses'
+        index_together = [
+            ['created', 'id'],
+            ['user', 'created', 'id'],
+        ]
 
     user_title = models.CharField(
         max_length=255,
@@ -129,6 +141,15 @@ class Analysis(models.Model):
         related_name='impact_layer'
     )
 
+    output_layers = models.ManyToManyField(
+        Layer,
+        verbose_name='Output Layers',
+        help_text='All layers produced by this analysis, including the '
+                  'impact layer.',
+        blank=True,
+        related_name='analysis_outputs'
+    )
+
     task_id = models.CharField(
         max_length=40,
         verbose_name='Task UUID',
@@ -176,19 +197,81 @@ class Analysis(models.Model):
         upload_to='analysis/report/'
     )
 
+    report_task_id = models.CharField(
+        max_length=40,
+        verbose_name='Report Task UUID',
+        help_text='Task UUID that renders the reports on demand',
+        blank=True,
+        null=True
+    )
+
+    report_error = models.TextField(
+        verbose_name='Report Error',
+        help_text='Why the reports can not be rendered on demand',
+        blank=True,
+        null=True
+    )
+
+    impact_data = models.TextField(
+        verbose_name='Impact Data',
+        help_text='Impact summary data of the impact layer, as JSON',
+        blank=True,
+        null=True
+    )
+
+    created = models.DateTimeField(
+        verbose_name='Created',
+        help_text='The time the analysis was requested',
+        default=timezone.now
+    )
+
+    last_accessed = models.DateTimeField(
+        verbose_name='Last Accessed',
+        help_text='The last time the impact result was accessed',
+        default=timezone.now,
+        db_index=True
+    )
+
+    storage_size = models.BigIntegerField(
+        verbose_name='Storage Size',
+        help_text='Size in bytes of the reports and impact layer files',
+        blank=True,
+        null=True
+    )
+
     def assign_report_map(self, filename):
+        """Assign report map from a file path or a File."""
         try:
             self.report_map.delete()
         except:
             pass
-        self.report_map = File(open(filename))
+        if isinstance(filename, File):
+            self.report_map = filename
+        else:
+            self.report_map = File(open(filename))
 
     def assign_report_table(self, filename):
+        """Assign report table from a file path or a File."""
         try:
             self.report_table.delete()
         except:
             pass
-        self.report_table = File(open(filename))
+        if isinstance(filename, File):
+            self.report_table = filename
+        else:
+            self.report_table = File(open(filename))
+
+    def has_reports(self):
+        """Check if both reports are rendered.
+
+        :rtype: bool
+        """
+        return bool(self.report_map) and bool(self.report_table)
+
+    def get_report_task_result(self):
+        if not self.report_task_id:
+            return None
+        return AsyncResult(self.report_task_id)
 
     def get_task_result(self):
         return AsyncResult(self.task_id)
@@ -222,20 +305,73 @@ class Analysis(models.Model):
         )
         return layer_name
 
-    _impact_function_list = []
-
     @classmethod
     def impact_function_list(cls):
-        if not cls._impact_function_list:
-            from geosafe.tasks.headless.analysis import filter_impact_function
-            cls._impact_function_list = filter_impact_function.delay().get()
-        return cls._impact_function_list
+        from geosafe.helpers.impact_function_catalogue import (
+            impact_function_list)
+        return impact_function_list()
 
     def impact_function_name(self):
-        for i in self.impact_function_list():
-            if i['id'] == self.impact_function_id:
-                return i['name']
-        return ''
+        from geosafe.helpers.impact_function_catalogue import (
+            impact_function_names)
+        return impact_function_names().get(self.impact_function_id, '')
+
+    @classmethod
+    def mark_accessed(cls, **lookup):
+        """Record access time of analyses matching lookup.
+
+        Updates are throttled by GEOSAFE_ACCESS_TOUCH_INTERVAL seconds, so
+        repeated access of the same result doesn't write on every request.
+
+        :return: number of analyses updated
+        :rtype: int
+        """
+        interval = getattr(settings, 'GEOSAFE_ACCESS_TOUCH_INTERVAL', 300)
+        now = timezone.now()
+        threshold = now - datetime.timedelta(seconds=interval)
+        return cls.objects.filter(
+            last_accessed__lt=threshold, **lookup).update(last_accessed=now)
+
+    def touch(self):
+        """Record access time of this analysis."""
+        if self.id:
+            self.mark_accessed(id=self.id)
+
+    def calculate_storage_size(self):
+        """Calculate size of reports and impact layer files.
+
+        :return: size in bytes
+        :rtype: int
+        """
+        size = 0
+        for report in [self.report_map, self.report_table]:
+            try:
+                if report:
+                    size += report.size
+            except (IOError, OSError):
+                pass
+
+        layers = self.extra_output_layers()
+        if self.impact_layer:
+            layers.append(self.impact_layer)
+        for layer in layers:
+            if not layer.upload_session:
+                continue
+            for layer_file in layer.upload_session.layerfile_set.all():
+                try:
+                    size += layer_file.file.size
+                except (IOError, OSError):
+                    pass
+        return size
+
+    def extra_output_layers(self):
+        """Output layers other than the impact layer.
+
+        :rtype: list(Layer)
+        """
+        if not self.pk:
+            return []
+        return list(self.output_layers.exclude(id=self.impact_layer_id))
 
     @classmethod
     def get_layer_url(cls, layer):
@@ -265,6 +401,12 @@ class Analysis(models.Model):
         except:
             pass
 
+        for layer in self.extra_output_layers():
+            try:
+                layer.delete()
+            except:
+                pass
+
         try:
             self.impact_layer.delete()
         except:
@@ -272,5 +414,352 @@ class Analysis(models.Model):
         super(Analysis, self).delete(using=using)
 
 
+class HarvestedCatalogue(models.Model):
+    """Represent a remote CSW catalogue harvested into local index."""
+    csw_url = models.CharField(
+        max_length=255,
+        verbose_name='CSW URL',
+        help_text='URL to CSW endpoint',
+        unique=True
+    )
+    last_modified = models.DateTimeField(
+        verbose_name='Last Modified',
+        help_text='Latest modification date of the harvested records',
+        blank=True,
+        null=True
+    )
+    last_harvested = models.DateTimeField(
+        verbose_name='Last Harvested',
+        help_text='The last time the catalogue was harvested',
+        blank=True,
+        null=True
+    )
+    last_swept = models.DateTimeField(
+        verbose_name='Last Swept',
+        help_text='The last time records removed from the catalogue were '
+                  'deleted from the index',
+        blank=True,
+        null=True
+    )
+
+    def __unicode__(self):
+        return self.csw_url
+
+
+class HarvestedRecord(models.Model):
+    """Represent a CSW record harvested from a remote catalogue."""
+
+    class Meta:
+        unique_together = ('catalogue', 'identifier')
+        index_together = [
+            ['bbox_x0', 'bbox_x1', 'bbox_y0', 'bbox_y1'],
+        ]
+
+    catalogue = models.ForeignKey(
+        HarvestedCatalogue,
+        verbose_name='Catalogue',
+        help_text='The catalogue this record is harvested from',
+        related_name='records'
+    )
+    identifier = models.CharField(
+        max_length=255,
+        verbose_name='Identifier',
+        help_text='Identifier of the record in the catalogue'
+    )
+    title = models.TextField(
+        verbose_name='Title',
+        blank=True,
+        null=True
+    )
+    abstract = models.TextField(
+        verbose_name='Abstract',
+        blank=True,
+        null=True
+    )
+    search_text = models.TextField(
+        verbose_name='Search Text',
+        help_text='Text indexed for full text search',
+        blank=True,
+        default=''
+    )
+    bbox_x0 = models.FloatField(blank=True, null=True)
+    bbox_x1 = models.FloatField(blank=True, null=True)
+    bbox_y0 = models.FloatField(blank=True, null=True)
+    bbox_y1 = models.FloatField(blank=True, null=True)
+    modified = models.DateTimeField(
+        verbose_name='Modified',
+        help_text='Modification date of the record in the catalogue',
+        blank=True,
+        null=True,
+        db_index=True
+    )
+    inasafe_keywords = models.TextField(
+        verbose_name='InaSAFE Keywords',
+        help_text='Supplemental information of the record',
+        blank=True,
+        null=True
+    )
+    inasafe_layer = models.BooleanField(
+        verbose_name='InaSAFE Layer',
+        help_text='True if the record contains InaSAFE keywords',
+        default=False,
+        db_index=True
+    )
+    references = models.TextField(
+        verbose_name='Service References',
+        help_text='JSON list of service references of the record',
+        blank=True,
+        default='[]'
+    )
+    xml = models.TextField(
+        verbose_name='Record XML',
+        help_text='ISO metadata of the record',
+        blank=True,
+        null=True
+    )
+
+    def __unicode__(self):
+        return self.identifier
+
+
+class ImportJob(models.Model):
+    """Represent import of a remote layer found by metasearch."""
+    STATE_PENDING = 'PENDING'
+    STATE_QUEUED = 'QUEUED'
+    STATE_RUNNING = 'RUNNING'
+    STATE_SUCCESS = 'SUCCESS'
+    STATE_FAILURE = 'FAILURE'
+
+    STATE_CHOICES = (
+        (STATE_PENDING, 'Waiting for a download slot'),
+        (STATE_QUEUED, 'Queued'),
+        (STATE_RUNNING, 'Running'),
+        (STATE_SUCCESS, 'Success'),
+        (STATE_FAILURE, 'Failure'),
+    )
+
+    # states of a job that is not finished yet
+    ACTIVE_STATES = (STATE_PENDING, STATE_QUEUED, STATE_RUNNING)
+
+    class Meta:
+        index_together = [
+            ['host', 'state'],
+        ]
+
+    request_key = models.CharField(
+        max_length=40,
+        verbose_name='Request Key',
+        help_text='Hash of the import request, used to find duplicates',
+        db_index=True
+    )
+    active_key = models.CharField(
+        max_length=40,
+        verbose_name='Active Request Key',
+        help_text='Request key while the job is not finished, only one '
+                  'unfinished job exists for a request',
+        blank=True,
+        null=True,
+        unique=True
+    )
+    service_type = models.CharField(
+        max_length=10,
+        verbose_name='Service Type',
+        help_text='OGC service type, WCS or WFS'
+    )
+    endpoint = models.CharField(
+        max_length=255,
+        verbose_name='Endpoint',
+        help_text='URL of the OGC service'
+    )
+    host = models.CharField(
+        max_length=255,
+        verbose_name='Host',
+        help_text='Host name of the endpoint'
+    )
+    service_id = models.CharField(
+        max_length=255,
+        verbose_name='Service ID',
+        help_text='Coverage ID or feature type name'
+    )
+    service_version = models.CharField(
+        max_length=10,
+        verbose_name='Service Version',
+        blank=True,
+        null=True
+    )
+    bbox = models.CharField(
+        max_length=255,
+        verbose_name='Bounding Box',
+        help_text='Comma separated minx, miny, maxx, maxy',
+        blank=True,
+        null=True
+    )
+    csw_url = models.CharField(
+        max_length=255,
+        verbose_name='CSW URL',
+        help_text='Catalogue the layer was found in',
+        blank=True,
+        null=True
+    )
+    identifier = models.CharField(
+        max_length=255,
+        verbose_name='Identifier',
+        help_text='Identifier of the record in the catalogue',
+        blank=True,
+        null=True
+    )
+    title = models.CharField(
+        max_length=255,
+        verbose_name='Title',
+        blank=True,
+        null=True
+    )
+    state = models.CharField(
+        max_length=10,
+        choices=STATE_CHOICES,
+        default=STATE_PENDING,
+        verbose_name='State',
+        db_index=True
+    )
+    task_id = models.CharField(
+        max_length=40,
+        verbose_name='Task UUID',
+        blank=True,
+        null=True
+    )
+    bytes_transferred = models.BigIntegerField(
+        verbose_name='Bytes Transferred',
+        default=0
+    )
+    error = models.TextField(
+        verbose_name='Error',
+        blank=True,
+        null=True
+    )
+    remote_modified = models.DateTimeField(
+        verbose_name='Remote Modified',
+        help_text='Modification date of the catalogue record when imported',
+        blank=True,
+        null=True
+    )
+    fingerprint = models.CharField(
+        max_length=40,
+        verbose_name='Source Fingerprint',
+        help_text='Hash of the import request and remote modification date',
+        blank=True,
+        null=True,
+        db_index=True
+    )
+    layer = models.ForeignKey(
+        Layer,
+        verbose_name='Imported Layer',
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL,
+        related_name='import_jobs'
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        verbose_name='Requested By',
+        blank=True,
+        null=True
+    )
+    created = models.DateTimeField(
+        verbose_name='Created',
+        auto_now_add=True,
+        db_index=True
+    )
+    queued = models.DateTimeField(
+        verbose_name='Queued',
+        blank=True,
+        null=True
+    )
+    started = models.DateTimeField(
+        verbose_name='Started',
+        blank=True,
+        null=True
+    )
+    finished = models.DateTimeField(
+        verbose_name='Finished',
+        blank=True,
+        null=True
+    )
+
+    def transfer_rate(self):
+        """Average transfer rate in bytes per second.
+
+        :rtype: float
+        """
+        if not self.started:
+            return 0.0
+        end = self.finished or timezone.now()
+        elapsed = (end - self.started).total_seconds()
+        if elapsed <= 0:
+            return 0.0
+        return self.bytes_transferred / elapsed
+
+    def bbox_list(self):
+        if not self.bbox:
+            return None
+        return self.bbox.split(',')
+
+    def __unicode__(self):
+        return '%s %s' % (self.service_type, self.service_id)
+
+
+class ImpactFunction(models.Model):
+    """Represent an impact function available in InaSAFE Headless."""
+    function_id = models.CharField(
+        max_length=100,
+        verbose_name='ID of Impact Function',
+        unique=True
+    )
+    name = models.CharField(
+        max_length=255,
+        verbose_name='Name',
+        blank=True,
+        default=''
+    )
+    last_synced = models.DateTimeField(
+        verbose_name='Last Synced',
+        help_text='The last time the function was seen in InaSAFE Headless',
+        auto_now=True
+    )
+
+    def __unicode__(self):
+        return self.name or self.function_id
+
+
+class ImpactFunctionCompatibility(models.Model):
+    """Impact function usable with a hazard and exposure category."""
+
+    class Meta:
+        unique_together = (
+            'hazard_category', 'exposure_category', 'impact_function')
+        index_together = [
+            ['hazard_category', 'exposure_category'],
+        ]
+
+    hazard_category = models.CharField(
+        max_length=30,
+        verbose_name='Hazard Category'
+    )
+    exposure_category = models.CharField(
+        max_length=30,
+        verbose_name='Exposure Category'
+    )
+    impact_function = models.ForeignKey(
+        ImpactFunction,
+        verbose_name='Impact Function',
+        related_name='compatibilities'
+    )
+
+    def __unicode__(self):
+        return '%s on %s: %s' % (
+            self.hazard_category,
+            self.exposure_category,
+            self.impact_function.function_id)
+
+
 # needed to load signals
 from geosafe import signals  # noqa
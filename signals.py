@@ -3,6 +3,7 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 
 from geonode.layers.models import Layer
+from geosafe.helpers.headless_cache import invalidate_layer
 from geosafe.models import Analysis
 from geosafe.tasks.analysis import create_metadata_object, \
     process_impact_result
@@ -14,6 +15,9 @@ __date__ = '2/3/16'
 
 @receiver(post_save, sender=Layer)
 def layer_post_save(sender, instance, created, **kwargs):
+    # results of headless tasks computed from the previous layer content
+    # are outdated
+    invalidate_layer(instance.id)
     # execute in a different task to let post_save returns and create metadata
     # asyncly
     create_metadata_object.delay(instance.id)
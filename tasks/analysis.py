@@ -7,6 +7,7 @@ import os
 import tempfile
 import time
 import urlparse
+from multiprocessing.pool import ThreadPool
 from zipfile import ZipFile
 
 import requests
@@ -15,10 +16,17 @@ from celery.app import shared_task
 from django.conf import settings
 from django.core.files.base import File
 from django.core.urlresolvers import reverse
-from django.db.models.query_utils import Q
+from django.db import connection
 
 from geonode.layers.models import Layer
 from geonode.layers.utils import file_upload
+from geosafe.helpers.headless_cache import cached_task_result
+from geosafe.helpers.impact_summary.summary_base import load_impact_data
+from geosafe.helpers.impact_function_catalogue import (
+    sync_compatibility_matrix, sync_impact_functions)
+from geosafe.helpers.retention.cleanup import CleanupEngine
+from geosafe.helpers.retention.quota import RetentionManager
+from geosafe.helpers.scratch import ScratchSpace, sweep_scratch
 from geosafe.models import Analysis, Metadata
 from geosafe.tasks.headless.analysis import read_keywords_iso_metadata
 from geosafe.tasks.headless.analysis import run_analysis
@@ -29,10 +37,10 @@ __author__ = 'lucernae'
 LOGGER = logging.getLogger(__name__)
 
 
-def download_file(url, user=None, password=None):
+def download_file(url, user=None, password=None, directory=None):
     parsed_uri = urlparse.urlparse(url)
     if parsed_uri.scheme == 'http' or parsed_uri.scheme == 'https':
-        tmpfile = tempfile.mktemp()
+        tmpfile = tempfile.mktemp(dir=directory)
         # NOTE the stream=True parameter
         # Assign User-Agent to emulate browser
         headers = {
@@ -53,6 +61,79 @@ def download_file(url, user=None, password=None):
         return parsed_uri.path
 
 
+def impact_zip_layers(infolist):
+    """Find the output layers of an impact zip and their members.
+
+    Each shapefile or GeoTIFF is an output layer. Its files are the
+    members sharing its name, its reports are <name>.pdf and
+    <name>_table.pdf.
+
+    :param infolist: zip directory
+    :type infolist: list(zipfile.ZipInfo)
+
+    :return: list of dict of layer, layer_files, report_map and
+        report_table members, in zip order
+    :rtype: list(dict)
+    """
+    outputs = []
+    for info in infolist:
+        if os.path.splitext(info.filename)[1] in ['.shp', '.tif']:
+            outputs.append({
+                'layer': info,
+                'layer_files': [],
+                'report_map': None,
+                'report_table': None,
+            })
+
+    for output in outputs:
+        basename = os.path.splitext(output['layer'].filename)[0]
+        for info in infolist:
+            if info.filename == '%s.pdf' % basename:
+                output['report_map'] = info
+            elif info.filename == '%s_table.pdf' % basename:
+                output['report_table'] = info
+            elif info.filename.startswith('%s.' % basename):
+                output['layer_files'].append(info)
+    return outputs
+
+
+def _upload_output_layer(args):
+    """Upload one output layer.
+
+    Executed in a worker thread, so the thread database connection is
+    closed afterwards.
+
+    :param args: tuple of layer file path and title
+    :type args: tuple
+
+    :return: tuple of the saved layer and the error if it failed
+    :rtype: (Layer, Exception)
+    """
+    path, title = args
+    try:
+        saved_layer = file_upload(path, overwrite=True)
+        saved_layer.set_default_permissions()
+        saved_layer.title = title
+        saved_layer.save()
+        return saved_layer, None
+    except Exception as e:
+        LOGGER.exception(e)
+        return None, e
+    finally:
+        connection.close()
+
+
+def zip_member_file(zf, info):
+    """Wrap a zip member as file to store it without extracting.
+
+    :rtype: File
+    """
+    member_file = File(zf.open(info), name=os.path.basename(info.filename))
+    # size can't be found from the zip stream itself
+    member_file.size = info.file_size
+    return member_file
+
+
 @shared_task(
     name='geosafe.tasks.analysis.create_metadata_object',
     queue='geosafe')
@@ -75,9 +156,10 @@ def create_metadata_object(layer_id):
         'geosafe:layer-metadata',
         kwargs={'layer_id': layer_id})
     layer_url = urlparse.urljoin(settings.GEONODE_BASE_URL, layer_url)
-    async_result = read_keywords_iso_metadata.delay(
-        layer_url, ('layer_purpose', 'hazard', 'exposure'))
-    keywords = async_result.get()
+    keywords = cached_task_result(
+        read_keywords_iso_metadata,
+        (layer_url, ('layer_purpose', 'hazard', 'exposure')),
+        layer_ids=[layer_id])
     metadata.layer_purpose = keywords.get('layer_purpose', None)
     metadata.category = keywords.get(metadata.layer_purpose, None)
     metadata.save()
@@ -90,17 +172,63 @@ def create_metadata_object(layer_id):
 def clean_impact_result():
     """Clean all the impact results not marked kept
 
-    :return:
+    Deletion is done in chunks by CleanupEngine. An interrupted run is
+    resumed by the next one. Progress is reported as task state meta.
+
+    :return: cleanup progress
+    :rtype: dict
     """
-    query = Q(keep=True)
-    for a in Analysis.objects.filter(~query):
-        a.delete()
+    def update_progress(progress):
+        if clean_impact_result.request.id:
+            clean_impact_result.update_state(
+                state='PROGRESS', meta=progress)
 
-    for i in Metadata.objects.filter(layer_purpose='impact'):
-        try:
-            Analysis.objects.get(impact_layer=i.layer)
-        except Analysis.DoesNotExist:
-            i.delete()
+    engine = CleanupEngine(progress_callback=update_progress)
+    return engine.run()
+
+
+@shared_task(
+    name='geosafe.tasks.analysis.enforce_impact_quota',
+    queue='geosafe')
+def enforce_impact_quota():
+    """Evict least recently used impact results exceeding the quota.
+
+    Impact metadata left without analysis is removed too.
+
+    :return: number of evicted analyses and bytes
+    :rtype: dict
+    """
+    manager = RetentionManager()
+    evicted = manager.evict()
+    manager.cleanup.delete_orphans()
+    return evicted
+
+
+@shared_task(
+    name='geosafe.tasks.analysis.sweep_scratch_space',
+    queue='geosafe')
+def sweep_scratch_space():
+    """Remove scratch directories leaked by interrupted tasks.
+
+    :return: number of removed entries and bytes
+    :rtype: dict
+    """
+    return sweep_scratch()
+
+
+@shared_task(
+    name='geosafe.tasks.analysis.sync_impact_function_catalogue',
+    queue='geosafe')
+def sync_impact_function_catalogue():
+    """Sync the local impact function catalogue from InaSAFE Headless.
+
+    :return: number of impact functions and category pairs synced
+    :rtype: dict
+    """
+    return {
+        'impact_functions': sync_impact_functions(),
+        'category_pairs': sync_compatibility_matrix()
+    }
 
 
 @shared_task(
@@ -134,74 +262,108 @@ def process_impact_result(analysis_id):
     while try_count < 5:
         time.sleep(5)
         try:
+            # reports are rendered on demand by render_analysis_report
             impact_url = run_analysis.delay(
                 hazard,
                 exposure,
                 function,
-                generate_report=True).get()
+                generate_report=getattr(
+                    settings, 'GEOSAFE_GENERATE_REPORT_WITH_ANALYSIS',
+                    False)).get()
             break
         except:
             try_count += 1
 
-    # download impact zip
-    impact_path = download_file(impact_url)
-    dir_name = os.path.dirname(impact_path)
+    # download impact zip in a directory of this task, so files of
+    # concurrent tasks with the same name don't collide
     success = False
-    with ZipFile(impact_path) as zf:
-        zf.extractall(path=dir_name)
-        for name in zf.namelist():
-            basename, ext = os.path.splitext(name)
-            if ext in ['.shp', '.tif']:
-                # process this in the for loop to make sure it works only
-                # when we found the layer
-                saved_layer = file_upload(
-                    os.path.join(dir_name, name),
-                    overwrite=True)
-                saved_layer.set_default_permissions()
+    with ScratchSpace('impact') as scratch:
+        impact_path = download_file(impact_url, directory=scratch.directory)
+        dir_name = scratch.mkdtemp('extract-')
+        with ZipFile(impact_path) as zf:
+            # look up the layers in the zip directory, then extract only
+            # the files of those layers
+            outputs = impact_zip_layers(zf.infolist())
+            for output in outputs:
+                for info in output['layer_files']:
+                    zf.extract(info, dir_name)
+
+            if outputs:
                 if analysis.user_title:
                     layer_name = analysis.user_title
                 else:
                     layer_name = analysis.get_default_impact_title()
-                saved_layer.title = layer_name
-                saved_layer.save()
+                upload_args = []
+                for index, output in enumerate(outputs):
+                    title = layer_name
+                    if index > 0:
+                        title = '%s (%s)' % (
+                            layer_name,
+                            os.path.splitext(
+                                os.path.basename(
+                                    output['layer'].filename))[0])
+                    upload_args.append((
+                        os.path.join(dir_name, output['layer'].filename),
+                        title))
+
+                # output layers are independent, upload them concurrently
+                workers = getattr(settings, 'GEOSAFE_INGEST_WORKERS', 4)
+                pool = ThreadPool(max(min(workers, len(upload_args)), 1))
+                try:
+                    results = pool.map(_upload_output_layer, upload_args)
+                finally:
+                    pool.close()
+                    pool.join()
+
+                saved_layer, error = results[0]
+                saved_layers = [r[0] for r in results if r[0]]
+                if error:
+                    # the impact layer is required, drop the others
+                    for layer in saved_layers:
+                        layer.delete()
+                    raise error
+
+                previous_outputs = analysis.extra_output_layers()
                 current_impact = None
                 if analysis.impact_layer:
                     current_impact = analysis.impact_layer
                 analysis.impact_layer = saved_layer
 
-                # check map report and table
-                report_map_path = os.path.join(
-                    dir_name, '%s.pdf' % basename
-                )
-
-                if os.path.exists(report_map_path):
-                    analysis.assign_report_map(report_map_path)
+                # reports of the impact layer are stored straight from the
+                # zip
+                if outputs[0]['report_map']:
+                    analysis.assign_report_map(
+                        zip_member_file(zf, outputs[0]['report_map']))
 
-                report_table_path = os.path.join(
-                    dir_name, '%s_table.pdf' % basename
-                )
-
-                if os.path.exists(report_table_path):
-                    analysis.assign_report_table(report_table_path)
+                if outputs[0]['report_table']:
+                    analysis.assign_report_table(
+                        zip_member_file(zf, outputs[0]['report_table']))
 
                 analysis.task_id = process_impact_result.request.id
                 analysis.task_state = 'SUCCESS'
+                # summary of the previous impact layer
+                analysis.impact_data = None
                 analysis.save()
-
-                if current_impact:
+                analysis.output_layers.clear()
+                analysis.output_layers.add(*saved_layers)
+                analysis.storage_size = analysis.calculate_storage_size()
+                analysis.save(update_fields=['storage_size'])
+                # summarize once, pages then read the stored summary
+                try:
+                    load_impact_data(saved_layer)
+                except Exception as e:
+                    LOGGER.exception(e)
+
+                # overwritten layers are reused, keep them
+                saved_ids = [layer.id for layer in saved_layers]
+                if current_impact and current_impact.id not in saved_ids:
                     current_impact.delete()
+                for layer in previous_outputs:
+                    if layer.id not in saved_ids:
+                        layer.delete()
                 success = True
-                break
 
-        # cleanup
-        for name in zf.namelist():
-            filepath = os.path.join(dir_name, name)
-            try:
-                os.remove(filepath)
-            except:
-                pass
-
-    # cleanup
+    # cleanup impact zip given as local file
     try:
         os.remove(impact_path)
     except:
@@ -211,3 +373,74 @@ def process_impact_result(analysis_id):
         LOGGER.info('No impact layer found in %s' % impact_url)
 
     return success
+
+
+@shared_task(
+    name='geosafe.tasks.analysis.render_analysis_report',
+    queue='geosafe')
+def render_analysis_report(analysis_id):
+    """Render map and table reports of an analysis on demand.
+
+    InaSAFE Headless only renders reports as part of an analysis run, so
+    the analysis is run again with reports. Only the reports of the impact
+    layer are taken from the result, the layers are left as they are.
+
+    The reports are not rendered if the hazard or exposure layer was
+    uploaded again after the analysis, since they would not match the
+    impact layer. That case, and a run without reports, is recorded in
+    report_error so the analysis isn't run again for nothing.
+
+    :param analysis_id: analysis id of the object
+    :type analysis_id: int
+
+    :return: True if the reports were stored
+    :rtype: bool
+    """
+    analysis = Analysis.objects.get(id=analysis_id)
+    if analysis.has_reports():
+        return True
+    if analysis.report_error:
+        return False
+
+    for layer in [analysis.hazard_layer, analysis.exposure_layer]:
+        upload_session = layer.upload_session
+        if upload_session and upload_session.date > analysis.created:
+            analysis.report_error = (
+                'Layer %s changed after the analysis' % layer.title)
+            analysis.save(update_fields=['report_error'])
+            LOGGER.info(analysis.report_error)
+            return False
+
+    impact_url = run_analysis.delay(
+        analysis.get_layer_url(analysis.hazard_layer),
+        analysis.get_layer_url(analysis.exposure_layer),
+        analysis.impact_function_id,
+        generate_report=True).get()
+
+    success = False
+    with ScratchSpace('report') as scratch:
+        impact_path = download_file(impact_url, directory=scratch.directory)
+        with ZipFile(impact_path) as zf:
+            outputs = impact_zip_layers(zf.infolist())
+            if (outputs and outputs[0]['report_map'] and
+                    outputs[0]['report_table']):
+                analysis.assign_report_map(
+                    zip_member_file(zf, outputs[0]['report_map']))
+                analysis.assign_report_table(
+                    zip_member_file(zf, outputs[0]['report_table']))
+                analysis.storage_size = analysis.calculate_storage_size()
+                analysis.save(update_fields=[
+                    'report_map', 'report_table', 'storage_size'])
+                success = True
+
+    # cleanup impact zip given as local file
+    try:
+        os.remove(impact_path)
+    except:
+        pass
+
+    if not success:
+        LOGGER.info('No report found in %s' % impact_url)
+        analysis.report_error = 'InaSAFE Headless rendered no report'
+        analysis.save(update_fields=['report_error'])
+    return success
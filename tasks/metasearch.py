@@ -2,42 +2,45 @@
 
 from __future__ import absolute_import
 
-import re
-import shutil
 import os
 import tempfile
 import io
-import urllib
-import urlparse
 
-from zipfile import ZipFile
+import logging
 
-import subprocess
 from celery.app import shared_task
-from owslib.wfs import WebFeatureService
 
 from geonode.layers.utils import file_upload
-from geosafe.tasks.analysis import download_file
+from geosafe.helpers.metasearch.csw_helper import csw_query_metadata_by_id
+from geosafe.helpers.metasearch.harvest import (
+    CatalogueHarvester,
+    parse_datestamp,
+    public_catalogues)
+from geosafe.helpers.metasearch.import_jobs import (
+    TransferProgress,
+    find_imported_layer,
+    finish_import_job,
+    job_credentials,
+    schedule_import_jobs,
+    source_fingerprint,
+    start_import_job)
+from geosafe.helpers.metasearch.iso_metadata import normalise_iso_metadata
+from geosafe.helpers.metasearch.record_cache import record_cache
+from geosafe.helpers.metasearch.wcs_download import download_coverage
+from geosafe.helpers.metasearch.wfs_download import download_features
+from geosafe.helpers.scratch import ScratchSpace
+from geosafe.models import HarvestedCatalogue, ImportJob
 
 __author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
 __date__ = '7/29/16'
 
 
+LOGGER = logging.getLogger(__name__)
+
+
 def cleanup_metadata(metadata_string):
     """Cleanup inasafe metadata in Supplemental Information."""
-    pattern = (r'<gmd:supplementalInformation>'
-               r'(?P<inasafe_keywords>'
-               r'\s*<gco:CharacterString>[\w\W]*</gco:CharacterString>\s*)'
-               r'</gmd:supplementalInformation>')
-    prog = re.search(pattern, metadata_string)
-    inasafe_keywords = prog.group('inasafe_keywords')
-    new_inasafe_keywords = inasafe_keywords\
-        .replace('&gt;', '>').replace('&lt;', '<').replace('&quot;', '"')\
-        .replace('&apos;', "'").replace('&amp;', '&')
-    new_inasafe_keywords = new_inasafe_keywords.strip()
-    new_inasafe_keywords = new_inasafe_keywords[
-        len('<gco:CharacterString>'):-len('</gco:CharacterString>')]
-    return metadata_string.replace(inasafe_keywords, new_inasafe_keywords)
+    return normalise_iso_metadata(metadata_string)
 
 
 @shared_task(
@@ -50,52 +53,40 @@ def add_wcs_layer(
         metadata_string=None,
         title=None,
         bbox=None,
-        user=None, password=None):
-    # build url
-    endpoint_parsed = urlparse.urlparse(endpoint)
-    q_dict = {
-        'version': version,
-        'coverageid': coverage_id,
-        'format': 'image/tiff',
-        'request': 'GetCoverage',
-        'service': 'WCS',
-        'crs': 'EPSG:4326',
-    }
-    if bbox:
-        q_dict['bbox'] = ','.join(bbox)
-    parsed_url = urlparse.ParseResult(
-        scheme=endpoint_parsed.scheme,
-        netloc=endpoint_parsed.netloc,
-        path=endpoint_parsed.path,
-        params=None,
-        query=urllib.urlencode(q_dict),
-        fragment=None
-    )
-    tmpfile = download_file(parsed_url.geturl(), user=user, password=password)
-    shutil.move(tmpfile, tmpfile + '.tif')
-    metadata_file = '%s.xml' % tmpfile
-    tmpfile += '.tif'
-
-    # get metadata file
-    if metadata_string:
-        if not isinstance(metadata_string, unicode):
-            metadata_string = unicode(metadata_string, 'utf-8')
-
-        metadata_string = cleanup_metadata(metadata_string)
-        with io.open(metadata_file, mode='w', encoding='utf-8') as f:
-            f.write(metadata_string)
-
+        user=None, password=None,
+        job_id=None):
     saved_layer = None
-    with open(tmpfile) as f:
+    with ScratchSpace('wcs') as scratch:
+        # download coverage in tiles and mosaic them
+        tmpfile = tempfile.mktemp(dir=scratch.directory)
+        metadata_file = '%s.xml' % tmpfile
+        tmpfile += '.tif'
+        progress = TransferProgress(job_id) if job_id else None
+        download_coverage(
+            endpoint,
+            version,
+            coverage_id,
+            tmpfile,
+            bbox=bbox,
+            user=user,
+            password=password,
+            progress_callback=progress)
+        if progress:
+            progress.flush()
+
+        # get metadata file
+        if metadata_string:
+            if not isinstance(metadata_string, unicode):
+                metadata_string = unicode(metadata_string, 'utf-8')
+
+            metadata_string = cleanup_metadata(metadata_string)
+            with io.open(metadata_file, mode='w', encoding='utf-8') as f:
+                f.write(metadata_string)
+
         saved_layer = file_upload(tmpfile, overwrite=True)
         saved_layer.set_default_permissions()
         saved_layer.title = title or coverage_id
         saved_layer.save()
-    try:
-        os.remove(tmpfile)
-        os.remove(metadata_file)
-    except:
-        pass
     return saved_layer
 
 
@@ -110,112 +101,169 @@ def add_wfs_layer(
         title=None,
         bbox=None,
         user=None,
-        password=None):
-    endpoint_parsed = urlparse.urlparse(endpoint)
-    q_dict = {
-        'version': version,
-        'typename': typename,
-        'outputFormat': 'shape-zip',
-        'request': 'GetFeature',
-        'service': 'WFS',
-        'srsName': 'EPSG:4326',
-    }
-    if bbox:
-        q_dict['bbox'] = ','.join(bbox)
-    parsed_url = urlparse.ParseResult(
-        scheme=endpoint_parsed.scheme,
-        netloc=endpoint_parsed.netloc,
-        path=endpoint_parsed.path,
-        params=None,
-        query=urllib.urlencode(q_dict),
-        fragment=None
-    )
-    tmpfile = download_file(parsed_url.geturl(), user=user, password=password)
-
-    # args = [
-    #     'ogr2ogr',
-    #     '-nlt POLYGON',
-    #     '-skipfailures',
-    #     '%s.shp' % tmpfile,
-    #     tmpfile,
-    #     'OGRGeoJSON'
-    # ]
-    #
-    # retval = subprocess.call(args)
-
-    # # get metadata file
-    # if metadata_string:
-    #     if not isinstance(metadata_string, unicode):
-    #         metadata_string = unicode(metadata_string, 'utf-8')
-    #     metadata_file = '%s.xml' % tmpfile
-    #     with io.open(metadata_file, mode='w', encoding='utf-8') as f:
-    #         f.write(metadata_string)
-    #
-    # saved_layer = None
-    # if retval == 0:
-    #     saved_layer = file_upload(
-    #         '%s.shp' % tmpfile,
-    #         overwrite=True)
-    #     saved_layer.set_default_permissions()
-    #     saved_layer.title = title or typename
-    #     saved_layer.save()
-    #
-    # # cleanup
-    # dir_name = os.path.dirname(tmpfile)
-    # for root, dirs, files in os.walk(dir_name):
-    #     for f in files:
-    #         if tmpfile in f:
-    #             try:
-    #                 os.remove(os.path.join(root, f))
-    #             except:
-    #                 pass
-
-    dir_name = os.path.dirname(tmpfile)
+        password=None,
+        job_id=None):
     saved_layer = None
-    metadata_file = None
-
-    with ZipFile(tmpfile) as zf:
-        zf.extractall(path=dir_name)
-        for name in zf.namelist():
-            basename, ext = os.path.splitext(name)
-            if '.shp' in ext:
-                # get metadata file
-                if metadata_string:
-                    if not isinstance(metadata_string, unicode):
-                        metadata_string = unicode(metadata_string, 'utf-8')
-                    metadata_file = '%s.xml' % basename
-                    metadata_file = os.path.join(dir_name, metadata_file)
-                    metadata_string = cleanup_metadata(metadata_string)
-                    with io.open(metadata_file, mode='w',
-                                 encoding='utf-8') as f:
-                        f.write(metadata_string)
-
-                # process shapefile layer
-                saved_layer = file_upload(
-                    os.path.join(dir_name, name),
-                    overwrite=True)
-                saved_layer.set_default_permissions()
-                saved_layer.title = title or typename
-                saved_layer.save()
-                break
-
-        # cleanup
-        for name in zf.namelist():
-            filepath = os.path.join(dir_name, name)
-            try:
-                os.remove(filepath)
-            except:
-                pass
-
-        if metadata_file:
-            try:
-                os.remove(metadata_file)
-            except:
-                pass
-
-    # cleanup
-    try:
-        os.remove(tmpfile)
-    except:
-        pass
+    with ScratchSpace('wfs') as scratch:
+        # download features page by page into a shapefile
+        dir_name = scratch.directory
+        layer_name = typename.split(':')[-1]
+        shapefile = os.path.join(dir_name, '%s.shp' % layer_name)
+        progress = TransferProgress(job_id) if job_id else None
+        shapefile = download_features(
+            endpoint,
+            typename,
+            shapefile,
+            version=version,
+            bbox=bbox,
+            user=user,
+            password=password,
+            progress_callback=progress)
+        if progress:
+            progress.flush()
+        if shapefile:
+            # get metadata file
+            if metadata_string:
+                if not isinstance(metadata_string, unicode):
+                    metadata_string = unicode(metadata_string, 'utf-8')
+                metadata_file = os.path.join(dir_name, '%s.xml' % layer_name)
+                metadata_string = cleanup_metadata(metadata_string)
+                with io.open(metadata_file, mode='w',
+                             encoding='utf-8') as f:
+                    f.write(metadata_string)
+
+            # process shapefile layer
+            saved_layer = file_upload(shapefile, overwrite=True)
+            saved_layer.set_default_permissions()
+            saved_layer.title = title or typename
+            saved_layer.save()
     return saved_layer
+
+
+def dispatch_import_job(job):
+    """Send an import job to celery.
+
+    :return: celery task id
+    :rtype: str
+    """
+    return run_import_job.delay(job.id).task_id
+
+
+@shared_task(
+    name='geosafe.tasks.metasearch.run_import_job',
+    queue='geosafe')
+def run_import_job(job_id):
+    """Run an import job, then start pending jobs of the same host."""
+    try:
+        job = ImportJob.objects.get(id=job_id)
+    except ImportJob.DoesNotExist:
+        LOGGER.info('Import job %s does not exist' % job_id)
+        return
+
+    if not start_import_job(job):
+        LOGGER.info('Import job %s is no longer queued' % job_id)
+        return
+    user, password = job_credentials(job)
+    try:
+        metadata_string = None
+        remote_modified = None
+        if job.csw_url and job.identifier:
+            # fetch the current record, to know if the remote has changed
+            record_cache.invalidate(
+                job.csw_url, job.identifier, username=user,
+                password=password)
+            record = csw_query_metadata_by_id(
+                job.csw_url,
+                job.identifier,
+                username=user,
+                password=password)
+            if record:
+                metadata_string = record.xml
+                remote_modified = parse_datestamp(
+                    getattr(record, 'datestamp', None))
+
+        job.remote_modified = remote_modified
+        job.fingerprint = source_fingerprint(job, remote_modified)
+        job.save(update_fields=['remote_modified', 'fingerprint'])
+
+        # reuse the layer if this source was imported and hasn't changed
+        layer = find_imported_layer(job)
+        if layer:
+            LOGGER.info('Reuse layer %s imported from %s' % (
+                layer.name, job.service_id))
+            finish_import_job(job, layer=layer)
+            return
+
+        if job.service_type == 'WCS':
+            import_layer = add_wcs_layer
+        elif job.service_type == 'WFS':
+            import_layer = add_wfs_layer
+        else:
+            raise ValueError(
+                'Unsupported service type: %s' % job.service_type)
+
+        layer = import_layer(
+            job.endpoint,
+            job.service_version,
+            job.service_id,
+            metadata_string=metadata_string,
+            title=job.title,
+            bbox=job.bbox_list(),
+            user=user,
+            password=password,
+            job_id=job.id)
+        if not layer:
+            raise ValueError('No data found for %s' % job.service_id)
+        finish_import_job(job, layer=layer)
+    except Exception as e:
+        LOGGER.exception(e)
+        finish_import_job(job, error=e)
+    finally:
+        # free download slot of this host
+        schedule_import_jobs(dispatch_import_job, host=job.host)
+
+
+@shared_task(
+    name='geosafe.tasks.metasearch.schedule_import_jobs',
+    queue='geosafe')
+def schedule_pending_import_jobs():
+    """Dispatch pending import jobs of hosts with free download slots.
+
+    Run periodically, in case a job was left pending when a worker died.
+    """
+    return schedule_import_jobs(dispatch_import_job)
+
+
+@shared_task(
+    name='geosafe.tasks.metasearch.harvest_catalogue',
+    queue='geosafe')
+def harvest_catalogue(csw_url):
+    """Harvest public records of a CSW catalogue into the local index.
+
+    Only records modified since the previous harvest are fetched. Every
+    GEOSAFE_METASEARCH_HARVEST_SWEEP_INTERVAL seconds, records removed
+    from the catalogue are deleted from the index.
+
+    :param csw_url: CSW endpoint url
+    :type csw_url: str
+
+    :return: number of records harvested
+    :rtype: int
+    """
+    harvester = CatalogueHarvester(csw_url)
+    return harvester.harvest()
+
+
+@shared_task(
+    name='geosafe.tasks.metasearch.harvest_catalogues',
+    queue='geosafe')
+def harvest_catalogues():
+    """Schedule harvest of every public metasearch catalogue.
+
+    Catalogues configured with credentials are searched live, and their
+    index from a previous harvest is removed.
+    """
+    public_urls = [c['url'] for c in public_catalogues()]
+    HarvestedCatalogue.objects.exclude(csw_url__in=public_urls).delete()
+    for csw_url in public_urls:
+        harvest_catalogue.delay(csw_url)
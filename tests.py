@@ -1,3 +1,466 @@
-from django.test import TestCase
+# coding=utf-8
+import base64
+import json
+import zipfile
+from datetime import datetime
+from io import BytesIO
+from unittest import skipIf
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from geosafe.helpers.analysis_history import (
+    AnalysisHistory,
+    InvalidCursor,
+    decode_cursor,
+    encode_cursor)
+from geosafe.helpers.circuit_breaker import CircuitBreaker, CircuitOpen
+from geosafe.helpers.impact_summary.summary_engine import \
+    ImpactSummaryEngine
+from geosafe.helpers.metasearch.import_jobs import (
+    create_import_job,
+    finish_import_job)
+from geosafe.helpers.metasearch.wcs_download import split_bbox
+from geosafe.helpers.retention.quota import RetentionManager
+from geosafe.helpers.zip_stream import ZipStream, ZipStreamEntry
+from geosafe.models import ImportJob
+
+try:
+    import numpy
+    from osgeo import gdal, ogr
+except ImportError:
+    gdal = None
+
+__author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
+__date__ = '10/19/16'
+
+
+def raw_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value))
+
+
+class AnalysisHistoryCursorTest(SimpleTestCase):
+
+    def test_cursor_round_trip(self):
+        created = datetime(2016, 10, 19, 8, 30, 15, 123456, timezone.utc)
+        self.assertEqual(
+            decode_cursor(encode_cursor(created, 42)), (created, 42))
+
+    def test_invalid_cursor(self):
+        for cursor in [
+                'not a cursor',
+                raw_cursor([]),
+                raw_cursor(['not a date', 1]),
+                raw_cursor(['2016-10-19T08:30:15', 'not an id'])]:
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+
+    @override_settings(
+        GEOSAFE_ANALYSIS_HISTORY_PAGE_SIZE=50,
+        GEOSAFE_ANALYSIS_HISTORY_MAX_PAGE_SIZE=200)
+    def test_page_size(self):
+        self.assertEqual(AnalysisHistory(None).limit, 50)
+        self.assertEqual(AnalysisHistory(None, limit=10).limit, 10)
+        self.assertEqual(AnalysisHistory(None, limit=1000).limit, 200)
+
+    def test_split(self):
+        created = datetime(2016, 10, 19, 8, 30, tzinfo=timezone.utc)
+        rows = [(created, 3), (created, 2), (created, 1)]
+        history = AnalysisHistory(None, limit=2)
+
+        page, cursor = history.split(
+            rows, lambda r: r[0], lambda r: r[1])
+        self.assertEqual(page, rows[:2])
+        self.assertEqual(decode_cursor(cursor), (created, 2))
+
+        # the last page has no cursor
+        next_history = AnalysisHistory(None, after=cursor, limit=2)
+        self.assertEqual(next_history.after, (created, 2))
+        page, cursor = next_history.split(
+            rows[2:], lambda r: r[0], lambda r: r[1])
+        self.assertEqual(page, rows[2:])
+        self.assertIsNone(cursor)
+
+
+class FakeAnalysis(object):
+
+    def __init__(self, analysis_id, storage_size):
+        self.id = analysis_id
+        self.storage_size = storage_size
+
+
+class FakeCleanup(object):
+    """Cleanup engine failing to delete some analyses."""
+
+    def __init__(self, analyses, failing_ids=(), chunk_size=3):
+        self.analyses = analyses
+        self.failing_ids = set(failing_ids)
+        self.chunk_size = chunk_size
+        self.workers = 1
+        self.chunks = []
+
+    def delete_chunk_ids(self, analyses, pool):
+        self.chunks.append([a.id for a in analyses])
+        failed_ids = [a.id for a in analyses if a.id in self.failing_ids]
+        deleted_ids = [a.id for a in analyses if a.id not in failed_ids]
+        self.analyses[:] = [
+            a for a in self.analyses if a.id not in deleted_ids]
+        return deleted_ids, failed_ids
+
+
+class FakeRetentionManager(RetentionManager):
+    """Retention of in memory analyses, least recently used first."""
+
+    def __init__(self, analyses, failing_ids=(), **kwargs):
+        super(FakeRetentionManager, self).__init__(**kwargs)
+        self.analyses = list(analyses)
+        self.cleanup = FakeCleanup(self.analyses, failing_ids)
+
+    def update_storage_size(self):
+        pass
+
+    def usage(self):
+        return {
+            'bytes': sum(a.storage_size for a in self.analyses),
+            'rows': len(self.analyses),
+        }
+
+    def eviction_candidates(self, exclude_ids=()):
+        return [a for a in self.analyses if a.id not in exclude_ids]
+
+
+class RetentionManagerEvictTest(SimpleTestCase):
+
+    def analyses(self, count=10, size=10):
+        return [FakeAnalysis(i, size) for i in range(1, count + 1)]
+
+    def test_within_quota(self):
+        manager = FakeRetentionManager(
+            self.analyses(), max_bytes=1000, max_rows=100)
+        self.assertEqual(
+            manager.evict(), {'rows': 0, 'bytes': 0, 'failed': 0})
+        self.assertEqual(manager.cleanup.chunks, [])
+
+    def test_evict_to_low_watermark(self):
+        # 100 bytes used, evicted down to 80 * 0.5 bytes
+        manager = FakeRetentionManager(
+            self.analyses(), max_bytes=80, low_watermark=0.5)
+        self.assertEqual(
+            manager.evict(), {'rows': 6, 'bytes': 60, 'failed': 0})
+        self.assertEqual(
+            [a.id for a in manager.analyses], [7, 8, 9, 10])
+
+    def test_evict_rows(self):
+        manager = FakeRetentionManager(
+            self.analyses(), max_rows=5, low_watermark=0.6)
+        self.assertEqual(
+            manager.evict(), {'rows': 7, 'bytes': 70, 'failed': 0})
+
+    def test_failed_deletions_are_skipped(self):
+        manager = FakeRetentionManager(
+            self.analyses(), failing_ids=[1, 2], max_bytes=80,
+            low_watermark=0.5)
+        evicted = manager.evict()
+        # failures don't count towards the evicted amount
+        self.assertEqual(evicted, {'rows': 6, 'bytes': 60, 'failed': 2})
+        self.assertEqual(
+            [a.id for a in manager.analyses], [1, 2, 9, 10])
+        # failed analyses are not tried again
+        tried = sum(manager.cleanup.chunks, [])
+        self.assertEqual(sorted(tried), range(1, 9))
+
+    def test_every_deletion_fails(self):
+        manager = FakeRetentionManager(
+            self.analyses(count=4), failing_ids=range(1, 5), max_bytes=10)
+        self.assertEqual(
+            manager.evict(), {'rows': 0, 'bytes': 0, 'failed': 4})
+        self.assertEqual(len(manager.analyses), 4)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'geosafe-tests',
+    }
+})
+class CircuitBreakerTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker('test', threshold=3, cooldown=60)
+
+    def open_cooldown(self):
+        """End the cooldown without waiting for it."""
+        cache.delete(self.breaker._key('open'))
+
+    def test_closed(self):
+        self.breaker.before_call()
+        self.assertFalse(self.breaker.is_open())
+
+    def test_open_after_threshold(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.is_open())
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.is_open())
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+
+    def test_success_resets_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.is_open())
+
+    def test_half_open_single_probe(self):
+        for i in range(3):
+            self.breaker.record_failure()
+        self.open_cooldown()
+        self.breaker.before_call()
+        # a second caller waits for the probe
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+
+    def test_probe_success_closes(self):
+        for i in range(3):
+            self.breaker.record_failure()
+        self.open_cooldown()
+        self.breaker.before_call()
+        self.breaker.record_success()
+        self.assertFalse(self.breaker.is_open())
+        self.breaker.before_call()
+        self.breaker.before_call()
+
+    def test_probe_failure_opens_again(self):
+        for i in range(3):
+            self.breaker.record_failure()
+        self.open_cooldown()
+        self.breaker.before_call()
+        # one failure is enough once tripped
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.is_open())
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+
+
+class ZipStreamTest(SimpleTestCase):
+
+    def read_archive(self, entries):
+        archive = zipfile.ZipFile(BytesIO(b''.join(ZipStream(entries))))
+        self.assertIsNone(archive.testzip())
+        return archive
+
+    def entry(self, arcname, content, size=None):
+        return ZipStreamEntry(
+            arcname, lambda: BytesIO(content), size=size)
+
+    def test_round_trip(self):
+        # larger than a chunk, so it is compressed in several parts
+        content = b'InaSAFE impact report ' * 10000
+        archive = self.read_archive([
+            self.entry('report.pdf', content, size=len(content)),
+            self.entry('empty.txt', b'', size=0),
+        ])
+        self.assertEqual(archive.namelist(), ['report.pdf', 'empty.txt'])
+        self.assertEqual(archive.read('report.pdf'), content)
+        self.assertEqual(archive.read('empty.txt'), b'')
+
+    def test_unknown_size(self):
+        # unknown sizes are written with ZIP64 records
+        archive = self.read_archive([self.entry('table.pdf', b'table')])
+        self.assertEqual(archive.read('table.pdf'), b'table')
+        self.assertEqual(archive.getinfo('table.pdf').file_size, 5)
+
+    def test_unicode_name(self):
+        archive = self.read_archive(
+            [self.entry(u'b\xe9ncana.txt', b'flood', size=5)])
+        self.assertEqual(archive.namelist(), [u'b\xe9ncana.txt'])
+        self.assertEqual(archive.read(u'b\xe9ncana.txt'), b'flood')
+
+    def test_no_entries(self):
+        self.assertEqual(self.read_archive([]).namelist(), [])
+
+
+class SplitBboxTest(SimpleTestCase):
+
+    def assertCovers(self, bbox, tiles, columns, rows):
+        """Tiles are a grid covering bbox exactly, without overlap."""
+        self.assertEqual(len(tiles), columns * rows)
+        grid = [tiles[r * columns:(r + 1) * columns] for r in range(rows)]
+        for row in grid:
+            self.assertEqual(row[0][0], bbox[0])
+            self.assertEqual(row[-1][2], bbox[2])
+            for left, right in zip(row, row[1:]):
+                self.assertEqual(left[2], right[0])
+                self.assertEqual((left[1], left[3]), (right[1], right[3]))
+        for column in zip(*grid):
+            self.assertEqual(column[0][1], bbox[1])
+            self.assertEqual(column[-1][3], bbox[3])
+            for lower, upper in zip(column, column[1:]):
+                self.assertEqual(lower[3], upper[1])
+        for minx, miny, maxx, maxy in tiles:
+            self.assertLess(minx, maxx)
+            self.assertLess(miny, maxy)
+
+    def test_single_tile(self):
+        bbox = [106.7, -6.3, 106.9, -6.1]
+        self.assertEqual(split_bbox(bbox, 1.0), [tuple(bbox)])
+
+    def test_grid(self):
+        bbox = [95.0, -11.0, 141.0, 6.0]
+        tiles = split_bbox(bbox, 10.0)
+        self.assertCovers(bbox, tiles, 5, 2)
+        for minx, miny, maxx, maxy in tiles:
+            self.assertLessEqual(maxx - minx, 10.0)
+            self.assertLessEqual(maxy - miny, 10.0)
+
+    def test_uneven_division(self):
+        # 0.1 steps are not exact in binary, edges must still match
+        bbox = [0.0, 0.0, 1.0, 0.3]
+        tiles = split_bbox(bbox, 0.1)
+        self.assertCovers(bbox, tiles, 10, 3)
+
+
+class FakeSummaryEngine(ImpactSummaryEngine):
+    """Summary engine of layer files given by path, without a Layer."""
+
+    def __init__(self, path, exposure='population', **kwargs):
+        super(FakeSummaryEngine, self).__init__(None, **kwargs)
+        self.path = path
+        self._keywords = {'exposure': exposure}
+
+    def layer_file_path(self, extensions):
+        for extension in extensions:
+            if self.path.endswith(extension):
+                return self.path
+        return None
+
+
+@skipIf(gdal is None, 'NumPy and GDAL are required to summarize layers')
+class ImpactSummaryEngineTest(SimpleTestCase):
+
+    def raster(self, values, data_type, nodata):
+        path = '/vsimem/impact.tif'
+        values = numpy.array(values)
+        rows, columns = values.shape
+        dataset = gdal.GetDriverByName('GTiff').Create(
+            path, columns, rows, 1, data_type)
+        band = dataset.GetRasterBand(1)
+        band.SetNoDataValue(nodata)
+        band.WriteArray(values)
+        dataset = None
+        self.addCleanup(gdal.Unlink, path)
+        return path
+
+    def vector(self, features, population=True):
+        path = '/vsimem/impact.shp'
+        driver = ogr.GetDriverByName('ESRI Shapefile')
+        datasource = driver.CreateDataSource(path)
+        layer = datasource.CreateLayer('impact', geom_type=ogr.wkbPoint)
+        layer.CreateField(ogr.FieldDefn('affected', ogr.OFTInteger))
+        if population:
+            layer.CreateField(ogr.FieldDefn('population', ogr.OFTReal))
+        for affected, count in features:
+            feature = ogr.Feature(layer.GetLayerDefn())
+            feature.SetField('affected', affected)
+            if population:
+                feature.SetField('population', count)
+            feature.SetGeometry(
+                ogr.CreateGeometryFromWkt('POINT (106.8 -6.2)'))
+            layer.CreateFeature(feature)
+        datasource = None
+        self.addCleanup(driver.DeleteDataSource, path)
+        return path
+
+    def test_classified_raster(self):
+        # the last chunk of rows is shorter than the others
+        path = self.raster(
+            [[0, 1, 1, 2],
+             [255, 0, 1, 1],
+             [2, 2, 255, 0]], gdal.GDT_Byte, 255)
+        engine = FakeSummaryEngine(path, chunk_rows=2)
+        self.assertEqual(
+            dict(engine.raster_class_totals(path)), {0: 3, 1: 4, 2: 3})
+
+    def test_population_raster(self):
+        path = self.raster(
+            [[1.5, 2.5, -1],
+             [float('nan'), 4.0, 0.0]], gdal.GDT_Float32, -1)
+        engine = FakeSummaryEngine(path, chunk_rows=1)
+        self.assertEqual(engine.impact_data(), {
+            'exposure': 'population',
+            'impact summary': {
+                'attributes': ['category', 'value'],
+                'fields': [
+                    ['Affected', 8.0],
+                    ['Total affected population', 8.0],
+                    ['Total population', 8.0],
+                ]
+            }
+        })
+
+    def test_vector_population(self):
+        path = self.vector([(0, 10.0), (1, 20.0), (1, 5.5), (0, 1.0)])
+        engine = FakeSummaryEngine(path, batch_size=3)
+        self.assertEqual(
+            dict(engine.vector_class_totals(path)),
+            {'0': 11.0, '1': 25.5})
+
+    def test_vector_count(self):
+        path = self.vector([(0, None), (1, None), (1, None)],
+                           population=False)
+        engine = FakeSummaryEngine(path, exposure='structure')
+        self.assertEqual(engine.impact_data()['impact summary']['fields'], [
+            ['0', 1],
+            ['1', 2],
+            ['Affected buildings', 2],
+            ['Total', 3],
+        ])
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'geosafe-tests',
+    }
+})
+class CreateImportJobTest(TestCase):
+
+    endpoint = 'http://example.com/geoserver/wfs'
+    bbox = [106.7, -6.3, 106.9, -6.1]
+
+    def create(self, bbox=None):
+        return create_import_job(
+            'WFS', self.endpoint, 'geonode:jakarta_flood', '1.0.0',
+            bbox=bbox or self.bbox, title='Jakarta flood')
+
+    def test_new_job(self):
+        job, created = self.create()
+        self.assertTrue(created)
+        self.assertEqual(job.state, ImportJob.STATE_PENDING)
+        self.assertEqual(job.host, 'example.com')
+        self.assertEqual(job.active_key, job.request_key)
+
+    def test_identical_pending_import(self):
+        job, _ = self.create()
+        existing, created = self.create()
+        self.assertFalse(created)
+        self.assertEqual(existing.id, job.id)
+        self.assertEqual(ImportJob.objects.count(), 1)
+
+    def test_other_bbox(self):
+        job, _ = self.create()
+        other, created = self.create(bbox=[95.0, -11.0, 141.0, 6.0])
+        self.assertTrue(created)
+        self.assertNotEqual(other.id, job.id)
+
+    def test_finished_import(self):
+        job, _ = self.create()
+        finish_import_job(job, error=IOError('Connection refused'))
+        again, created = self.create()
+        self.assertTrue(created)
+        self.assertNotEqual(again.id, job.id)
+        self.assertEqual(again.request_key, job.request_key)
@@ -9,10 +9,10 @@ from geosafe.views.analysis import (
     AnalysisListView,
     AnalysisCreateView,
     AnalysisDetailView,
-    impact_function_filter,
+    impact_function_filter, impact_function_filter_result,
     layer_tiles, layer_metadata, layer_archive, layer_list, rerun_analysis,
     analysis_json, toggle_analysis_saved, download_report, layer_panel,
-    analysis_summary)
+    analysis_summary, export_analyses, layer_search, analysis_history)
 
 urlpatterns = patterns(
     '',
@@ -31,6 +31,11 @@ urlpatterns = patterns(
         impact_function_filter,
         name='impact-function-filter'
     ),
+    url(
+        r'^geosafe/analysis/impact-function-filter/(?P<token>[\w-]+)$',
+        impact_function_filter_result,
+        name='impact-function-filter-result'
+    ),
     url(
         r'^geosafe/analysis/(?P<pk>\d+)$',
         AnalysisDetailView.as_view(),
@@ -59,6 +64,11 @@ urlpatterns = patterns(
         layer_list,
         name='layer-list'
     ),
+    url(
+        r'^geosafe/analysis/layer-search$',
+        layer_search,
+        name='layer-search'
+    ),
     url(
         r'^geosafe/analysis/layer-panel'
         r'(?:/(?P<bbox>[\[\],.\d-]*))?',
@@ -90,6 +100,16 @@ urlpatterns = patterns(
         download_report,
         name='download-report'
     ),
+    url(
+        r'^geosafe/analysis/history$',
+        analysis_history,
+        name='analysis-history'
+    ),
+    url(
+        r'^geosafe/analysis/export$',
+        export_analyses,
+        name='analysis-export'
+    ),
     url(
         r'^geosafe/analysis/summary/'
         r'(?P<impact_id>[-\d]+)/',
@@ -108,11 +128,21 @@ urlpatterns = patterns(
         metasearch.csw_ajax,
         name='metasearch_csw_ajax'
     ),
+    url(
+        r'^geosafe/metasearch/csw_federated_stream$',
+        metasearch.csw_federated_stream,
+        name='metasearch_csw_federated_stream'
+    ),
     url(
         r'^geosafe/metasearch/add_layer$',
         metasearch.add_layer,
         name='metasearch_add_layer'
     ),
+    url(
+        r'^geosafe/metasearch/import_job/(?P<job_id>\d+)$',
+        metasearch.import_job_json,
+        name='metasearch_import_job'
+    ),
     url(
         r'^geosafe/metasearch/add_layer_dialog',
         metasearch.show_add_layer_dialog,
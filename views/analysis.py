@@ -2,31 +2,51 @@ import json
 
 import os
 import logging
-import tempfile
-from zipfile import ZipFile
+from urllib import urlencode
 
+from celery.exceptions import TimeoutError
 from django.conf import settings
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
-from django.db.models.expressions import F
+from django.db import transaction
 from django.db.models.query_utils import Q
+from django.http import Http404
 from django.http.response import HttpResponseServerError, HttpResponse, \
-    HttpResponseBadRequest, HttpResponseRedirect
+    HttpResponseBadRequest, HttpResponseRedirect, JsonResponse, \
+    StreamingHttpResponse
 from django.shortcuts import render
 from django.views.generic import (
     ListView, CreateView, DetailView)
 
+from guardian.shortcuts import get_objects_for_user
+
 from geosafe.helpers.impact_summary.polygon_people_summary import \
     PolygonPeopleSummary
-from geosafe.helpers.impact_summary.summary_base import ImpactSummary
+from geosafe.helpers.impact_summary.summary_base import (
+    ImpactSummary, load_impact_data)
+from geosafe.helpers.analysis_export import AnalysisExport
+from geosafe.helpers.analysis_history import AnalysisHistory, InvalidCursor
+from geosafe.helpers.circuit_breaker import CircuitOpen
+from geosafe.helpers.headless_cache import (
+    HeadlessUnavailable, cached_result, collect_task_result,
+    last_known_result, submit_task)
+from geosafe.helpers.layer_search import (
+    InvalidSearch, LayerSearch, bbox_intersects, normalize_bbox)
+from geosafe.helpers.impact_function_catalogue import (
+    compatible_impact_functions, layer_category)
 
 from geonode.layers.models import Layer
-from geosafe.forms import (AnalysisCreationForm)
+from geonode.people.models import Profile
+from geosafe.forms import (
+    AnalysisCreationForm, AnalysisExportForm, AnalysisHistoryForm)
 from geosafe.helpers.impact_summary.population_summary import \
     PopulationSummary
 from geosafe.helpers.impact_summary.road_summary import RoadSummary
 from geosafe.helpers.impact_summary.structure_summary import StructureSummary
+from geosafe.helpers.zip_stream import ZipStream, field_file_entry
 from geosafe.models import Analysis, Metadata
 from geosafe.signals import analysis_post_save
+from geosafe.tasks.analysis import render_analysis_report
 from geosafe.tasks.headless.analysis import filter_impact_function
 
 LOGGER = logging.getLogger("geosafe")
@@ -58,41 +78,16 @@ def retrieve_layers(purpose, category=None, bbox=None):
     if not category:
         category = None
     if bbox:
-        bbox = json.loads(bbox)
-        # normalize bbox
-        if bbox[2] < bbox[0]:
-            temp = bbox[0]
-            bbox[0] = bbox[2]
-            bbox[2] = temp
-        if bbox[3] < bbox[1]:
-            temp = bbox[1]
-            bbox[1] = bbox[3]
-            bbox[3] = temp
-        intersect = (
-            Q(layer__bbox_x0__lte=bbox[2]) &
-            Q(layer__bbox_x1__gte=bbox[0]) &
-            Q(layer__bbox_y0__lte=bbox[3]) &
-            Q(layer__bbox_y1__gte=bbox[1]) &
-            Q(layer__bbox_x0__lte=F('layer__bbox_x1')) &
-            Q(layer__bbox_y0__lte=F('layer__bbox_y1'))
-        ) | (
-            # in case of swapped value
-            Q(layer__bbox_x0__lte=bbox[2]) &
-            Q(layer__bbox_x1__gte=bbox[0]) &
-            Q(layer__bbox_y0__gte=bbox[1]) &
-            Q(layer__bbox_y1__lte=bbox[3]) &
-            Q(layer__bbox_x0__lte=F('layer__bbox_x1')) &
-            Q(layer__bbox_y1__lte=F('layer__bbox_y0'))
-        )
+        intersect = bbox_intersects(normalize_bbox(bbox))
         metadatas = Metadata.objects.filter(
             Q(layer_purpose=purpose),
             Q(category=category),
             intersect
-        )
+        ).select_related('layer')
         layer_count = Metadata.objects.filter(
             layer_purpose=purpose,
             category=category).count()
-        if len(metadatas) == layer_count:
+        if metadatas.count() == layer_count:
             # it means unfiltered by bbox
             is_filtered = False
         else:
@@ -100,11 +95,67 @@ def retrieve_layers(purpose, category=None, bbox=None):
             is_filtered = True
     else:
         metadatas = Metadata.objects.filter(
-            layer_purpose=purpose, category=category)
+            layer_purpose=purpose, category=category).select_related('layer')
         is_filtered = False
     return [m.layer for m in metadatas], is_filtered
 
 
+def panel_layers(purpose, category=None, bbox=None):
+    """First page of layers of an options panel list.
+
+    The rest of the list is loaded from the layer search API, from the
+    url returned with the page.
+
+    :param purpose: InaSAFE layer purpose
+    :type purpose: str
+
+    :param category: InaSAFE layer category
+    :type category: str
+
+    :param bbox: Layer bbox to filter
+    :type bbox: (float, float, float, float)
+
+    :return: dict of layers, list of dict of id and title, total number
+        of layers, whether the bbox filters out layers, and url of the
+        next page, None on the last page
+    :rtype: dict
+    """
+    limit = getattr(settings, 'GEOSAFE_LAYER_PANEL_SIZE', 20)
+    search = LayerSearch(
+        purpose=purpose,
+        category=category,
+        bbox=bbox,
+        fields=['id', 'title'],
+        limit=limit)
+    page = search.page()
+    total = search.queryset().count()
+    is_filtered = False
+    if bbox:
+        unfiltered = LayerSearch(purpose=purpose, category=category)
+        is_filtered = unfiltered.queryset().count() != total
+
+    next_url = None
+    if page['next']:
+        params = {
+            'purpose': purpose,
+            'fields': 'id,title',
+            'limit': limit,
+            'after': page['next'],
+        }
+        if category:
+            params['category'] = category
+        if bbox:
+            params['bbox'] = json.dumps(search.bbox)
+        next_url = '%s?%s' % (
+            reverse('geosafe:layer-search'), urlencode(params))
+    return {
+        'layers': page['results'],
+        'total': total,
+        'is_filtered': is_filtered,
+        'next_url': next_url,
+    }
+
+
 class AnalysisCreateView(CreateView):
     model = Analysis
     form_class = AnalysisCreationForm
@@ -152,40 +203,42 @@ class AnalysisCreateView(CreateView):
             categories = []
             is_section_filtered = False
             for idx, c in enumerate(p.get('categories')):
-                layers, is_filtered = retrieve_layers(p.get('name'), c, bbox=bbox)
-                if is_filtered:
+                layers = panel_layers(p.get('name'), c, bbox=bbox)
+                if layers['is_filtered']:
                     is_section_filtered = True
                 category = {
                     'name': c,
-                    'layers': layers,
-                    'total_layers': len(layers),
+                    'layers': layers['layers'],
+                    'total_layers': layers['total'],
+                    'next_url': layers['next_url'],
                     'filter_status': (
-                        'filtered' if is_filtered else 'unfiltered'),
+                        'filtered' if layers['is_filtered']
+                        else 'unfiltered'),
                     'list_title': p.get('list_titles')[idx]
                 }
                 categories.append(category)
             section = {
                 'name': p.get('name'),
                 'total_layers': sum(
-                    [len(c['layers']) for c in categories]),
+                    [c['total_layers'] for c in categories]),
                 'filter_status': (
                     'filtered' if is_section_filtered else 'unfiltered'),
                 'categories': categories
             }
             sections.append(section)
 
-        impact_layers, is_filtered = retrieve_layers('impact', bbox=bbox)
-        total_impact_layers = len(impact_layers)
+        impact_layers = panel_layers('impact', bbox=bbox)
         sections.append({
             'name': 'impact',
-            'total_layers': total_impact_layers,
+            'total_layers': impact_layers['total'],
             'filter_status': (
-                'filtered' if is_filtered else 'unfiltered'),
+                'filtered' if impact_layers['is_filtered'] else 'unfiltered'),
             'categories': [
                 {
                     'name': 'impact',
-                    'layers': impact_layers,
-                    'total_layers': total_impact_layers,
+                    'layers': impact_layers['layers'],
+                    'total_layers': impact_layers['total'],
+                    'next_url': impact_layers['next_url'],
                 }
             ]
         })
@@ -244,14 +297,43 @@ class AnalysisCreateView(CreateView):
 
 
 class AnalysisListView(ListView):
+    """History of analyses, newest first, one page at a time.
+
+    The user URL argument restricts the list to analyses of that user, and
+    the after GET parameter is the cursor of the page.
+    """
     model = Analysis
     template_name = 'geosafe/analysis/list.html'
     context_object_name = 'analysis_list'
-    queryset = Analysis.objects.all().order_by("-impact_layer__date")
+
+    def get_queryset(self):
+        analyses = Analysis.objects.all()
+        if self.kwargs.get('user'):
+            analyses = analyses.filter(user_id=self.kwargs['user'])
+        try:
+            history = AnalysisHistory(
+                analyses, after=self.request.GET.get('after'))
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
+        analysis_list, self.next_cursor = history.objects()
+        return analysis_list
 
     def get_context_data(self, **kwargs):
         context = super(AnalysisListView, self).get_context_data(**kwargs)
-        context.update({'user': self.request.user})
+        if self.request.user.username:
+            current_user = self.request.user
+        else:
+            current_user = Profile.objects.get(username='AnonymousUser')
+        next_url = None
+        if self.next_cursor:
+            next_url = '%s?%s' % (
+                self.request.path, urlencode({'after': self.next_cursor}))
+        context.update({
+            'user': self.request.user,
+            'current_user_id': current_user.id,
+            'filtered_user': self.kwargs.get('user'),
+            'next_url': next_url,
+        })
         return context
 
 
@@ -262,11 +344,16 @@ class AnalysisDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super(AnalysisDetailView, self).get_context_data(**kwargs)
+        self.object.touch()
         return context
 
 
 def impact_function_filter(request):
     """Ajax Request for filtered available IF
+
+    Answers from the local catalogue or the cache when possible. Otherwise
+    InaSAFE Headless is asked without waiting, and the answer is 202 with
+    the url to poll for the result.
     """
     if request.method != 'GET':
         return HttpResponseBadRequest()
@@ -282,20 +369,74 @@ def impact_function_filter(request):
         exposure_layer = Layer.objects.get(id=exposure_id)
         hazard_layer = Layer.objects.get(id=hazard_id)
 
-        hazard_url = Analysis.get_layer_url(hazard_layer)
-        exposure_url = Analysis.get_layer_url(exposure_layer)
+        impact_functions = compatible_impact_functions(
+            layer_category(hazard_layer), layer_category(exposure_layer))
+
+        if impact_functions is None:
+            # category pair not in the catalogue yet
+            args = (
+                Analysis.get_layer_url(hazard_layer),
+                Analysis.get_layer_url(exposure_layer))
+            layer_ids = [hazard_layer.id, exposure_layer.id]
+            impact_functions = cached_result(
+                filter_impact_function.name, args, layer_ids=layer_ids)
+
+            if impact_functions is None:
+                try:
+                    token = submit_task(
+                        filter_impact_function, args, layer_ids=layer_ids)
+                except CircuitOpen as e:
+                    impact_functions = last_known_result(
+                        filter_impact_function.name, args, e)
+                else:
+                    return impact_function_pending(token)
+
+        return HttpResponse(
+            json.dumps(impact_functions), content_type="application/json")
+    except HeadlessUnavailable as e:
+        LOGGER.warning(e)
+        return JsonResponse(
+            {'error': 'InaSAFE Headless is not available'}, status=503)
+    except Exception as e:
+        LOGGER.exception(e)
+        return HttpResponseServerError()
+
 
-        async_result = filter_impact_function.delay(
-            hazard_url,
-            exposure_url)
+def impact_function_pending(token):
+    """Answer that the IF list is being resolved.
 
-        impact_functions = async_result.get()
+    :param token: token of the headless task
+    :type token: str
+    """
+    return JsonResponse({
+        'token': token,
+        'poll_url': reverse(
+            'geosafe:impact-function-filter-result',
+            kwargs={'token': token})
+    }, status=202)
+
+
+def impact_function_filter_result(request, token):
+    """Ajax Request polling for IF list resolved by InaSAFE Headless
+    """
+    if request.method != 'GET':
+        return HttpResponseBadRequest()
 
+    try:
+        ready, impact_functions = collect_task_result(token)
+        if not ready:
+            return impact_function_pending(token)
         return HttpResponse(
             json.dumps(impact_functions), content_type="application/json")
+    except KeyError:
+        raise Http404('Unknown impact function request')
+    except HeadlessUnavailable as e:
+        LOGGER.warning(e)
+        return JsonResponse(
+            {'error': 'InaSAFE Headless is not available'}, status=503)
     except Exception as e:
         LOGGER.exception(e)
-        raise HttpResponseServerError()
+        return HttpResponseServerError()
 
 
 def layer_tiles(request):
@@ -357,16 +498,13 @@ def layer_archive(request, layer_id):
 
     try:
         layer = Layer.objects.get(id=layer_id)
-        tmp = tempfile.mktemp()
-        with ZipFile(tmp, mode='w') as zf:
-            for layer_file in layer.upload_session.layerfile_set.all():
-                base_name = os.path.basename(layer_file.file.name)
-                zf.writestr(
-                    base_name,
-                    layer_file.file.read())
-
-        with open(tmp) as f:
-            return HttpResponse(f.read(), content_type='application/zip')
+        Analysis.mark_accessed(impact_layer_id=layer.id)
+        entries = [
+            field_file_entry(
+                os.path.basename(layer_file.file.name), layer_file.file)
+            for layer_file in layer.upload_session.layerfile_set.all()]
+        return StreamingHttpResponse(
+            ZipStream(entries), content_type='application/zip')
 
     except Exception as e:
         LOGGER.exception(e)
@@ -419,6 +557,43 @@ def layer_list(request, layer_purpose, layer_category=None, bbox=None):
         return HttpResponseServerError()
 
 
+def layer_search(request):
+    """Ajax request searching layers for typeahead inputs.
+
+    Query parameters are q, match (prefix or full), purpose, category,
+    bbox (JSON list), fields (comma separated), limit, and after, the
+    cursor returned with the previous page.
+    """
+    if request.method != 'GET':
+        return HttpResponseBadRequest()
+
+    fields = request.GET.get('fields')
+    try:
+        search = LayerSearch(
+            query=request.GET.get('q'),
+            match=request.GET.get('match') or 'prefix',
+            purpose=request.GET.get('purpose'),
+            category=request.GET.get('category'),
+            bbox=request.GET.get('bbox'),
+            fields=fields.split(',') if fields else None,
+            after=request.GET.get('after'),
+            limit=request.GET.get('limit'))
+    except InvalidSearch as e:
+        return HttpResponseBadRequest(str(e))
+
+    try:
+        page = search.page()
+        if page['next']:
+            params = request.GET.copy()
+            params['after'] = page['next']
+            page['next_url'] = '%s?%s' % (
+                request.path, params.urlencode())
+        return JsonResponse(page)
+    except Exception as e:
+        LOGGER.exception(e)
+        return HttpResponseServerError()
+
+
 def layer_panel(request, bbox=None):
     if request.method != 'GET':
         return HttpResponseBadRequest()
@@ -427,8 +602,6 @@ def layer_panel(request, bbox=None):
         sections = AnalysisCreateView.options_panel_dict(bbox=bbox)
         form = AnalysisCreationForm(
             user=request.user,
-            exposure_layer=retrieve_layers('exposure', bbox=bbox)[0],
-            hazard_layer=retrieve_layers('hazard', bbox=bbox)[0],
             impact_functions=Analysis.impact_function_list())
         context = {
             'sections': sections,
@@ -518,6 +691,125 @@ def serve_files(file_stream, content_type, filename):
     return response
 
 
+def serve_zip_stream(entries, filename):
+    """Stream a zip archive, built while it is sent.
+
+    :param entries: members of the archive
+    :type entries: list(ZipStreamEntry)
+    """
+    response = StreamingHttpResponse(
+        ZipStream(entries),
+        content_type='application/zip')
+    response['Content-Disposition'] = 'inline; filename="%s";' % filename
+    return response
+
+
+def report_task_key(task_id):
+    return 'geosafe.report_task.%s' % task_id
+
+
+def report_task_lost(result):
+    """Check if a report task will never finish.
+
+    A task whose result expired from the result backend, or whose message
+    was lost, stays PENDING forever.
+
+    :param result: the report task result
+    :type result: AsyncResult
+
+    :rtype: bool
+    """
+    return (
+        result.state == 'PENDING' and
+        cache.get(report_task_key(result.task_id)) is None)
+
+
+def wait_for_reports(analysis, timeout=None):
+    """Render the reports of an analysis if needed and wait for them.
+
+    The first request starts a report rendering task, later requests wait
+    on the same task. A new task is started if the previous one crashed or
+    was lost, but not if it recorded that no report can be rendered.
+
+    :param analysis: the analysis
+    :type analysis: Analysis
+
+    :param timeout: seconds to wait, default GEOSAFE_REPORT_WAIT_TIMEOUT
+    :type timeout: int
+
+    :return: report task state, SUCCESS if the reports are available
+    :rtype: str
+    """
+    if analysis.has_reports():
+        return 'SUCCESS'
+    if analysis.report_error:
+        # rendering again would give the same result
+        return 'FAILURE'
+
+    with transaction.atomic():
+        locked = Analysis.objects.select_for_update().get(id=analysis.id)
+        if locked.has_reports():
+            return 'SUCCESS'
+        if locked.report_error:
+            return 'FAILURE'
+        result = locked.get_report_task_result()
+        if result is None or report_task_lost(result) or result.state in [
+                'SUCCESS', 'FAILURE', 'REVOKED']:
+            # reports are missing, a task that crashed or was lost needs
+            # to run again
+            result = render_analysis_report.delay(locked.id)
+            cache.set(
+                report_task_key(result.task_id),
+                1,
+                getattr(settings, 'GEOSAFE_REPORT_TASK_TIMEOUT', 3600))
+            Analysis.objects.filter(id=locked.id).update(
+                report_task_id=result.task_id)
+
+    if timeout is None:
+        timeout = getattr(settings, 'GEOSAFE_REPORT_WAIT_TIMEOUT', 5)
+    try:
+        result.get(timeout=timeout, propagate=False)
+    except TimeoutError:
+        return result.state
+
+    analysis.refresh_from_db()
+    if analysis.has_reports():
+        return 'SUCCESS'
+    return 'FAILURE'
+
+
+def report_pending_response(request, analysis, state):
+    """Answer a report download while the report is not available.
+
+    Ajax clients get the task state as JSON, browsers get a page polling
+    the same url until the report is served.
+
+    :param analysis: the analysis
+    :type analysis: Analysis
+
+    :param state: report task state
+    :type state: str
+
+    :rtype: HttpResponse
+    """
+    failed = state == 'FAILURE'
+    status = 500 if failed else 202
+    if request.is_ajax():
+        return JsonResponse({'state': state}, status=status)
+    context = {
+        'state': state,
+        'failed': failed,
+        'error': analysis.report_error,
+        'retry_url': request.get_full_path(),
+        'retry_after': getattr(settings, 'GEOSAFE_REPORT_POLL_INTERVAL', 5)
+    }
+    return render(
+        request,
+        'geosafe/analysis/report_pending.html',
+        context,
+        status=status)
+
+
 def download_report(request, analysis_id, data_type='map'):
     """Download the pdf files of the analysis
 
@@ -536,7 +828,14 @@ def download_report(request, analysis_id, data_type='map'):
 
     try:
         analysis = Analysis.objects.get(id=analysis_id)
+        analysis.touch()
         layer_title = analysis.impact_layer.title
+        if data_type in ['map', 'table', 'reports', 'all']:
+            state = wait_for_reports(analysis)
+            if state != 'SUCCESS':
+                # failed, the next request tries again, or still rendering
+                return report_pending_response(request, analysis, state)
+
         if data_type == 'map':
             return serve_files(
                 analysis.report_map.read(),
@@ -548,39 +847,30 @@ def download_report(request, analysis_id, data_type='map'):
                 'application/pdf',
                 '%s_table.pdf' % layer_title)
         elif data_type == 'reports':
-            tmp = tempfile.mktemp()
-            with ZipFile(tmp, mode='w') as zf:
-                zf.writestr(
-                    '%s_map.pdf' % layer_title,
-                    analysis.report_map.read())
-                zf.writestr(
-                    '%s_table.pdf' % layer_title,
-                    analysis.report_table.read())
-
-            return serve_files(
-                open(tmp),
-                'application/zip',
+            entries = [
+                field_file_entry(
+                    '%s_map.pdf' % layer_title, analysis.report_map),
+                field_file_entry(
+                    '%s_table.pdf' % layer_title, analysis.report_table),
+            ]
+            return serve_zip_stream(
+                entries,
                 '%s_reports.zip' % layer_title)
         elif data_type == 'all':
-            tmp = tempfile.mktemp()
-            with ZipFile(tmp, mode='w') as zf:
-                zf.writestr(
-                    '%s_map.pdf' % layer_title,
-                    analysis.report_map.read())
-                zf.writestr(
-                    '%s_table.pdf' % layer_title,
-                    analysis.report_table.read())
-                layer = analysis.impact_layer
-
-                for layer_file in layer.upload_session.layerfile_set.all():
-                    base_name = os.path.basename(layer_file.file.name)
-                    zf.writestr(
-                        base_name.replace(layer.name, layer.title),
-                        layer_file.file.read())
-
-            return serve_files(
-                open(tmp),
-                'application/zip',
+            entries = [
+                field_file_entry(
+                    '%s_map.pdf' % layer_title, analysis.report_map),
+                field_file_entry(
+                    '%s_table.pdf' % layer_title, analysis.report_table),
+            ]
+            layer = analysis.impact_layer
+            for layer_file in layer.upload_session.layerfile_set.all():
+                base_name = os.path.basename(layer_file.file.name)
+                entries.append(field_file_entry(
+                    base_name.replace(layer.name, layer.title),
+                    layer_file.file))
+            return serve_zip_stream(
+                entries,
                 '%s_download.zip' % layer_title)
 
         return HttpResponseServerError()
@@ -589,6 +879,91 @@ def download_report(request, analysis_id, data_type='map'):
         return HttpResponseServerError()
 
 
+def downloadable_analyses(user, analyses):
+    """Analyses whose files a user may download.
+
+    These are the analyses of the user, and the analyses whose impact layer
+    the user has download permission on.
+
+    :param user: the requesting user
+    :type user: Profile
+
+    :param analyses: analyses to filter
+    :type analyses: QuerySet
+
+    :rtype: QuerySet
+    """
+    if user.is_superuser:
+        return analyses
+    resources = get_objects_for_user(
+        user, 'base.download_resourcebase').values('id')
+    condition = Q(impact_layer_id__in=resources)
+    if user.is_authenticated():
+        condition |= Q(user=user)
+    return analyses.filter(condition)
+
+
+def export_analyses(request):
+    """Download reports and impact layers of many analyses as one zip.
+
+    Analyses are filtered by the GET parameters of AnalysisExportForm:
+    user, date_from, date_to, hazard_layer and keep. Only analyses the
+    user may download are exported.
+    """
+    if request.method != 'GET':
+        return HttpResponseBadRequest()
+
+    form = AnalysisExportForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(
+            json.dumps(form.errors), content_type='application/json')
+
+    try:
+        analyses = downloadable_analyses(
+            request.user, form.filter(Analysis.objects.all()))
+        export = AnalysisExport(analyses)
+        return serve_zip_stream(export.entries(), 'analyses_export.zip')
+    except Exception as e:
+        LOGGER.exception(e)
+        return HttpResponseServerError()
+
+
+def analysis_history(request):
+    """Ajax request listing analyses, newest first, one page at a time.
+
+    Analyses are filtered by the GET parameters of AnalysisHistoryForm:
+    user, state, hazard_layer, exposure_layer and keep. The after
+    parameter is the cursor returned with the previous page.
+    """
+    if request.method != 'GET':
+        return HttpResponseBadRequest()
+
+    form = AnalysisHistoryForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(
+            json.dumps(form.errors), content_type='application/json')
+
+    try:
+        history = AnalysisHistory(
+            form.filter(Analysis.objects.all()),
+            after=form.cleaned_data.get('after'),
+            limit=form.cleaned_data.get('limit'))
+    except InvalidCursor as e:
+        return HttpResponseBadRequest(str(e))
+
+    try:
+        page = history.page()
+        if page['next']:
+            params = request.GET.copy()
+            params['after'] = page['next']
+            page['next_url'] = '%s?%s' % (
+                request.path, params.urlencode())
+        return JsonResponse(page)
+    except Exception as e:
+        LOGGER.exception(e)
+        return HttpResponseServerError()
+
+
 def analysis_summary(request, impact_id):
     """Get analysis summary from a given impact id"""
 
@@ -597,22 +972,27 @@ def analysis_summary(request, impact_id):
 
     try:
         analysis = Analysis.objects.get(impact_layer__id=impact_id)
+        analysis.touch()
         report_type = None
-        summary = ImpactSummary(analysis.impact_layer)
-        if 'building' in summary.exposure_type():
+        summary_class = ImpactSummary
+        impact_data = load_impact_data(analysis.impact_layer)
+        exposure_type = impact_data.get('exposure') or ''
+        if 'building' in exposure_type:
             report_type = 'structure'
-            summary = StructureSummary(analysis.impact_layer)
-        elif 'population' in summary.exposure_type():
+            summary_class = StructureSummary
+        elif 'population' in exposure_type:
             report_type = 'population'
-            summary = PopulationSummary(analysis.impact_layer)
-        elif 'polygon people' in summary.exposure_type():
+            summary_class = PopulationSummary
+        elif 'polygon people' in exposure_type:
             report_type = 'polygon_people'
-            summary = PolygonPeopleSummary(analysis.impact_layer)
-        elif 'road' in summary.exposure_type():
+            summary_class = PolygonPeopleSummary
+        elif 'road' in exposure_type:
             report_type = 'road'
-            summary = RoadSummary(analysis.impact_layer)
-        elif 'landcover' in summary.exposure_type():
+            summary_class = RoadSummary
+        elif 'landcover' in exposure_type:
             report_type = 'landcover'
+        summary = summary_class(
+            analysis.impact_layer, impact_data=impact_data)
 
         context = {
             'analysis': analysis,
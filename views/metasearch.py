@@ -4,23 +4,38 @@ import os
 
 import shutil
 import logging
-import urllib
 import urlparse
 
-from django.http.response import HttpResponse, HttpResponseServerError, JsonResponse
+from django.http.response import HttpResponse, HttpResponseServerError, \
+    JsonResponse, StreamingHttpResponse, HttpResponseBadRequest
 from django.shortcuts import render
-from owslib.iso import MD_Metadata
 from owslib.wcs import WebCoverageService
 
 from geonode.layers.utils import file_upload
-from geosafe.tasks.analysis import download_file
 from owslib import fes
-from owslib.csw import CatalogueServiceWeb, CswRecord
+from owslib.csw import CswRecord
 
 from geosafe.forms import MetaSearchForm
+from geosafe.models import ImportJob
 from geosafe.tasks import metasearch
 
-from geosafe.helpers.metasearch.csw_helper import csw_query_metadata_by_id
+from geosafe.helpers.metasearch.csw_helper import (
+    csw_query_metadata_by_id,
+    csw_pool,
+    csw_search_records)
+from geosafe.helpers.metasearch.federated import (
+    catalogue_credentials,
+    federated_search)
+from geosafe.helpers.metasearch.harvest import search_harvested_records
+from geosafe.helpers.metasearch.import_jobs import (
+    create_import_job,
+    schedule_import_jobs,
+    store_job_credentials)
+from geosafe.helpers.metasearch.record_cache import record_cache
+from geosafe.helpers.metasearch.wfs_proxy import (
+    WFSProxy,
+    decompress_stream,
+    parse_bbox)
 
 __author__ = 'Rizky Maulana Nugraha <lana.pcfre@gmail.com>'
 
@@ -35,12 +50,14 @@ def index(request, *args, **kwargs):
         form = MetaSearchForm(request.POST)
         if form.is_valid():
             url = form.cleaned_data['csw_url']
+            federated = form.cleaned_data['federated']
             user = form.cleaned_data['user']
             password = form.cleaned_data['password']
             keywords = form.cleaned_data['keywords']
 
             # set session
             request.session['csw_url'] = url
+            request.session['federated'] = federated
             request.session['user'] = user
             request.session['password'] = password
             request.session['keywords'] = keywords
@@ -50,6 +67,7 @@ def index(request, *args, **kwargs):
     else:
         form = MetaSearchForm({
             'csw_url': request.session.get('csw_url'),
+            'federated': request.session.get('federated'),
             'user': request.session.get('user'),
             'password': request.session.get('password'),
             'keywords': request.session.get('keywords')
@@ -58,6 +76,7 @@ def index(request, *args, **kwargs):
 
     context = {
         'form': form,
+        'federated': request.session.get('federated'),
         'result': result
     }
     return render(request, template, context)
@@ -69,43 +88,31 @@ def csw_ajax(request, *args, **kwargs):
         user = request.session['user']
         password = request.session['password']
         keywords = request.session['keywords']
-        keywords_query = [fes.PropertyIsLike(
-            'csw:AnyText', '%%%s%%' % keywords)]
         if not csw_url:
             return HttpResponseServerError()
 
         try:
-            csw = CatalogueServiceWeb(
+            offset = int(request.GET['offset'])
+            per_page = int(request.GET['perPage'])
+            # answer from local index if the catalogue is harvested
+            page = search_harvested_records(
                 csw_url,
-                username=user,
-                password=password)
-            result = csw.identification.type
-            if result == 'CSW':
-                page = int(request.GET['page'])
-                offset = int(request.GET['offset'])
-                per_page = int(request.GET['perPage'])
-                csw.getrecords2(
-                    typenames='gmd:MD_Metadata',
-                    esn='full',
-                    outputschema='http://www.isotc211.org/2005/gmd',
-                    constraints=keywords_query,
-                    startposition=offset,
-                    maxrecords=per_page)
-                result = []
-                for key in csw.records:
-                    rec = csw.records[key]
-                    res = {}
-                    if isinstance(rec, MD_Metadata):
-                        res['id'] = rec.identifier
-                        res['title'] = rec.identification.title
-                        res['inasafe_keywords'] = rec.identification.supplementalinformation
-                        if res['inasafe_keywords']:
-                            res['inasafe_layer'] = '<inasafe_keywords/>' in res['inasafe_keywords']
-                        result.append(res)
+                keywords,
+                offset,
+                per_page,
+                username=user)
+            if page is None:
+                page = csw_search_records(
+                    csw_url,
+                    keywords,
+                    offset,
+                    per_page,
+                    username=user,
+                    password=password)
             json_result = {
-                'records': result,
-                'queryRecordCount': csw.results['matches'],
-                'totalRecordCount': csw.results['matches']
+                'records': page['records'],
+                'queryRecordCount': page['matches'],
+                'totalRecordCount': page['matches']
             }
             return JsonResponse(json_result, safe=False)
         except Exception as e:
@@ -115,83 +122,124 @@ def csw_ajax(request, *args, **kwargs):
     return HttpResponseServerError()
 
 
+def csw_federated_stream(request, *args, **kwargs):
+    """Stream search results of every configured catalogue.
+
+    The response is newline delimited JSON, one line per catalogue, sent as
+    soon as the catalogue responds.
+    """
+    if request.method == 'GET':
+        keywords = request.GET.get(
+            'keywords', request.session.get('keywords'))
+        try:
+            offset = int(request.GET.get('offset', 0))
+            per_page = int(request.GET.get('perPage', 10))
+        except ValueError:
+            return HttpResponseBadRequest()
+
+        def stream():
+            for result in federated_search(keywords, offset, per_page):
+                yield json.dumps(result) + '\n'
+
+        return StreamingHttpResponse(
+            stream(), content_type='application/x-ndjson')
+
+    return HttpResponseServerError()
+
+
+def find_service_record(records):
+    """Find the first record referring to a WCS or WFS service.
+
+    The record is annotated with type and endpoint of the service.
+
+    :param records: records with references attribute
+    :type records: list
+
+    :return: the record, None if no record refers to a service
+    """
+    for rec in records:
+        for ref in rec.references:
+            if 'OGC:WCS' in ref['scheme']:
+                rec.type = 'WCS'
+                rec.endpoint = ref['url']
+                return rec
+            if 'OGC:WFS' in ref['scheme']:
+                rec.type = 'WFS'
+                rec.endpoint = ref['url']
+                return rec
+    return None
+
+
 def show_add_layer_dialog(request, *args, **kwargs):
     if request.method == 'POST':
-        csw_url = request.session['csw_url']
-        user = request.session['user']
-        password = request.session['password']
+        csw_url = request.POST.get('csw_url') or request.session['csw_url']
+        user, password = catalogue_credentials(csw_url, request.session)
         layer_id = request.POST['layer_id']
         try:
-            csw = CatalogueServiceWeb(
-                csw_url,
-                username=user,
-                password=password)
-            constraints = [
-                fes.PropertyIsEqualTo(
-                    'dc:identifier', layer_id)
-            ]
-            result = csw.identification.type
-            if result == 'CSW':
+            # use record fetched by search results if it refers to service
+            record = None
+            cached_record = record_cache.get_service_record(
+                csw_url, layer_id, username=user, password=password)
+            if cached_record:
+                record = find_service_record([cached_record])
+
+            if not record:
+                csw = csw_pool.get(
+                    csw_url,
+                    username=user,
+                    password=password)
+                constraints = [
+                    fes.PropertyIsEqualTo(
+                        'dc:identifier', layer_id)
+                ]
+                if csw.identification.type != 'CSW':
+                    return HttpResponseServerError()
                 csw.getrecords2(constraints=constraints)
-                record = None
-                for key in csw.records:
-                    rec = csw.records[key]
-                    for ref in rec.references:
-                        if 'OGC:WCS' in ref['scheme']:
-                            rec.type = 'WCS'
-                            rec.endpoint = ref['url']
-                            record = rec
+                record = find_service_record(csw.records.values())
+
+            if record.type == 'WCS':
+                # get describe coverage
+                # find coverage id from references
+                coverage_id = None
+                version = None
+                for ref in record.references:
+                    if 'service=WCS' in ref['url']:
+                        url = ref['url']
+                        parse_result = urlparse.urlparse(url)
+                        query = parse_result.query
+                        query_dict = urlparse.parse_qs(query)
+                        coverage_id = query_dict['coverageid'][0]
+                        version = query_dict['version'][0]
+                        if coverage_id and version:
                             break
-                        if 'OGC:WFS' in ref['scheme']:
-                            rec.type = 'WFS'
-                            rec.endpoint = ref['url']
-                            record = rec
+                record.service_id = coverage_id
+                record.service_version = version
+            elif record.type == 'WFS':
+                typename = None
+                version = None
+                for ref in record.references:
+                    if 'service=WFS' in ref['url']:
+                        url = ref['url']
+                        parse_result = urlparse.urlparse(url)
+                        query = parse_result.query
+                        query_dict = urlparse.parse_qs(query)
+                        typename = query_dict['typename'][0]
+                        version = query_dict['version'][0]
+                        if typename and version:
                             break
-                    if record:
-                        break
-
-                if record.type == 'WCS':
-                    # get describe coverage
-                    # find coverage id from references
-                    coverage_id = None
-                    version = None
-                    for ref in record.references:
-                        if 'service=WCS' in ref['url']:
-                            url = ref['url']
-                            parse_result = urlparse.urlparse(url)
-                            query = parse_result.query
-                            query_dict = urlparse.parse_qs(query)
-                            coverage_id = query_dict['coverageid'][0]
-                            version = query_dict['version'][0]
-                            if coverage_id and version:
-                                break
-                    record.service_id = coverage_id
-                    record.service_version = version
-                elif record.type == 'WFS':
-                    typename = None
-                    version = None
-                    for ref in record.references:
-                        if 'service=WFS' in ref['url']:
-                            url = ref['url']
-                            parse_result = urlparse.urlparse(url)
-                            query = parse_result.query
-                            query_dict = urlparse.parse_qs(query)
-                            typename = query_dict['typename'][0]
-                            version = query_dict['version'][0]
-                            if typename and version:
-                                break
-
-                    record.service_id = typename
-                    record.service_version = version
-                #     wcs = WebCoverageService(record.endpoint)
-                #     result = wcs.getDescribeCoverage(coverage_id)
-                context = {
-                    'record': record
-                }
-                return render(
-                    request,
-                    'geosafe/metasearch/modal/add_layer.html',
-                    context)
+
+                record.service_id = typename
+                record.service_version = version
+            #     wcs = WebCoverageService(record.endpoint)
+            #     result = wcs.getDescribeCoverage(coverage_id)
+            context = {
+                'record': record,
+                'csw_url': csw_url
+            }
+            return render(
+                request,
+                'geosafe/metasearch/modal/add_layer.html',
+                context)
         except Exception as e:
             return HttpResponseServerError()
     return HttpResponseServerError()
@@ -199,9 +247,8 @@ def show_add_layer_dialog(request, *args, **kwargs):
 
 def show_metadata(request, *args, **kwargs):
     if request.method == 'GET':
-        csw_url = request.session['csw_url']
-        user = request.session['user']
-        password = request.session['password']
+        csw_url = request.GET.get('csw_url') or request.session['csw_url']
+        user, password = catalogue_credentials(csw_url, request.session)
         layer_id = request.GET['layer_id']
         try:
             record = csw_query_metadata_by_id(
@@ -231,9 +278,8 @@ def add_layer(request, *args, **kwargs):
     if request.method == 'POST':
         endpoint = request.POST['endpoint']
         type = request.POST['type']
-        csw_url = request.session['csw_url']
-        user = request.session['user']
-        password = request.session['password']
+        csw_url = request.POST.get('csw_url') or request.session['csw_url']
+        user, password = catalogue_credentials(csw_url, request.session)
         identifier = request.POST['identifier']
         service_id = request.POST['service_id']
         service_version = request.POST['service_version']
@@ -246,65 +292,90 @@ def add_layer(request, *args, **kwargs):
             maxx, maxy
         ]
         try:
-            record = csw_query_metadata_by_id(
-                csw_url,
-                identifier,
-                username=user,
-                password=password)
-            metadata_string = record.xml if record else None
-            if type == 'WCS':
-                metasearch.add_wcs_layer.delay(
-                    endpoint,
-                    service_version,
-                    service_id,
-                    metadata_string=metadata_string,
-                    bbox=bbox,
-                    user=user, password=password)
-            elif type == 'WFS':
-                # bbox = (
-                #     float(minx), float(miny),
-                #     float(maxx), float(maxy)
-                # )
-                metasearch.add_wfs_layer.delay(
-                    endpoint,
-                    service_version,
-                    service_id,
-                    metadata_string=metadata_string,
-                    bbox=bbox,
-                    user=user, password=password)
+            if type not in ['WCS', 'WFS']:
+                return HttpResponseBadRequest()
+            job, created = create_import_job(
+                type,
+                endpoint,
+                service_id,
+                service_version,
+                bbox=bbox,
+                csw_url=csw_url,
+                identifier=identifier,
+                title=request.POST.get('title'),
+                user=request.user)
+            if created:
+                store_job_credentials(job, user, password)
+                schedule_import_jobs(metasearch.dispatch_import_job)
             result['success'] = True
+            result['duplicate'] = not created
+            result['job_id'] = job.id
         except Exception as e:
-            pass
+            LOGGER.exception(e)
     return HttpResponse(
         json.dumps(result), content_type='application/json')
 
 
+def import_job_json(request, job_id, *args, **kwargs):
+    """Report state and transfer progress of an import job."""
+    try:
+        job = ImportJob.objects.get(id=job_id)
+    except ImportJob.DoesNotExist:
+        return HttpResponseBadRequest()
+
+    result = {
+        'id': job.id,
+        'state': job.state,
+        'service_type': job.service_type,
+        'service_id': job.service_id,
+        'host': job.host,
+        'bytes_transferred': job.bytes_transferred,
+        'transfer_rate': job.transfer_rate(),
+        'layer_id': job.layer_id,
+        'layer_url': job.layer.get_absolute_url() if job.layer else None,
+        'error': job.error,
+    }
+    return JsonResponse(result)
+
+
 def wfs_proxy(request, *args, **kwargs):
+    """Proxy WFS GeoJSON of a feature type for map preview.
+
+    Optional parameters: bbox (minx,miny,maxx,maxy) to limit the features,
+    and zoom to snap bbox to tiles and simplify geometries for that zoom.
+    """
     if request.method == 'GET':
         endpoint = request.GET['endpoint']
         typename = request.GET['typename']
         user = request.session['user']
         password = request.session['password']
+        try:
+            bbox = parse_bbox(request.GET.get('bbox'))
+            zoom = request.GET.get('zoom')
+            proxy = WFSProxy(
+                endpoint,
+                typename,
+                bbox=bbox,
+                zoom=int(zoom) if zoom else None,
+                user=user,
+                password=password)
+        except ValueError:
+            return HttpResponseBadRequest()
+
+        try:
+            body = proxy.stream()
+        except Exception as e:
+            LOGGER.exception(e)
+            return HttpResponseServerError()
 
-        endpoint_parsed = urlparse.urlparse(endpoint)
-        q_dict = {
-            'version': '1.0.0',
-            'typename': typename,
-            'outputFormat': 'json',
-            'request': 'GetFeature',
-            'service': 'WFS',
-            'srsName': 'EPSG:4326',
-        }
-        parsed_url = urlparse.ParseResult(
-            scheme=endpoint_parsed.scheme,
-            netloc=endpoint_parsed.netloc,
-            path=endpoint_parsed.path,
-            params=None,
-            query=urllib.urlencode(q_dict),
-            fragment=None
-        )
-        LOGGER.info('Proxy to url: %s' % parsed_url.geturl())
-        tmpfile = download_file(parsed_url.geturl(), user=user, password=password)
-        with open(tmpfile) as f:
-            return HttpResponse(f.read(), content_type='application/json')
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if 'gzip' in accept_encoding:
+            response = StreamingHttpResponse(
+                body, content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = StreamingHttpResponse(
+                decompress_stream(body), content_type='application/json')
+        response['Vary'] = 'Accept-Encoding'
+        return response
     return HttpResponseServerError()